@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Reports encode speed and output bitrate for every encoding profile
+
+Encodes each sample with each profile and prints the frames encoded per
+second of wall clock time and the bitrate of the result. Without samples a
+synthetic 1080x1920 clip is generated with testsrc and sine. Needs ffmpeg.
+
+TEST_CMD:
+python3 benchmarks/bench_profiles.py backgrounds/subway.mp4 -l 20
+"""
+import os
+import tempfile
+from argparse import ArgumentParser
+from subprocess import run, DEVNULL
+from time import time
+
+from four_horsemen.probe import probe
+from four_horsemen.profiles import PROFILES, get_encoder_args
+
+
+def main():
+    """
+    Main function for the benchmark
+    """
+    args = get_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        samples = args.samples or [make_sample(os.path.join(tmp, 'sample.mp4'), args.length)]
+
+        print(f'{"sample":<24} {"profile":<10} {"fps":>8} {"bitrate":>12} {"size":>9}')
+        for sample in samples:
+            for profile in args.profiles:
+                output = os.path.join(tmp, f'{profile}.mp4')
+                fps, bitrate, size = encode(sample, output, profile, args.length, args.threads)
+
+                print(f'{os.path.basename(sample)[:24]:<24} {profile:<10} {fps:8.1f}'
+                      f' {bitrate / 1000:8.0f}kb/s {size / 1e6:7.1f}MB')
+
+
+def get_args():
+    """
+    Gets the cli arguments for the benchmark
+    """
+    args = ArgumentParser()
+    args.add_argument('samples', help='Videos to encode (a synthetic clip when empty)', nargs='*')
+    args.add_argument('-p', '--profiles', help='Profiles to compare', default=list(PROFILES),
+                      choices=PROFILES, nargs='+')
+    args.add_argument('-l', '--length', help='Seconds of each sample to encode', default=20, type=float)
+    args.add_argument('-t', '--threads', help='Threads given to ffmpeg (0 lets ffmpeg decide)', default=0, type=int)
+
+    return args.parse_args()
+
+
+def make_sample(path: str, length: float) -> str:
+    """
+    Creates a synthetic portrait clip with audio
+    """
+    run([
+        'ffmpeg', '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=duration={length}:size=1080x1920:rate=30',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={length}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '10', '-c:a', 'aac', '-shortest',
+        path,
+    ], check=True)
+
+    return path
+
+
+def encode(sample: str, output: str, profile: str, length: float, threads: int) -> tuple:
+    """
+    Encodes a sample with a profile
+
+    Returns (frames per second, bitrate in bits per second, size in bytes)
+    """
+    start = time()
+    run([
+        'ffmpeg', '-y', '-v', 'error', '-t', str(length), '-i', sample,
+        *get_encoder_args(profile, threads),
+        output,
+    ], check=True, stdout=DEVNULL)
+    elapsed = time() - start
+
+    info = probe(output)
+    size = os.path.getsize(output)
+
+    return info.duration * info.fps / elapsed, size * 8 / info.duration, size
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Compares filter graph trimming against input seeking on a long background
+
+Generates a synthetic background with ffmpeg's testsrc and times pulling a
+short window from deep inside it both ways. Needs ffmpeg on the PATH.
+
+TEST_CMD:
+python3 benchmarks/bench_seek.py -d 1800 -l 15
+"""
+import os
+from argparse import ArgumentParser
+from subprocess import run, DEVNULL
+from time import time
+
+from four_horsemen.utils import get_seek_args
+
+
+def main():
+    """
+    Main function for the benchmark
+    """
+    args = get_args()
+
+    background = os.path.join(args.tmp, f'seek_{args.duration}s_{args.size}.mp4')
+    if not os.path.isfile(background):
+        make_background(background, args.duration, args.size)
+
+    print(f'{"offset":>8} {"trim":>10} {"fast seek":>10} {"accurate":>10}')
+    for fraction in args.offsets:
+        start = fraction * (args.duration - args.length)
+        trim = time_command(get_trim_command(background, start, args.length), args.repeat)
+        fast = time_command(get_seek_command(background, start, args.length, False), args.repeat)
+        accurate = time_command(get_seek_command(background, start, args.length, True), args.repeat)
+
+        print(f'{start:7.0f}s {trim:9.2f}s {fast:9.2f}s {accurate:9.2f}s')
+
+
+def get_args():
+    """
+    Gets the cli arguments for the benchmark
+    """
+    args = ArgumentParser()
+    args.add_argument('-d', '--duration', help='Length of the generated background in seconds', default=1800, type=int)
+    args.add_argument('-s', '--size', help='Size of the generated background', default='1920x1080')
+    args.add_argument('-l', '--length', help='Length of the window to pull out', default=15, type=float)
+    args.add_argument('-r', '--repeat', help='Runs per measurement (best is kept)', default=3, type=int)
+    args.add_argument('-o', '--offsets', help='Where the window starts as a fraction of the background',
+                      default=[0.1, 0.5, 0.9], type=float, nargs='+')
+    args.add_argument('-t', '--tmp', help='Where to keep the generated background', default='tmp')
+
+    return args.parse_args()
+
+
+def make_background(path: str, duration: int, size: str):
+    """
+    Creates a synthetic background video
+    """
+    print(f'Generating a {duration}s {size} background at {path}')
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    run([
+        'ffmpeg', '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc=duration={duration}:size={size}:rate=30',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '250',
+        path,
+    ], check=True)
+
+
+def get_trim_command(background: str, start: float, length: float) -> list:
+    """
+    Pulls the window out with a trim inside the filter graph (the old way)
+    """
+    return [
+        'ffmpeg', '-v', 'error', '-i', background,
+        '-filter_complex', f'[0:v]trim=start={start}:duration={length},setpts=PTS-STARTPTS[v]',
+        '-map', '[v]', '-f', 'null', '-',
+    ]
+
+
+def get_seek_command(background: str, start: float, length: float, accurate: bool) -> list:
+    """
+    Pulls the window out by seeking the input before it is opened
+    """
+    return [
+        'ffmpeg', '-v', 'error', *get_seek_args(start, length, accurate), '-i', background,
+        '-filter_complex', '[0:v]setpts=PTS-STARTPTS[v]',
+        '-map', '[v]', '-f', 'null', '-',
+    ]
+
+
+def time_command(command: list, repeat: int) -> float:
+    """
+    Gets the best wall clock time of a command
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time()
+        run(command, check=True, stdout=DEVNULL)
+        best = min(best, time() - start)
+
+    return best
+
+
+if __name__ == '__main__':
+    main()
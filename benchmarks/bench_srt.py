@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Times the SRT conversion on the bundled text.xml scaled up to long captions
+
+The paragraphs of text.xml are repeated (with shifted times) until the
+captions cover the requested number of hours.
+
+TEST_CMD:
+python3 benchmarks/bench_srt.py -x text.xml --hours 1 4 12
+"""
+import os
+import re
+import tempfile
+import tracemalloc
+from argparse import ArgumentParser
+from time import time
+
+from four_horsemen.srt import xml_to_srt, write_srt
+
+
+def main():
+    """
+    Main function for the benchmark
+    """
+    args = get_args()
+
+    with open(args.xml, 'r', encoding='utf-8') as f:
+        xml = f.read()
+
+    print(f'{"hours":>6} {"size":>9} {"xml_to_srt":>11} {"peak":>9} {"write_srt":>10} {"peak":>9}')
+    for hours in args.hours:
+        scaled = scale_xml(xml, hours * 3600 * 1000)
+
+        convert, convert_peak = measure(lambda: xml_to_srt(scaled))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'captions.xml')
+            with open(source, 'w', encoding='utf-8') as f:
+                f.write(scaled)
+
+            write, write_peak = measure(lambda: write_srt(source, os.path.join(tmp, 'captions.srt')))
+
+        print(f'{hours:6g} {len(scaled) / 1e6:7.1f}MB {convert:10.2f}s {convert_peak / 1e6:7.1f}MB'
+              f' {write:9.2f}s {write_peak / 1e6:7.1f}MB')
+
+
+def get_args():
+    """
+    Gets the cli arguments for the benchmark
+    """
+    args = ArgumentParser()
+    args.add_argument('-x', '--xml', help='Timedtext (format 3) xml to scale up', default='text.xml')
+    args.add_argument('--hours', help='Length of the scaled captions', default=[1, 4], type=float, nargs='+')
+
+    return args.parse_args()
+
+
+def scale_xml(xml: str, length: int) -> str:
+    """
+    Repeats the paragraphs of the xml until they cover `length` milliseconds
+    """
+    head, rest = xml.split('<body>', maxsplit=1)
+    body, tail = rest.rsplit('</body>', maxsplit=1)
+
+    times = [int(t) for t in re.findall(r'<p t="(\d+)"', body)]
+    period = max(times) + 10000 if times else 10000
+
+    shift = lambda offset: lambda match: f'<p t="{int(match.group(1)) + offset}"'
+    parts = [
+        re.sub(r'<p t="(\d+)"', shift(offset), body)
+        for offset in range(0, int(length), period)
+    ]
+
+    return f'{head}<body>{"".join(parts)}</body>{tail}'
+
+
+def measure(function) -> tuple:
+    """
+    Gets the wall clock time and peak traced memory of a function
+    """
+    tracemalloc.start()
+    start = time()
+    function()
+    elapsed = time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed, peak
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the hot paths of both generators on synthetic media
+
+Every input is generated locally (testsrc2 and sine for videos and audio,
+testsrc for images, text.xml scaled up for captions), so the suite runs
+offline. The cases are:
+
+- probe: uncached ffprobe of each synthetic video, headers and keyframes
+- family_guy: render_source on a synthetic source, clips per hour
+- multi_meme: create_video on synthetic images and create_batch on all of them, videos per hour
+- srt: xml_to_srt on timedtext scaled to several lengths
+- save: appending records to a RecordSink and the JobQueue, exporting them
+- layout: building the layout, filter graph and plan of many multi_meme videos
+
+The media cases need ffmpeg. Results are appended to a JSON Lines file with
+the commit they were measured on, and each case is compared against the
+latest result from a different commit so regressions stand out.
+
+TEST_CMD:
+python3 benchmarks/bench_suite.py -c srt save layout
+python3 benchmarks/bench_suite.py --durations 60 600 --sizes 1280x720 1920x1080
+"""
+import json
+import os
+import subprocess
+import tempfile
+from argparse import ArgumentParser
+from subprocess import run
+from time import time
+
+import numpy as np
+import pandas as pd
+
+from bench_srt import scale_xml
+from four_horsemen.backgrounds import BackgroundIndex
+from four_horsemen.download import LocalBackend
+from four_horsemen.family_guy import fetch_source, render_source
+from four_horsemen.jobs import JobQueue
+from four_horsemen.multi_meme import DIMENSIONS, NUM_IMAGES, REQUESTYPES, create_batch, create_video, \
+    get_filter_complex, get_post_layout, make_info
+from four_horsemen.probe import KEYFRAME_ARGS, KEYFRAME_TIMEOUT, run_ffprobe
+from four_horsemen.srt import xml_to_srt
+from four_horsemen.store import RecordSink
+
+CASES = ['probe', 'family_guy', 'multi_meme', 'srt', 'save', 'layout']
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    """
+    Main function for the benchmark
+    """
+    args = get_args()
+    commit = get_commit()
+    previous = get_previous(args.results, commit)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        media = args.media or os.path.join(tmp, 'media')
+        os.makedirs(media, exist_ok=True)
+
+        # The generators read tmp/ and audios/ relative to the working directory
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            for case in args.cases:
+                for name, params, seconds, throughput, unit in CASE_FUNCTIONS[case](args, media):
+                    results.append({
+                        'commit': commit, 'time': time(), 'case': case, 'name': name,
+                        'params': params, 'seconds': seconds, 'throughput': throughput, 'unit': unit,
+                    })
+                    print_result(results[-1], previous.get((case, name)))
+        finally:
+            os.chdir(cwd)
+
+    if args.results:
+        with open(args.results, 'a', encoding='utf-8') as file:
+            file.writelines(json.dumps(result) + '\n' for result in results)
+        print(f'Saved {len(results)} results for {commit} to {args.results}')
+
+
+def get_args():
+    """
+    Gets the cli arguments for the benchmark
+    """
+    args = ArgumentParser()
+    args.add_argument('-c', '--cases', help='Cases to run', default=CASES, choices=CASES, nargs='+')
+    args.add_argument('-d', '--durations', help='Lengths of the synthetic videos in seconds',
+                      default=[30, 120], type=int, nargs='+')
+    args.add_argument('-s', '--sizes', help='Sizes of the synthetic videos', default=['1280x720', '1920x1080'], nargs='+')
+    args.add_argument('-j', '--jobs', help='Clips or videos to render at once', default=2, type=int)
+    args.add_argument('-p', '--profile', help='Encoding profile for the render cases', default='draft')
+    args.add_argument('-n', '--records', help='Records written by the save case and videos laid out by the layout case', default=10000, type=int)
+    args.add_argument('-x', '--xml', help='Timedtext (format 3) xml for the srt case', default=os.path.join(ROOT, 'text.xml'))
+    args.add_argument('--hours', help='Lengths of the scaled captions', default=[1, 4], type=float, nargs='+')
+    args.add_argument('-m', '--media', help='Keeps the synthetic media in this directory between runs')
+    args.add_argument('-r', '--results', help='JSON Lines file results are appended to (empty to skip)',
+                      default=os.path.join(ROOT, 'benchmarks', 'results.jsonl'))
+
+    return args.parse_args()
+
+
+def get_commit() -> str:
+    """
+    Gets the commit being measured, marked dirty when there are local changes
+    """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+    return f'{commit}-dirty' if dirty else commit
+
+
+def get_previous(path: str, commit: str) -> dict:
+    """
+    Gets the latest result of every (case, name) measured on another commit
+    """
+    previous = {}
+    if not path or not os.path.isfile(path):
+        return previous
+
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if result.get('commit') != commit:
+                previous[(result['case'], result['name'])] = result
+
+    return previous
+
+
+def print_result(result: dict, previous: dict = None):
+    """
+    Prints a result next to the change from the previous commit
+    """
+    change = ''
+    if previous and previous.get('throughput'):
+        ratio = result['throughput'] / previous['throughput'] - 1
+        change = f'{ratio:+7.1%} vs {previous["commit"]}'
+
+    print(f'{result["case"]:<11} {result["name"]:<28} {result["seconds"]:9.3f}s'
+          f' {result["throughput"]:12.1f} {result["unit"]:<12} {change}')
+
+
+def make_video(media: str, duration: int, size: str) -> str:
+    """
+    Creates (or reuses) a synthetic video with audio
+    """
+    path = os.path.join(media, f'video_{duration}s_{size}.mp4')
+    if not os.path.isfile(path):
+        run([
+            'ffmpeg', '-y', '-v', 'error',
+            '-f', 'lavfi', '-i', f'testsrc2=duration={duration}:size={size}:rate=30',
+            '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '60', '-c:a', 'aac', '-shortest',
+            path,
+        ], check=True)
+
+    return path
+
+
+def make_audio(path: str, duration: int) -> str:
+    """
+    Creates (or reuses) a synthetic audio file
+    """
+    if not os.path.isfile(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        run(['ffmpeg', '-y', '-v', 'error', '-f', 'lavfi', '-i', f'sine=frequency=220:duration={duration}',
+             '-c:a', 'aac', path], check=True)
+
+    return path
+
+
+def make_image(path: str, size: str) -> str:
+    """
+    Creates (or reuses) a synthetic image
+    """
+    if not os.path.isfile(path):
+        run(['ffmpeg', '-y', '-v', 'error', '-f', 'lavfi', '-i', f'testsrc=size={size}',
+             '-frames:v', '1', path], check=True)
+
+    return path
+
+
+def bench_probe(args, media):
+    """
+    Times an uncached probe of every synthetic video
+    """
+    for duration in args.durations:
+        for size in args.sizes:
+            video = make_video(media, duration, size)
+            start = time()
+            run_ffprobe(video)
+            elapsed = time() - start
+
+            yield f'{duration}s_{size}', {'duration': duration, 'size': size}, elapsed, duration / elapsed, 'x realtime'
+
+            start = time()
+            run_ffprobe(video, KEYFRAME_ARGS, KEYFRAME_TIMEOUT)
+            elapsed = time() - start
+            yield f'{duration}s_{size}_keyframes', {'duration': duration, 'size': size}, elapsed, \
+                duration / elapsed, 'x realtime'
+
+
+def bench_family_guy(args, media):
+    """
+    Times render_source, the split_clip render, on a synthetic source of each length
+    """
+    backgrounds = os.path.join(media, 'backgrounds')
+    os.makedirs(backgrounds, exist_ok=True)
+    background = make_video(media, max(args.durations) + 120, '1920x1080')
+    if not os.path.exists(os.path.join(backgrounds, 'background.mp4')):
+        os.symlink(background, os.path.join(backgrounds, 'background.mp4'))
+    index = BackgroundIndex(backgrounds)
+
+    for duration in args.durations:
+        for size in args.sizes:
+            os.makedirs('tmp', exist_ok=True)
+            os.makedirs('output', exist_ok=True)
+            source = fetch_source('source', backend=LocalBackend(make_video(media, duration, size)))
+
+            start = time()
+            clips = render_source(source, length=min(90, duration), overlap=5, backgrounds=index,
+                                  output='output', jobs=args.jobs, profile=args.profile)
+            elapsed = time() - start
+
+            params = {'duration': duration, 'size': size, 'jobs': args.jobs, 'profile': args.profile}
+            yield f'{duration}s_{size}', params, elapsed, len(clips) / elapsed * 3600, 'clips/hour'
+
+
+def bench_multi_meme(args, media):
+    """
+    Times create_video on synthetic images for each number of images, then create_batch on all of them
+    """
+    background = make_video(media, 90, '1080x1920')
+    make_audio(os.path.join('audios', 'sine.m4a'), 90)
+    images = [make_image(os.path.join(media, f'image_{i}.png'), '1200x900') for i in range(max(NUM_IMAGES))]
+    os.makedirs('output', exist_ok=True)
+
+    for count in NUM_IMAGES:
+        info = {
+            'id': f'bench_{count}', 'subreddit': 'bench', 'category': 'top', 'images': images[:count],
+            'n': count, 'audio': 'sine.m4a', 'background': background, 'background_start': 10.0,
+            'speed': 1, 'length': 15,
+        }
+
+        start = time()
+        create_video(info, 'output', images=images[:count], profile=args.profile)
+        elapsed = time() - start
+
+        if not os.path.isfile(os.path.join('output', f'bench_{count}.mp4')):
+            raise RuntimeError(f'create_video made no video for {count} images')
+
+        yield f'{count}_images', {'images': count, 'profile': args.profile}, elapsed, 3600 / elapsed, 'videos/hour'
+
+    # The same videos rendered by one ffmpeg process, on consecutive windows of the background
+    batch = [
+        {'id': f'batch_{count}', 'images': images[:count], 'audio': 'sine.m4a', 'background': background,
+         'background_start': 10.0 + 15 * k, 'length': 15}
+        for k, count in enumerate(NUM_IMAGES)
+    ]
+
+    start = time()
+    create_batch(batch, 'output', images=[i['images'] for i in batch], profile=args.profile)
+    elapsed = time() - start
+
+    yield 'batch', {'videos': len(batch), 'profile': args.profile}, elapsed, len(batch) * 3600 / elapsed, 'videos/hour'
+
+
+def bench_srt(args, media):
+    """
+    Times xml_to_srt on the timedtext scaled to each length
+    """
+    with open(args.xml, 'r', encoding='utf-8') as file:
+        xml = file.read()
+
+    for hours in args.hours:
+        scaled = scale_xml(xml, hours * 3600 * 1000)
+
+        start = time()
+        xml_to_srt(scaled)
+        elapsed = time() - start
+
+        yield f'{hours:g}h', {'hours': hours, 'bytes': len(scaled)}, elapsed, len(scaled) / elapsed / 1e6, 'MB/s'
+
+
+def bench_save(args, media):
+    """
+    Times appending part records to the sink and the queue, and exporting them
+    """
+    records = [
+        {'id': f'video{i // 10}', 'title': 'Title', 'description': f'Part {i % 10 + 1}/10 of Title',
+         'part': i % 10 + 1, 'file_path': f'output/video{i // 10}_{i % 10}.mp4', 'uploaded': False}
+        for i in range(args.records)
+    ]
+
+    sink = RecordSink('info.jsonl', key='file_path')
+    start = time()
+    for record in records:
+        sink.append(record)
+    elapsed = time() - start
+    yield 'sink_append', {'records': args.records}, elapsed, args.records / elapsed, 'records/s'
+
+    start = time()
+    sink.export('info.csv')
+    elapsed = time() - start
+    yield 'sink_export_csv', {'records': args.records}, elapsed, args.records / elapsed, 'records/s'
+
+    queue = JobQueue('jobs.db')
+    sources = sorted({record['id'] for record in records})
+    queue.add_sources(sources)
+    for source in sources:
+        queue.set_parts(source, 'Title', 10)
+
+    start = time()
+    for record in records:
+        queue.finish_part(record['id'], record['part'] - 1, record['file_path'], record['description'])
+    elapsed = time() - start
+    queue.close()
+    yield 'queue_finish_part', {'records': args.records}, elapsed, args.records / elapsed, 'records/s'
+
+
+def bench_layout(args, media):
+    """
+    Times building the layout and filter graph of many multi_meme videos
+    """
+    videos = args.records
+    counts = [NUM_IMAGES[i % len(NUM_IMAGES)] for i in range(videos)]
+
+    start = time()
+    for count in counts:
+        get_post_layout(DIMENSIONS['imgs'], DIMENSIONS['imgs_center'], count)
+    elapsed = time() - start
+    yield 'get_post_layout', {'videos': videos}, elapsed, videos / elapsed, 'videos/s'
+
+    start = time()
+    for count in counts:
+        get_filter_complex({'images': [''] * count}, scaled=True)
+    elapsed = time() - start
+    yield 'get_filter_complex', {'videos': videos}, elapsed, videos / elapsed, 'videos/s'
+
+    frame = pd.DataFrame({'subreddit': [f'sub_{i % 50}' for i in range(videos)],
+                          'url': [f'https://i.redd.it/{i}.png' for i in range(videos)]})
+    per_category = max(1, videos // (50 * len(REQUESTYPES)))
+
+    start = time()
+    info = make_info(frame, StaticBackgrounds(), ['sine.m4a'], per_category, seed=0)
+    elapsed = time() - start
+    yield 'make_info', {'videos': len(info)}, elapsed, len(info) / elapsed, 'videos/s'
+
+
+class StaticBackgrounds:
+    """
+    Stands in for a BackgroundIndex so planning can be timed without probing videos
+    """
+
+    def sample_many(self, length, count, rng):
+        return np.full(count, 'background.mp4', dtype=object), rng.random(count) * 60
+
+
+CASE_FUNCTIONS = {
+    'probe': bench_probe,
+    'family_guy': bench_family_guy,
+    'multi_meme': bench_multi_meme,
+    'srt': bench_srt,
+    'save': bench_save,
+    'layout': bench_layout,
+}
+
+
+if __name__ == '__main__':
+    main()
@@ -2,28 +2,21 @@
 Uploads a Dhar mann video using a cron job (going to be run on desktop)
 
 Cron Tab: 0 0 0/3 * * * *
+
+Posts more than one video per run with --batch
 """
-import pandas as pd
-from os import system
+from four_horsemen.uploader import run, get_args
 
 COOKIES = "cookies.txt"
-INFO = "info.xslx"
-KEY = "uploaded"
+INFO = "info.jsonl"
+UPLOADS = "uploads.db"
 
 def main(): 
-    frame = pd.read_excel(INFO)
-    
-    # gets index of video
-    unposted = frame.loc[frame[KEY]==0]
-    
-    # TODO: Maybe write a bunch of files to my desktop to notify me that things have not been posted
+    args = get_args(__doc__)
 
-    index = uposted[0]
-
-    # gets the row from the data frame
-    video_info = frame.iloc[index]
+    # TODO: Maybe write a bunch of files to my desktop to notify me that things have not been posted
+    run(UPLOADS, INFO, COOKIES, batch=args.batch)
 
-    system(f"tiktok-uploader -v {video_info['file_path']} -description {video_info['description'] -c {COOKIES}")   
 
-    video_info[KEY] = True # Registers the video has been uploaded
-    frame.to_excel(INFO)
+if __name__ == "__main__":
+    main()
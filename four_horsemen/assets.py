@@ -0,0 +1,83 @@
+'''
+Pre-scaled image assets for the meme overlays
+
+Raw Reddit images are often multi-megapixel PNGs. Rather than scaling them
+inside every ffmpeg graph which uses them, each image is decoded and scaled
+once per cell size and the result is cached, so renders only composite small
+inputs which are already the right size.
+'''
+import os
+from hashlib import sha1
+from typing import List, Tuple
+
+from four_horsemen.cache import atomic_path, get_cache_dir
+from four_horsemen.process import ProcessError, run_ffmpeg
+
+ANIMATED_EXTENSIONS = ['gif']
+
+
+def prescale_images(paths: List[str], size: Tuple[int, int]) -> List[str]:
+    '''
+    Scales every image to fit inside `size`, see `prescale_image`
+    '''
+    return [prescale_image(path, size) for path in paths]
+
+
+def prescale_image(path: str, size: Tuple[int, int]) -> str:
+    '''
+    Scales an image to fit inside `size`, keeping its aspect ratio
+
+    The scaled copy is cached by the image's path, modification time and the
+    target size. Animated GIFs keep their animation and get their own palette.
+
+    Returns the path of the scaled image
+    '''
+    width, height = size
+    stat = os.stat(path)
+    ending = get_ending(path)
+
+    key = sha1(f'{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}'.encode('utf-8')).hexdigest()
+    scaled = os.path.join(get_cache_dir('assets'), f'{key}_{width}x{height}.{ending}')
+
+    if os.path.isfile(scaled):
+        return scaled
+
+    with atomic_path(scaled, f'.{ending}') as tmp_path:
+        command = [
+            'ffmpeg', '-y', '-v', 'error', '-i', path,
+            *get_scale_args(width, height, ending in ANIMATED_EXTENSIONS),
+            tmp_path,
+        ]
+
+        try:
+            run_ffmpeg(command)
+        except ProcessError as e:
+            raise AssetError(f'Failed to scale {path}: {e}') from e
+
+    return scaled
+
+
+def get_scale_args(width: int, height: int, animated: bool) -> List[str]:
+    '''
+    Gets the ffmpeg options which scale an image to fit inside width x height
+    '''
+    scale = f'scale={width}:{height}:force_original_aspect_ratio=decrease'
+
+    if animated:
+        return ['-filter_complex', f'[0:v]{scale},split[a][b];[a]palettegen[p];[b][p]paletteuse']
+
+    return ['-vf', scale, '-frames:v', '1']
+
+
+def get_ending(path: str) -> str:
+    '''
+    Gets the ending of the scaled copy, stills are stored as png
+    '''
+    ending = path.rsplit('.', maxsplit=1)[-1].lower()
+    return ending if ending in ANIMATED_EXTENSIONS else 'png'
+
+
+class AssetError(Exception):
+    '''
+    Raised when an image cannot be scaled
+    '''
@@ -0,0 +1,201 @@
+'''
+Index of the background videos both generators cut clips out of
+
+Every background is probed once and its duration, resolution, frame rate,
+codec and keyframe timestamps are kept in an index in the cache. Opening the
+index only probes the files which were added or changed since it was last
+saved, and forgets the ones which were removed.
+
+Clips are sampled from keyframe aligned windows which are guaranteed to fit
+inside the background, so fast seeking lands exactly on the chosen start and
+a background which is too short is never picked.
+
+When a generator is given, backgrounds are read from their proxies (see
+`four_horsemen.proxies`) wherever those are up to date.
+'''
+import os
+import random
+from bisect import bisect_right
+from hashlib import sha1
+from typing import List, NamedTuple, Tuple
+
+import numpy as np
+
+from four_horsemen.cache import get_cache_dir, read_meta, write_meta
+from four_horsemen.probe import ProbeError, probe
+from four_horsemen.proxies import VIDEO_EXTENSIONS, get_fresh_proxy
+
+INDEX_VERSION = 2 # bump when Background changes to rebuild every index
+
+
+class Background(NamedTuple):
+    '''
+    A probed background video
+    '''
+    path: str
+    duration: float
+    width: int
+    height: int
+    fps: float
+    codec: str
+    keyframes: Tuple[float, ...]
+
+
+class BackgroundIndex:
+    '''
+    The probed backgrounds of a directory
+
+    Parameters
+    ----------
+    directory: str
+        Directory holding the background videos
+    extensions: list
+        File extensions counted as videos
+    target: str
+        Generator whose proxies are used when they are up to date
+    '''
+
+    def __init__(self, directory: str, extensions: List[str] = VIDEO_EXTENSIONS, target: str = None):
+        self.directory = directory
+        self.extensions = extensions
+        self.target = target
+
+        key = sha1(f'{os.path.abspath(directory)}:{target}'.encode('utf-8')).hexdigest()
+        self.path = os.path.join(get_cache_dir('backgrounds'), f'{key}.json')
+
+        self.backgrounds = []
+        self.windows = {}
+        self.refresh()
+
+    def refresh(self) -> int:
+        '''
+        Probes the backgrounds added or changed since the index was saved
+
+        Returns the number of files probed
+        '''
+        index = read_meta(self.path)
+        saved = index.get('backgrounds', {}) if index.get('version') == INDEX_VERSION else {}
+
+        entries = {}
+        probed = 0
+        for name in sorted(os.listdir(self.directory)):
+            if name.split('.')[-1] not in self.extensions:
+                continue
+
+            path = os.path.join(self.directory, name)
+            if self.target:
+                path = get_fresh_proxy(path, self.target) or path
+
+            stat = os.stat(path)
+            entry = saved.get(name)
+
+            if entry is None or entry['path'] != path or entry['mtime'] != stat.st_mtime_ns \
+                    or entry['size'] != stat.st_size:
+                try:
+                    info = probe(path, keyframes=True)
+                except ProbeError as e:
+                    print(f'Skipping background {name}: {e}')
+                    continue
+
+                entry = {
+                    'path': path,
+                    'mtime': stat.st_mtime_ns,
+                    'size': stat.st_size,
+                    'duration': info.duration,
+                    'width': info.width,
+                    'height': info.height,
+                    'fps': info.fps,
+                    'codec': info.video_codec,
+                    'keyframes': list(info.keyframes),
+                }
+                probed += 1
+
+            entries[name] = entry
+
+        if probed or entries.keys() != saved.keys():
+            write_meta(self.path, {'version': INDEX_VERSION, 'backgrounds': entries})
+
+        self.backgrounds = [
+            Background(
+                entry['path'], entry['duration'], entry['width'], entry['height'],
+                entry['fps'], entry['codec'], tuple(entry['keyframes'])
+            )
+            for entry in entries.values()
+        ]
+        self.windows = {}
+
+        return probed
+
+    def get_windows(self, length: float) -> List[Tuple[Background, int]]:
+        '''
+        Gets the backgrounds long enough for a clip, each with how many of its
+        keyframes a clip can start on
+
+        Computed once per clip length
+        '''
+        if length not in self.windows:
+            windows = []
+            for background in self.backgrounds:
+                if background.duration < length:
+                    continue
+
+                starts = bisect_right(background.keyframes, background.duration - length)
+                windows.append((background, starts))
+
+            self.windows[length] = windows
+
+        return self.windows[length]
+
+    def sample(self, length: float, rng: random.Random = random) -> Tuple[str, float]:
+        '''
+        Picks a random background and a window of it which fits `length` seconds
+
+        The window starts on a keyframe, unless the background has none which
+        do not run past its end
+
+        Returns (background path, start in seconds)
+        '''
+        windows = self.get_windows(length)
+        if not windows:
+            raise BackgroundError(f'No background in {self.directory} is at least {length:.1f} seconds long')
+
+        background, starts = rng.choice(windows)
+        if starts:
+            return background.path, background.keyframes[rng.randrange(starts)]
+
+        return background.path, rng.random() * (background.duration - length)
+
+    def sample_many(self, length: float, count: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Picks `count` windows at once, drawn the same way as `sample`
+
+        Returns (array of background paths, array of starts in seconds)
+        '''
+        windows = self.get_windows(length)
+        if not windows:
+            raise BackgroundError(f'No background in {self.directory} is at least {length:.1f} seconds long')
+
+        paths = np.array([background.path for background, _ in windows], dtype=object)
+        durations = np.array([background.duration for background, _ in windows])
+        counts = np.array([starts for _, starts in windows])
+        # The keyframes every window can start on, one after the other
+        keyframes = np.array([t for background, starts in windows for t in background.keyframes[:starts]])
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+        picks = rng.integers(len(windows), size=count)
+        starts = rng.random(count) * (durations[picks] - length)
+
+        aligned = counts[picks] > 0
+        keyframe = offsets[picks] + (rng.random(count) * counts[picks]).astype(int)
+        starts[aligned] = keyframes[keyframe[aligned]]
+
+        return paths[picks], starts
+
+    def __len__(self) -> int:
+        return len(self.backgrounds)
+
+
+class BackgroundError(Exception):
+    '''
+    Raised when no background can fit a clip
+    '''
@@ -0,0 +1,246 @@
+'''
+On-disk caches shared between runs
+'''
+import json
+import os
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from hashlib import sha256
+from time import time
+from typing import Iterator
+from urllib.parse import urlparse
+
+CACHE_DIR = os.environ.get(
+    'FOUR_HORSEMEN_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'four_horsemen')
+)
+
+TIMEOUT = 40
+CHUNK_SIZE = 1 << 20
+MAX_CACHE_BYTES = 5 << 30
+EVICT_TO = 0.9 # evicts down to this fraction of the limit so it does not run on every download
+EVICT_GRACE = 3600 # seconds a file is protected from eviction after it was last used
+REVALIDATE_AFTER = 24 * 3600 # seconds before a cached file is checked against the server again
+
+
+def get_cache_dir(name: str) -> str:
+    '''
+    Gets (and creates) a named directory inside the cache
+    '''
+    path = os.path.join(CACHE_DIR, name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class MediaCache:
+    '''
+    Persistent cache of downloaded media, addressed by a hash of the url
+
+    Each file sits next to a small json file holding the url and the ETag /
+    Last-Modified validators it was served with, so stale entries are checked
+    with a conditional request instead of being downloaded again. The cache is
+    bounded in size and evicts the least recently used files first.
+
+    Files are written to a temporary name and renamed into place, so several
+    renders (threads or processes) can share the cache without ever reading a
+    partial file. Concurrent requests for the same url within a process wait
+    for a single download.
+    '''
+
+    def __init__(self, session, directory: str = None, max_bytes: int = MAX_CACHE_BYTES,
+                 revalidate_after: float = REVALIDATE_AFTER):
+        self.session = session
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.size = None
+
+    def get_path(self, url: str) -> str:
+        '''
+        Gets where a url is stored in the cache
+        '''
+        key = sha256(url.encode('utf-8')).hexdigest()
+        ending = os.path.splitext(urlparse(url).path)[1]
+        directory = os.path.join(self.directory or get_cache_dir('media'), key[:2])
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f'{key}{ending}')
+
+    def get(self, url: str) -> str:
+        '''
+        Gets the local path of a url, downloading it when needed
+
+        Returns None if the url could not be downloaded
+        '''
+        with self.lock:
+            future = self.in_flight.get(url)
+            owner = future is None
+            if owner:
+                future = self.in_flight[url] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            path = self.fetch(url)
+            future.set_result(path)
+            return path
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[url]
+
+    def fetch(self, url: str) -> str:
+        '''
+        Downloads a url into the cache unless a valid copy is already there
+        '''
+        path = self.get_path(url)
+        meta = read_meta(f'{path}.json')
+
+        if os.path.isfile(path) and meta:
+            if time() - meta.get('checked_at', 0) < self.revalidate_after:
+                os.utime(path)
+                return path
+
+            headers = {}
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        else:
+            headers = {}
+
+        response = self.session.get(url, headers=headers, timeout=TIMEOUT, stream=True)
+
+        if response.status_code == 304:
+            response.close()
+            write_meta(f'{path}.json', {**meta, 'checked_at': time()})
+            os.utime(path)
+            return path
+
+        if response.status_code != 200:
+            response.close()
+            print(f'Failed to download {url}')
+            # A stale copy is better than nothing when the server misbehaves
+            return path if os.path.isfile(path) else None
+
+        size = 0
+        with atomic_path(path) as tmp_path, open(tmp_path, 'wb') as file:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                file.write(chunk)
+                size += len(chunk)
+
+        write_meta(f'{path}.json', {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'checked_at': time(),
+        })
+
+        self.track(size)
+        return path
+
+    def track(self, size: int):
+        '''
+        Keeps track of the size of the cache, evicting when it grows too large
+        '''
+        with self.lock:
+            if self.size is None:
+                self.size = sum(os.path.getsize(path) for path, _ in self.entries())
+            else:
+                self.size += size
+
+            if self.size > self.max_bytes:
+                self.size = self.evict()
+
+    def entries(self):
+        '''
+        Yields every cached file with the time it was last used
+        '''
+        directory = self.directory or get_cache_dir('media')
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if name.endswith('.json') or name.endswith('.tmp'):
+                    continue
+
+                path = os.path.join(root, name)
+                try:
+                    yield path, os.path.getmtime(path)
+                except OSError:
+                    continue
+
+    def evict(self) -> int:
+        '''
+        Removes the least recently used files until the cache fits
+
+        Files used within the last EVICT_GRACE seconds are left alone, they
+        may be an input of a render which is still running
+
+        Returns the size of the cache afterwards
+        '''
+        entries = sorted(self.entries(), key=lambda entry: entry[1])
+        size = sum(os.path.getsize(path) for path, _ in entries)
+
+        for path, used in entries:
+            if size <= self.max_bytes * EVICT_TO or time() - used < EVICT_GRACE:
+                break
+
+            size -= os.path.getsize(path)
+            for remove in [path, f'{path}.json']:
+                try:
+                    os.remove(remove)
+                except OSError:
+                    pass
+
+        return size
+
+
+def read_meta(path: str) -> dict:
+    '''
+    Reads the json written next to a cached file
+    '''
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_meta(path: str, meta: dict):
+    '''
+    Writes the json next to a cached file
+    '''
+    with atomic_path(path) as tmp_path, open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(meta, file)
+
+
+@contextmanager
+def atomic_path(path: str, ending: str = '') -> Iterator[str]:
+    '''
+    Gets a temporary path which is moved to `path` once the block succeeds
+
+    Readers, including other threads and processes, never see half a file.
+    The temporary path is unique per thread and is removed if the block fails
+
+    Parameters
+    ----------
+    path: str
+        Where the file ends up
+    ending: str
+        Added to the temporary path, for tools which pick the format by extension
+    '''
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp{ending}'
+    try:
+        yield tmp_path
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    os.replace(tmp_path, path)
@@ -0,0 +1,301 @@
+'''
+Downloads the source videos family_guy splits
+
+A backend turns a video id into a local file. The `youtube` backend resolves
+the streams with pytube and fetches their bytes itself, the `local` backend
+copies the video from a directory or URL template, which also lets the whole
+pipeline run offline against a local HTTP server.
+
+URLs are fetched with several ranged requests at once. Progress is journaled
+next to the partial file, so an interrupted download picks up where it left
+off instead of starting over. Servers which do not support ranges are
+downloaded with a single request.
+'''
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import requests
+
+from four_horsemen.cache import read_meta, write_meta
+from four_horsemen.process import ProcessError, run_ffmpeg
+from four_horsemen.utils import RETRIES, TIMEOUT, get_with_backoff
+
+CONNECTIONS = 4 # ranged requests made at once for a single file
+CHUNK_SIZE = 8 << 20 # bytes fetched by each ranged request
+READ_SIZE = 1 << 20
+MIN_HEIGHT = 810 # the source is cropped to 4:3 and scaled to 1080x810
+PART_ENDING = '.part'
+JOURNAL_ENDING = '.part.json'
+
+
+class Video(NamedTuple):
+    '''
+    A downloaded source video
+    '''
+    title: str
+    captions: dict
+
+
+class YouTubeBackend:
+    '''
+    Resolves streams with pytube and downloads them with ranged requests
+
+    The lowest resolution which still fills the output is picked. When only an
+    adaptive (video only) stream is tall enough, its audio is downloaded too
+    and both are muxed without re-encoding.
+    '''
+
+    def __init__(self, connections: int = CONNECTIONS, min_height: int = MIN_HEIGHT):
+        self.connections = connections
+        self.min_height = min_height
+
+    def download(self, video_id: str, path: str) -> Video:
+        '''
+        Downloads a video to `path`
+        '''
+        from pytube import YouTube
+
+        yt = YouTube(f'https://www.youtube.com/watch?v={video_id}')
+        streams = yt.streams.filter(type='video', subtype='mp4')
+        stream = pick_stream(list(streams), self.min_height)
+
+        if stream is None:
+            raise DownloadError(f'No mp4 stream found for video {video_id}')
+
+        if not stream.is_progressive:
+            audio = yt.streams.filter(only_audio=True, subtype='mp4').order_by('abr').desc().first()
+            if audio is None:
+                # Without an audio stream to mux, only a progressive stream has sound
+                stream = pick_stream([stream for stream in streams if stream.is_progressive], self.min_height)
+                if stream is None:
+                    raise DownloadError(f'No mp4 audio stream found for video {video_id}')
+
+        print(f'Downloading {video_id} at {stream.resolution}')
+
+        if stream.is_progressive:
+            fetch_url(stream.url, path, self.connections)
+        else:
+            fetch_url(stream.url, f'{path}.video', self.connections)
+            fetch_url(audio.url, f'{path}.audio', self.connections)
+            mux(f'{path}.video', f'{path}.audio', path)
+
+        return Video(yt.title, yt.captions)
+
+
+class LocalBackend:
+    '''
+    Copies videos from a directory or URL template holding `{id}`
+
+    Meant for testing the pipeline offline, the video id is used as the title
+    '''
+
+    def __init__(self, source: str, connections: int = CONNECTIONS):
+        self.source = source
+        self.connections = connections
+
+    def download(self, video_id: str, path: str) -> Video:
+        '''
+        Downloads (or copies) a video to `path`
+        '''
+        source = self.source.format(id=video_id)
+
+        if source.startswith(('http://', 'https://')):
+            fetch_url(source, path, self.connections)
+        else:
+            shutil.copyfile(source, path)
+
+        return Video(video_id, {})
+
+
+BACKENDS = {
+    'youtube': YouTubeBackend,
+    'local': LocalBackend,
+}
+
+
+def get_backend(name: str = 'youtube', source: str = None, connections: int = CONNECTIONS):
+    '''
+    Creates a download backend by name
+
+    Parameters
+    ----------
+    name: str
+        One of BACKENDS
+    source: str
+        Directory or URL template of the videos, for the local backend
+    connections: int
+        Ranged requests made at once for a single file
+    '''
+    if name == 'local':
+        if not source:
+            raise DownloadError('The local backend needs a source, such as videos/{id}.mp4')
+        return LocalBackend(source, connections)
+
+    return YouTubeBackend(connections)
+
+
+def pick_stream(streams: list, min_height: int = MIN_HEIGHT):
+    '''
+    Picks the lowest resolution stream which is at least `min_height` tall
+
+    Progressive streams win ties as they need no separate audio. Without a tall
+    enough stream the tallest one is picked.
+    '''
+    streams = [stream for stream in streams if get_height(stream)]
+    if not streams:
+        return None
+
+    tall = [stream for stream in streams if get_height(stream) >= min_height]
+    if tall:
+        return min(tall, key=lambda stream: (get_height(stream), not stream.is_progressive))
+
+    return max(streams, key=lambda stream: (get_height(stream), stream.is_progressive))
+
+
+def get_height(stream) -> int:
+    '''
+    Gets the height of a pytube stream from its resolution (720p -> 720)
+    '''
+    try:
+        return int((stream.resolution or '').rstrip('p'))
+    except ValueError:
+        return 0
+
+
+def fetch_url(url: str, path: str, connections: int = CONNECTIONS, chunk_size: int = CHUNK_SIZE):
+    '''
+    Downloads a url to `path`, resuming a previous attempt when possible
+
+    The file is split into chunks which are fetched by `connections` ranged
+    requests at once and written straight into place in `path.part`. Finished
+    chunks are recorded in `path.part.json`, and `path` only appears once the
+    whole file is there.
+    '''
+    size = get_size(url)
+
+    if size is None:
+        fetch_whole(url, path)
+        return
+
+    part = path + PART_ENDING
+    journal_path = path + JOURNAL_ENDING
+    journal = read_meta(journal_path)
+
+    # A journal for a different file is useless, the download starts over
+    if journal.get('size') != size or journal.get('chunk_size') != chunk_size or not os.path.isfile(part):
+        journal = {'size': size, 'chunk_size': chunk_size, 'done': []}
+        with open(part, 'wb') as file:
+            file.truncate(size)
+        write_meta(journal_path, journal)
+
+    done = set(journal['done'])
+    chunks = [i for i in range((size + chunk_size - 1) // chunk_size) if i not in done]
+    if done:
+        print(f'Resuming {os.path.basename(path)}, {len(done)} chunks already downloaded')
+
+    lock = threading.Lock()
+
+    def fetch(chunk: int):
+        start = chunk * chunk_size
+        end = min(start + chunk_size, size) - 1
+        fetch_range(url, part, start, end)
+
+        with lock:
+            done.add(chunk)
+            write_meta(journal_path, {'size': size, 'chunk_size': chunk_size, 'done': sorted(done)})
+
+    with ThreadPoolExecutor(max_workers=max(1, connections)) as pool:
+        for future in [pool.submit(fetch, chunk) for chunk in chunks]:
+            future.result()
+
+    os.replace(part, path)
+    os.remove(journal_path)
+
+
+def get_size(url: str):
+    '''
+    Gets the size of the file at a url, or None when the server does not support ranges
+    '''
+    response = get_with_backoff(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=TIMEOUT)
+    response.close()
+
+    if response.status_code != 206:
+        response.raise_for_status()
+        return None
+
+    # Content-Range: bytes 0-0/12345
+    try:
+        return int(response.headers['Content-Range'].rsplit('/', 1)[1])
+    except (KeyError, ValueError, IndexError):
+        return None
+
+
+def fetch_range(url: str, part: str, start: int, end: int):
+    '''
+    Downloads bytes start..end (inclusive) of a url into the same place in `part`
+
+    Retried when the connection drops or the server sends the wrong amount
+    '''
+    for attempt in range(RETRIES + 1):
+        try:
+            response = get_with_backoff(url, headers={'Range': f'bytes={start}-{end}'},
+                                        stream=True, timeout=TIMEOUT)
+            if response.status_code != 206:
+                raise DownloadError(f'Expected a partial response for {url}, got {response.status_code}')
+
+            written = 0
+            with open(part, 'r+b') as file:
+                file.seek(start)
+                for data in response.iter_content(READ_SIZE):
+                    file.write(data)
+                    written += len(data)
+
+            if written != end - start + 1:
+                raise DownloadError(f'Got {written} of {end - start + 1} bytes from {url}')
+
+            return
+        except (requests.RequestException, DownloadError) as e:
+            if attempt == RETRIES:
+                raise DownloadError(f'Failed to download bytes {start}-{end} of {url}: {e}') from e
+
+
+def fetch_whole(url: str, path: str):
+    '''
+    Downloads a url with a single request, for servers which do not support ranges
+    '''
+    part = path + PART_ENDING
+    response = get_with_backoff(url, stream=True, timeout=TIMEOUT)
+    response.raise_for_status()
+
+    with open(part, 'wb') as file:
+        for data in response.iter_content(READ_SIZE):
+            file.write(data)
+
+    os.replace(part, path)
+
+
+def mux(video: str, audio: str, path: str):
+    '''
+    Combines a video only and an audio only file without re-encoding
+    '''
+    command = [
+        'ffmpeg', '-y', '-v', 'error', '-i', video, '-i', audio,
+        '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy', path,
+    ]
+
+    try:
+        run_ffmpeg(command)
+    except ProcessError as e:
+        raise DownloadError(f'Failed to mux {path}: {e}') from e
+
+    os.remove(video)
+    os.remove(audio)
+
+
+class DownloadError(Exception):
+    '''
+    Raised when a video cannot be downloaded
+    '''
@@ -1,22 +1,37 @@
 from argparse import ArgumentParser
-from os.path import join
-from os import listdir, system
+from os.path import join, getsize, isfile
+from os import listdir, makedirs, remove, cpu_count
 import re
+import shlex
+import shutil
 import random
 import math
-import subprocess
 import requests # Will be implemented later
 from time import time
-
-from pytube import YouTube
-
-import pandas as pd
-
-from four_horsemen.srt import xml_to_srt
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterator, NamedTuple, Tuple
+
+from four_horsemen.backgrounds import VIDEO_EXTENSIONS, BackgroundIndex
+from four_horsemen.download import BACKENDS, CONNECTIONS, get_backend
+from four_horsemen.filtergraph import Filter, FilterGraph, Param, Template, escape, filter_args
+from four_horsemen.srt import write_srt
+from four_horsemen.probe import probe
+from four_horsemen.profiles import PROFILES, get_encoder_args
+from four_horsemen.proxies import get_fill_filter
+from four_horsemen.jobs import JobQueue
+from four_horsemen.metrics import METRICS
+from four_horsemen.process import ProcessError, run_ffmpeg
+from four_horsemen.store import RecordSink, get_sink_path
+from four_horsemen.utils import get_worker_count, get_seek_args
 
 VALID_CAPTIONS = ['en', 'en-US', 'a.en', 'a.en-US']
-VIDEO_EXTENSIONS = ['mov', 'mp4', 'avi', 'mkv', 'webm'] # must be supported by ffmpeg
-VIDEO_QUALITY = ['720p', '480p', '360p', '240p', '144p'] # must be supported by pytube
+FFMPEG_THREADS = 4 # threads given to each ffmpeg process when sizing the pool
+DEFAULT_PROFILE = 'draft'
+LOOKAHEAD = 1 # sources downloaded ahead of the one rendering
+MAX_TMP_GB = 20 # prefetching pauses while tmp/ holds more than this
+SUBTITLE_STYLE = "'Fontname=Consolas,BackColour=&H80000000,Spacing=0.2,Outline=0,Shadow=0.75'"
 
 import traceback
 
@@ -32,29 +47,59 @@ def main():
 
     print(f'Found {len(videos)} videos')
 
-    clear(args.output)
+    sink = RecordSink(get_sink_path(args.info), key='file_path')
+    METRICS.open(args.metrics)
 
-    # Gets a glob of all the backgrounds
-    backgrounds = [join(args.backgrounds, f) for f in listdir(args.backgrounds)
-                        if is_video(f)]
-    print(f'Found {len(backgrounds)} backgrounds')
+    if args.fresh:
+        clear(args.output, args.queue, sink.path)
+    else:
+        makedirs('tmp', exist_ok=True)
+        makedirs(args.output, exist_ok=True)
 
-    # video information storage
-    failed = []
-    info = []
-    for id in map(get_video_id, videos):
-        try:
-            curr_time = time()
+    queue = JobQueue(args.queue)
+    print(f'Queued {queue.add_sources([get_video_id(video) for video in videos])} new videos')
 
-            info += split_clip(id, length=args.length, overlap=args.overlap, output=args.output, backgrounds=backgrounds)
-            save_data(info, args.info) # excel, csv or json
+    jobs = get_worker_count(args.jobs, FFMPEG_THREADS)
+    print(f'Rendering {jobs} clips at a time')
+
+    # Only the backgrounds added since the last run are probed, proxies are used when up to date
+    backgrounds = BackgroundIndex(args.backgrounds, VIDEO_EXTENSIONS, 'family_guy')
+    print(f'Found {len(backgrounds)} backgrounds')
 
-            print(f'Time taken to split video: {time() - curr_time:.2f} seconds')
-        except Exception as e:
-            print(f'Failed to create video: {id}\nException:\n {e}')
-            # prints out the exception's stack trace
-            traceback.print_exc()
-            failed.append(id)
+    backend = get_backend(args.downloader, args.source, args.connections)
+
+    failed = []
+    # The next sources download while the current one renders
+    sources = prefetch_sources(queue, args.lookahead, args.max_tmp * 1e9, backend=backend)
+    try:
+        for id, source in sources:
+            try:
+                curr_time = time()
+
+                render_source(source.result(), length=args.length, overlap=args.overlap, output=args.output, backgrounds=backgrounds, jobs=jobs, single_pass=args.single_pass, profile=args.profile, queue=queue, sink=sink)
+
+                print(f'Time taken to split video: {time() - curr_time:.2f} seconds')
+            except Exception as e:
+                print(f'Failed to create video: {id}\nException:\n {e}')
+                # prints out the exception's stack trace
+                traceback.print_exc()
+                queue.fail_source(id, e)
+                remove_source(id)
+                failed.append(id)
+    finally:
+        # Unfinished sources, including the ones downloaded ahead, go back to
+        # the queue so a rerun picks them up straight away
+        sources.close()
+        released = queue.release_sources()
+        if released:
+            print(f'Released {released} unfinished videos back to the queue')
+
+        # Parts are appended to the sink as they finish, the export happens once
+        if args.info != sink.path:
+            sink.export(args.info) # excel, csv or json
+        print(f'Queue: {queue.counts()}')
+        queue.close()
+        METRICS.report(args.prometheus)
 
     return failed
 
@@ -70,7 +115,19 @@ def get_args():
     args.add_argument('-u', '--user', help='User ID for Tik Tok API')
     args.add_argument('-o', '--overlap', help='Overlap between clips', default=5, type=float)
     args.add_argument('-l', '--length', help='Max clip length', default=90, type=float) # Clips are now 90 seconds by default
-    args.add_argument('-i', '--info', help='Where to save video info (xlsx, csv or json)', default='info.xlsx')
+    args.add_argument('-i', '--info', help='Where to save video info (jsonl, or xlsx, csv or json to also export it at the end)', default='info.jsonl')
+    args.add_argument('-j', '--jobs', help='Clips to render at once (0 picks from the core count)', default=0, type=int)
+    args.add_argument('-p', '--profile', help='Encoding profile', default=DEFAULT_PROFILE, choices=PROFILES)
+    args.add_argument('-q', '--queue', help='SQLite file holding the render queue, shared by workers', default='jobs.db')
+    args.add_argument('-f', '--fresh', help='Delete the previous output and queue before starting', action='store_true')
+    args.add_argument('-L', '--lookahead', help='Videos to download ahead of the one rendering (0 downloads each one just before it renders)', default=LOOKAHEAD, type=int)
+    args.add_argument('-m', '--max-tmp', help='Gigabytes tmp may hold before downloading ahead pauses', default=MAX_TMP_GB, type=float)
+    args.add_argument('-d', '--downloader', help='Where the videos are downloaded from', default='youtube', choices=BACKENDS)
+    args.add_argument('--source', help='Directory or URL template of the videos for the local downloader, such as videos/{id}.mp4')
+    args.add_argument('-c', '--connections', help='Ranged requests made at once for each download', default=CONNECTIONS, type=int)
+    args.add_argument('--metrics', help='JSON Lines file every stage timing is appended to', default='metrics.jsonl')
+    args.add_argument('--prometheus', help='Also write the metrics of the run to this Prometheus textfile')
+    args.add_argument('-s', '--single-pass', help='Decode each source once and render all of its parts in one ffmpeg process', action='store_true')
     args.add_argument('output', help='Output directory for the clips (tmp)')
 
     return args.parse_args()
@@ -85,14 +142,9 @@ def validate_args(args):
 
 def get_duration(filename: str) -> float:
     """
-    Gets the duration and frame rate of a video
+    Gets the duration of a video
     """
-    raw_info = subprocess.Popen(f'ffmpeg -i {filename}', stdout=subprocess.PIPE, stderr = subprocess.STDOUT, shell=True).communicate()[0].decode('utf-8') # Gets rid of the standard error
-
-    # Regex to match the pattern Duration: 00:00:00.00
-    duration = raw_info.split('Duration: ')[1].split(',')[0].strip().split(':')
-
-    return int(duration[0]) * 3600 + int(duration[1]) * 60 + float(duration[2])
+    return probe(filename).duration
 
 
 def split_into_lines(text: str, max_length: int):
@@ -112,14 +164,29 @@ def split_into_lines(text: str, max_length: int):
     return lines
 
 
-def clear(output: str = 'output'):
+def clear(output: str = 'output', queue: str = None, info: str = None):
+    """
+    Clears the temporary directory, the render queue and the video info from the previous run
+    """
+    makedirs('tmp', exist_ok=True)
+    remove_files(join('tmp', f) for f in listdir('tmp') if f.endswith('.mp4'))
+    shutil.rmtree(output, ignore_errors=True)
+    makedirs(output, exist_ok=True)
+    if queue:
+        remove_files([queue, f'{queue}-wal', f'{queue}-shm'])
+    if info:
+        remove_files([info])
+
+
+def remove_files(paths):
     """
-    Clears the temporary directory from the previous run
+    Removes files, ignoring the ones which do not exist
     """
-    system('mkdir -p tmp')
-    system('rm -rf tmp/*.mp4')
-    system(f'rm -rf {output}')
-    system(f'mkdir -p {output}')
+    for path in paths:
+        try:
+            remove(path)
+        except FileNotFoundError:
+            pass
 
 
 def get_valid_languages(captions) -> list:
@@ -160,23 +227,22 @@ def get_video_id(url: str) -> str:
     raise Exception(f'Invalid URL: {url}')
 
 
-def download_video(video_id: str, output: str = 'tmp'):
+def download_video(video_id: str, output: str = 'tmp', backend=None):
     """
     Downloads a video from a id
+
+    Parameters
+    ----------
+    video_id: str
+        The id of the YouTube video
+    output: str
+        Directory the video is saved to as <id>.mp4
+    backend
+        Download backend, see `four_horsemen.download` (YouTube by default)
     """
     print(f'Downloading video: {video_id}')
 
-    yt = YouTube(f'https://www.youtube.com/watch?v={video_id}')
-
-    # saves a little bit of time by not downloading the highest quality video
-    streams = yt.streams.filter(resolution= lambda res: res in VIDEO_QUALITY).order_by('resolution').desc()
-        
-    if streams:
-        streams.first().download(output, f'{video_id}.mp4')
-    else:
-        yt.streams.filter(progressive=True).order_by('resolution').desc().first().download(output, f'{video_id}.mp4')
-
-    return yt
+    return (backend or get_backend()).download(video_id, join(output, f'{video_id}.mp4'))
 
 
 def get_output_props(duration, length=90, overlap=5):
@@ -188,16 +254,7 @@ def get_output_props(duration, length=90, overlap=5):
     return clips, clip_duration
 
 
-def get_random_clip(duration, clip_duration, overlap=5):
-    """
-    Gets a random clip of the background
-    """
-    time_range = duration - (clip_duration + overlap) # Duration of the background clip
-    start = random.random() * time_range
-    return time_range, start
-
-
-def upload_clip(index: int, id: str, backgrounds: list, output: str, captions: str, clip_duration: float, overlap: float, quality_settings: str = None):
+def upload_clip(index: int, id: str, backgrounds: BackgroundIndex, output: str, captions: str, clip_duration: float, overlap: float, quality_settings: str = None, threads: int = FFMPEG_THREADS, profile: str = DEFAULT_PROFILE):
     """
     Creates a single clip using ffmpeg
 
@@ -207,8 +264,8 @@ def upload_clip(index: int, id: str, backgrounds: list, output: str, captions: s
         The index of the subclip
     id: str
         The id of the YouTube video
-    backgrounds: list
-        A list of all the background videos to choose from
+    backgrounds: BackgroundIndex
+        The background videos to choose from
     captions: list
         .srt or other valid captions file for the video
     clip_duration: float
@@ -216,112 +273,446 @@ def upload_clip(index: int, id: str, backgrounds: list, output: str, captions: s
     overlap: float
         Overlap time between clips
     quality_settings: str
-        Custom quality settings for the output image
-        Default: "-r 30 -vsync 2 -c:v libx264 -crf 29 -preset ultrafast"
+        Custom quality settings for the output image, overrides the profile
+    threads: int
+        Number of threads ffmpeg may use for this clip
+    profile: str
+        Encoding profile to use, see `four_horsemen.profiles`
     """
     print(f'Making clip {index + 1:3} for video {id}')
 
-    quality_settings = quality_settings or '-r 30 -vsync 2 -c:v libx264 -crf 32 -preset ultrafast'
+    quality_settings = get_quality_settings(quality_settings, profile, threads)
+
+    # A keyframe aligned window of a background long enough for the clip
+    background, start = backgrounds.sample(clip_duration + overlap)
+
+    template = get_clip_template(bool(captions))
+    params = {'number': index + 1}
+    if captions:
+        # The source is already seeked, so the captions need their timestamps back
+        params |= {'source_start': index * clip_duration, 'captions': escape(join('tmp', f'{id}.srt'))}
+
+    with METRICS.timer('filtergraph', id=id, part=index):
+        filter_complex = template.render(**params)
+
+    with filter_args(filter_complex) as graph_args:
+        command = [
+            'ffmpeg',
+            '-v', 'error',
+            '-y',
+            *get_seek_args(start, clip_duration + overlap, accurate=False),
+            '-i', background,
+            *get_seek_args(index * clip_duration, clip_duration + overlap),
+            '-i', join('tmp', f'{id}.mp4'),
+            *graph_args,
+            *template.get_map_args(),
+            '-shortest',
+            *quality_settings,
+            join(output, f'{id}_{index}.mp4')
+        ]
+
+        with METRICS.timer('encode', id=id, part=index) as fields:
+            try:
+                fields.update(run_ffmpeg(command).progress)
+            except ProcessError as e:
+                raise ClipCreationError(f'Failed to make clip {index + 1} for video {id}: {e}') from e
+
+
+def render_single_pass(id: str, parts: list, backgrounds: BackgroundIndex, output: str, captions: str, clip_duration: float, overlap: float, quality_settings: str = None, threads: int = 0, profile: str = DEFAULT_PROFILE):
+    """
+    Creates every clip of a video with one ffmpeg process
+
+    The source is decoded once and split to every part, so the work grows with
+    the length of the source rather than with the square of the number of parts
+
+    Parameters
+    ----------
+    id: str
+        The id of the YouTube video
+    parts: list
+        The indexes of the parts to create
+    backgrounds: BackgroundIndex
+        The background videos to choose from
+    captions: list
+        .srt or other valid captions file for the video
+    clip_duration: float
+        Duration of each clip
+    overlap: float
+        Overlap time between clips
+    quality_settings: str
+        Custom quality settings for the output image, overrides the profile
+    threads: int
+        Number of threads ffmpeg may use (0 lets ffmpeg decide)
+    profile: str
+        Encoding profile to use, see `four_horsemen.profiles`
+    """
+    print(f'Making {len(parts)} clips for video {id} in a single pass')
+
+    quality_settings = get_quality_settings(quality_settings, profile, threads)
+    template = get_single_pass_template(len(parts), bool(captions))
+    params = {'duration': clip_duration + overlap}
+    if captions:
+        params['captions'] = escape(join('tmp', f'{id}.srt'))
+
+    inputs = ['-i', join('tmp', f'{id}.mp4')]
+    outputs = []
+    for k, i in enumerate(parts):
+        background, start = backgrounds.sample(clip_duration + overlap)
+
+        inputs += [*get_seek_args(start, clip_duration + overlap, accurate=False), '-i', background]
+        params |= {f'number{k}': i + 1, f'start{k}': i * clip_duration}
+        outputs += [
+            *template.get_map_args(template.outputs[2 * k:2 * k + 2]),
+            '-shortest',
+            *quality_settings,
+            join(output, f'{id}_{i}.mp4')
+        ]
+
+    with METRICS.timer('filtergraph', id=id, parts=len(parts)):
+        filter_complex = template.render(**params)
+
+    with filter_args(filter_complex) as graph_args:
+        command = [
+            'ffmpeg',
+            '-v', 'error',
+            '-y',
+            *inputs,
+            *graph_args,
+            *outputs
+        ]
+
+        with METRICS.timer('encode', id=id, parts=len(parts)) as fields:
+            try:
+                fields.update(run_ffmpeg(command).progress)
+            except ProcessError as e:
+                raise ClipCreationError(f'Failed to make clips for video {id}: {e}') from e
+
+
+def get_quality_settings(quality_settings: str, profile: str, threads: int) -> list:
+    """
+    Gets the output options of a clip from custom settings or an encoding profile
+    """
+    if quality_settings:
+        return [*shlex.split(quality_settings), '-threads', str(threads)]
+
+    return ['-r', '30', '-vsync', '2', *get_encoder_args(profile, threads)]
+
+
+def get_subtitle_filter(captions) -> Filter:
+    """
+    Gets the filter which burns captions into the top half
+
+    Parameters
+    ----------
+    captions: str or Param
+        Escaped path of the .srt file
+    """
+    return Filter('subtitles', captions, force_style=SUBTITLE_STYLE)
+
+
+@lru_cache(maxsize=None)
+def get_clip_template(captions: bool) -> Template:
+    """
+    Gets the graph of a clip made from a seeked source and background
+
+    Compiled once, the parameters are the number drawn on the clip and, with
+    captions, the .srt file and where the clip starts in the source
+    """
+    graph = FilterGraph(inputs=2)
+    sub = [Filter('setpts', f'PTS+{Param("source_start")}/TB'), get_subtitle_filter(Param('captions'))] if captions else []
+    get_part_filter(graph, Param('number'), sub=sub)
+
+    return graph.compile()
+
+
+@lru_cache(maxsize=None)
+def get_single_pass_template(parts: int, captions: bool) -> Template:
+    """
+    Gets the graph which splits a source into several clips
+
+    The source is input 0 and the background of part k is input k + 1. The
+    parameters are the length of the clips, the number and start of every
+    part and, with captions, the .srt file. The outputs are the video and
+    audio of every part in turn.
+    """
+    graph = FilterGraph(inputs=parts + 1)
+    sub = [get_subtitle_filter(Param('captions'))] if captions else []
+    videos = graph.chain(['0:v'], [*sub, Filter('split', parts)], parts)
+    audios = graph.chain(['0:a'], [Filter('asplit', parts)], parts)
+
+    for k in range(parts):
+        get_part_filter(graph, Param(f'number{k}'), Param('duration'), source_start=Param(f'start{k}'),
+                        source=videos[k], source_audio=audios[k], background=f'{k + 1}:v')
 
-    background = random.choice(backgrounds) # Randomly chooses a background which remains the same of all clips
-    bg_duration = get_duration(background)
+    return graph.compile()
 
-    time_range, start = get_random_clip(bg_duration, clip_duration, overlap)
 
-    sub = f"subtitles=tmp/{id}.srt:force_style='Fontname=Consolas,BackColour=&H80000000,Spacing=0.2,Outline=0,Shadow=0.75'," if captions else ""
+def get_part_filter(graph: FilterGraph, number, duration=None, source_start=None, background_start=None, source: str = '1:v', source_audio: str = '1:a', background: str = '0:v', sub: list = ()) -> Tuple[str, str]:
+    """
+    Adds the chains which stack a part of the source on top of the background
+
+    Parameters
+    ----------
+    graph: FilterGraph
+        The graph the chains are added to
+    number: int or Param
+        The number drawn on the part
+    duration: float or Param
+        Duration of the part, only needed when trimming
+    source_start, background_start: float or Param
+        Where the part starts in the source and background. Left as None when
+        the input was already seeked with `get_seek_args`
+    source, source_audio, background: str
+        Input pads for the source video, source audio and background
+    sub: list
+        Subtitle filters to run on the source before it is trimmed
+
+    Returns the labels of the video and audio of the part
+    """
+    source_trim = Filter('trim', start=source_start, duration=duration) if source_start is not None else None
+    source_atrim = Filter('atrim', start=source_start, duration=duration) if source_start is not None else None
+    background_trim = Filter('trim', start=background_start, duration=duration) if background_start is not None else None
+    crop = escape('min(iw/4,ih/3)')
+
+    top, = graph.chain([source], [
+        *sub, source_trim, 'setpts=PTS-STARTPTS',
+        Filter('crop', f'4*{crop}', f'3*{crop}'),
+        Filter('scale', 1080, 810),
+        Filter('pad', 'iw', 'ih+10', 0, 0, 'black'),
+    ])
+    bottom, = graph.chain([background], [background_trim, 'setpts=PTS-STARTPTS', get_fill_filter(1080, 1100)])
+    video, = graph.chain([top, bottom], [
+        Filter('vstack', inputs=2, shortest=1),
+        Filter('drawtext', fontsize=180, fontcolor='white', x=80, y=750, text=number,
+               enable=escape('gte(t,0)'), box=1, boxborderw=10, line_spacing=10, boxcolor='black'),
+    ])
+    audio, = graph.chain([source_audio], [source_atrim, 'asetpts=PTS-STARTPTS'])
+
+    return video, audio
+
+
+class Source(NamedTuple):
+    """
+    A downloaded source video, ready to be split
+    """
+    id: str
+    title: str
+    duration: float
+
+
+def prefetch_sources(queue: JobQueue, lookahead: int = LOOKAHEAD, max_tmp: float = MAX_TMP_GB * 1e9, use_captions: bool = False, backend=None) -> Iterator[Tuple[str, Future]]:
+    """
+    Claims sources from the queue and downloads them ahead of time
+
+    Up to `lookahead` sources download in the background while the caller
+    renders the current one. Downloading ahead pauses while tmp/ holds more
+    than `max_tmp` bytes, and picks up again once rendered sources are removed.
+
+    Yields (video id, future of its `Source`) in the order they were claimed
+    """
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=max(1, lookahead)) as pool:
+        try:
+            while True:
+                # Always keeps the source about to render, the rest only fit under the limits
+                while not pending or (len(pending) <= lookahead and get_tmp_size() < max_tmp):
+                    if (id := queue.claim_source()) is None:
+                        break
+                    pending.append((id, pool.submit(fetch_source, id, use_captions, backend)))
+
+                if not pending:
+                    return
 
-    filter_complex = [
-        f'[1:v]{sub}trim=start={index * clip_duration}:duration={clip_duration + overlap}',
-        'setpts=PTS-STARTPTS,crop=4*min(iw/4\,ih/3):3*min(iw/4\,ih/3)',
-        'scale=1080:810',
-        'pad=iw:ih+10:0:0:black[top]',
-        f'[0:v]trim=start={start}:duration={clip_duration + overlap}',
-        'setpts=PTS-STARTPTS,crop=1080*min(iw/1080\,ih/1100):1100*min(iw/1080\,ih/1100)',
-        'scale=1080:1100',
-        '[top]vstack=inputs=2:shortest=1',
-        f'drawtext=fontsize=180:fontcolor=white:x=80:y=750:text=\'{index + 1}\':enable=\'gte(t\,0)\':box=1:boxborderw=10:line_spacing=10:boxcolor=black[out]',
-        f'[1:a]atrim=start={index * clip_duration}:duration={clip_duration + overlap},asetpts=PTS-STARTPTS[a]',
-        'asetpts=PTS-STARTPTS,[aout]'
-    ]
+                yield pending.popleft()
+        finally:
+            # Closed early, the downloads which have not started are dropped
+            for _, future in pending:
+                future.cancel()
 
-    filter_complex = ','.join(filter_complex)
 
-    command = [
-        'ffmpeg',
-        '-v quiet',
-        '-y',
-        '-i', background,
-        '-i', join('tmp', f'{id}.mp4'),
-        '-filter_complex', filter_complex,
-        '-map', '\'[out]\'',
-        '-map', '\'[aout]\'',
-        '-shortest',
-        quality_settings,
-        join(output, f'{id}_{index}.mp4')
-    ]
+def get_tmp_size(directory: str = 'tmp') -> int:
+    """
+    Gets the number of bytes held by the downloaded sources
+    """
+    paths = [join(directory, f) for f in listdir(directory)]
+    return sum(getsize(path) for path in paths if isfile(path))
+
 
-    system(' '.join(command))
+def fetch_source(id: str, use_captions: bool = False, backend=None) -> Source:
+    """
+    Downloads a source video and its captions and probes its duration
+    """
+    with METRICS.timer('download', id=id):
+        yt = download_video(id, backend=backend)
+
+    valid_langs = get_valid_languages(yt.captions)
+
+    if use_captions and valid_langs:
+        with METRICS.timer('captions', id=id):
+            write_srt(yt.captions[valid_langs[0]].xml_captions, f'tmp/{id}.srt')
 
-    # system(f'ffmpeg -v quiet -y -i {background} -i {join("tmp", f"{id}.mp4")} -filter_complex "[1:v]{sub}trim=start={index * clip_duration}:duration={clip_duration + overlap},setpts=PTS-STARTPTS,crop=4*min(iw/4\,ih/3):3*min(iw/4\,ih/3),scale=1080:810,pad=iw:ih+10:0:0:black[top],[0:v]trim=start={start}:duration={clip_duration + overlap},setpts=PTS-STARTPTS,crop=1080*min(iw/1080\,ih/1100):1100*min(iw/1080\,ih/1100),scale=1080:1100,[top]vstack=inputs=2:shortest=1,drawtext=fontsize=180:fontcolor=white:x=80:y=750:text=\'{index + 1}\':enable=\'between(t,0,10)\':box=1:boxborderw=10:line_spacing=500:boxcolor=black[out],[1:a]atrim=start={index * clip_duration}:duration={clip_duration + overlap},asetpts=PTS-STARTPTS[aout]" -map \'[out]\' -map \'[aout]\' {quality_settings} {join(output, f"{id}+{index}.mp4")}')
+    with METRICS.timer('probe', id=id):
+        duration = get_duration(f'tmp/{id}.mp4')
 
+    return Source(id, yt.title, duration)
 
-def split_clip(id: str, length: float, overlap: float, backgrounds: list, output: str, use_captions: bool = False) -> list:
+
+def remove_source(id: str):
+    """
+    Removes the downloaded files of a source
+    """
+    remove_files([join('tmp', f'{id}.mp4'), join('tmp', f'{id}.srt')])
+
+
+def split_clip(id: str, length: float, overlap: float, backgrounds: BackgroundIndex, output: str, use_captions: bool = False, jobs: int = 1, single_pass: bool = False, profile: str = DEFAULT_PROFILE, queue: JobQueue = None, sink: RecordSink = None) -> list:
     """
     Splits a clip into multiple clips
 
+    Downloads the source and renders it, see `fetch_source` and `render_source`
+
     Parameters
     ----------
     id: str
         The id of the YouTube video
+    use_captions: bool
+        Burns the YouTube captions into the clips
+    """
+    return render_source(fetch_source(id, use_captions), length, overlap, backgrounds, output, jobs, single_pass, profile, queue, sink)
+
+
+def render_source(source: Source, length: float, overlap: float, backgrounds: BackgroundIndex, output: str, jobs: int = 1, single_pass: bool = False, profile: str = DEFAULT_PROFILE, queue: JobQueue = None, sink: RecordSink = None) -> list:
+    """
+    Renders every part of a downloaded source
+
+    Parameters
+    ----------
+    source: Source
+        The downloaded source video
     length: float
         The length of each clip
     overlap: float
         The overlap between clips
-    backgrounds: list
-        A list of all the background videos to choose from (must be full path)
+    backgrounds: BackgroundIndex
+        The background videos to choose from
     output: str
         The output directory
+    jobs: int
+        The number of clips to render at once
+    single_pass: bool
+        Decodes the source once and renders every part in one ffmpeg process
+    profile: str
+        Encoding profile to use, see `four_horsemen.profiles`
+    queue: JobQueue
+        Records the state of every part so only unfinished parts are rendered
+    sink: RecordSink
+        Where the information of every finished part is appended
     """
-    yt = download_video(id)
-
-    valid_langs = get_valid_languages(yt.captions)
-
-    if use_captions and valid_langs:
-        srt_captions = xml_to_srt(yt.captions[valid_langs[0]].xml_captions)
-        save_string(srt_captions, f'tmp/{id}.srt')
-
-    duration = get_duration(f'tmp/{id}.mp4')
+    id, title, duration = source
 
     print(f'Duration: {duration:0.2f} seconds')
 
     num_clips, clip_duration = get_output_props(duration, length, overlap)
 
+    if queue:
+        queue.set_parts(id, title, num_clips)
+        parts = queue.pending_parts(id)
+        print(f'Rendering {len(parts)} of {num_clips} parts')
+    else:
+        parts = list(range(num_clips))
+
+    clip_args = {
+        'id': id,
+        'backgrounds': backgrounds,
+        'output': output,
+        'captions': None,
+        'clip_duration': clip_duration,
+        'overlap': overlap,
+        'profile': profile,
+    }
+
+    if single_pass:
+        try:
+            render_single_pass(parts=parts, **clip_args)
+            failed = {}
+        except ClipCreationError as e:
+            failed = {i: e for i in parts}
+    else:
+        failed = render_parts(parts, jobs, **clip_args)
+
     information = []
-    for i in range(num_clips):
-        upload_clip(
-            index=i,
-            id=id,
-            backgrounds=backgrounds,
-            output=output,
-            captions=None,
-            clip_duration=clip_duration,
-            overlap=overlap
-        )
+    for i in parts:
+        if i in failed:
+            METRICS.count('parts_failed')
+            if queue:
+                queue.fail_part(id, i, failed[i])
+            continue
+
+        METRICS.count('parts_done')
 
         information.append({
             'id': id,
-            'title': yt.title,
-            'description': f'Part {i + 1}/{num_clips} of {yt.title}',
+            'title': title,
+            'description': f'Part {i + 1}/{num_clips} of {title}',
             'part': i + 1,
-            'file_path': join(output, f'{id}+{i}.mp4'),
+            'file_path': join(output, f'{id}_{i}.mp4'),
             'uploaded': False
         })
 
-    system(f'rm tmp/{id}.mp4 tmp/{id}.srt')
+        with METRICS.timer('save', id=id, part=i):
+            if sink:
+                sink.append(information[-1])
+            if queue:
+                queue.finish_part(id, i, information[-1]['file_path'], information[-1]['description'])
+
+    remove_source(id)
+
+    if queue:
+        queue.finish_source(id)
+
+    if parts and not information:
+        raise ClipCreationError(f'Every clip failed for video {id}')
 
     return information
 
 
+def render_parts(parts: list, jobs: int, **clip_args) -> dict:
+    """
+    Renders every part of a video using a bounded pool of ffmpeg processes
+
+    Each worker thread blocks on its own ffmpeg process, so threads are enough
+    to keep the cores busy. A failed part does not stop the others.
+
+    Parameters
+    ----------
+    parts: list
+        The indexes of the parts to render
+    jobs: int
+        The maximum number of ffmpeg processes to run at once
+    clip_args
+        Passed through to `upload_clip` for every part
+
+    Returns a dictionary of part index to exception for the parts which failed
+    """
+    jobs = max(1, min(jobs, len(parts)))
+    threads = max(1, (cpu_count() or 1) // jobs)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            i: pool.submit(upload_clip, index=i, threads=threads, **clip_args)
+            for i in parts
+        }
+
+    failed = {}
+    for i, future in futures.items():
+        error = future.exception()
+        if error is not None:
+            print(f'Failed to make clip {i + 1:3} for video {clip_args.get("id")}: {error}')
+            failed[i] = error
+
+    return failed
+
+
 def save_string(string: str, path: str) -> None:
     """Saves a string to a file"""
     with open(path, 'w', encoding='utf-8') as f:
@@ -329,26 +720,7 @@ def save_string(string: str, path: str) -> None:
         f.close()
 
 
-def save_data(info: list, path: str) -> None:
+class ClipCreationError(Exception):
+    """
+    Raised when ffmpeg fails to create a clip
     """
-    Saves the data based on the ending of the string
-
-    Parameters
-    ----------
-    info
-        A list of dictionaries with video information
-    path
-        The path to save the data to
-    """
-    # convert info from a list of dictionaries to a dictionary of lists
-    info = {key: [d[key] for d in info] for key in info[0]}
-    frame = pd.DataFrame(info)
-
-    if path.endswith('.csv'):
-        frame.to_csv(path, index=False)
-    elif path.endswith('.json'):
-        frame.to_json(path, orient='records')
-    elif path.endswith('.xlsx'):
-        frame.to_excel(path, index=False)
-    else:
-        frame.to_csv(path, index=False)
\ No newline at end of file
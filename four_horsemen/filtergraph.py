@@ -0,0 +1,274 @@
+'''
+Builds ffmpeg filter graphs
+
+A graph is a list of chains. Each chain reads labelled pads, runs its filters
+one after the other and writes labelled pads:
+
+    graph = FilterGraph(inputs=2)
+    top, = graph.chain(['0:v'], [Filter('scale', 1080, 810)])
+    graph.chain([top, '1:v'], [Filter('vstack', inputs=2)], ['out'])
+
+The pads are checked when a graph is compiled. Every input of a chain must be
+a stream of one of the command's inputs or the output of another chain, and
+every output may be read at most once. Outputs which no chain reads are the
+outputs of the graph and are what `-map` picks.
+
+A `Param` leaves a hole in a graph. A graph whose shape only depends on the
+layout is compiled once into a `Template`, which is then filled in for every
+video by joining strings.
+
+Long graphs are written to a temporary file and passed with
+-filter_complex_script so that commands with many overlays stay below the
+argument length limit. The file is removed once the command is done:
+
+    with filter_args(graph.compile().render()) as args:
+        run_ffmpeg(['ffmpeg', '-i', 'in.mp4', *args, 'out.mp4'])
+'''
+import os
+import re
+from contextlib import contextmanager
+from itertools import count
+from tempfile import NamedTemporaryFile
+from typing import Iterator, List, NamedTuple, Union
+
+SCRIPT_THRESHOLD = 8000 # graphs longer than this are passed as a script file
+STREAM = re.compile(r'^(\d+)(:[vas](:\d+)?|:\d+)?$') # input streams such as 0:v or 1:a:0
+HOLE = '\x00' # marks where a parameter goes in a compiled graph
+
+
+class Param(NamedTuple):
+    '''
+    A value which is only known when the graph is rendered
+    '''
+    name: str
+
+    def __str__(self) -> str:
+        return f'{HOLE}{self.name}{HOLE}'
+
+
+class Filter:
+    '''
+    A single filter with its positional and named options
+
+    Options which are strings are used as they are, so expressions have to be
+    escaped already (see `escape`)
+    '''
+
+    def __init__(self, name: str, *args, **options):
+        self.name = name
+        self.args = args
+        self.options = options
+
+    def __str__(self) -> str:
+        values = [format_value(value) for value in self.args]
+        values += [f'{key}={format_value(value)}' for key, value in self.options.items()]
+
+        return f'{self.name}={":".join(values)}' if values else self.name
+
+    def __repr__(self) -> str:
+        return f'Filter({str(self)!r})'
+
+
+class Chain(NamedTuple):
+    '''
+    Filters run one after the other between labelled pads
+    '''
+    inputs: List[str]
+    filters: List[Union[Filter, str]]
+    outputs: List[str]
+
+    def __str__(self) -> str:
+        return ''.join([
+            *(f'[{pad}]' for pad in self.inputs),
+            ','.join(str(f) for f in self.filters),
+            *(f'[{pad}]' for pad in self.outputs),
+        ])
+
+
+class FilterGraph:
+    '''
+    Chains of filters making up a -filter_complex
+
+    Parameters
+    ----------
+    inputs: int
+        The number of inputs of the command, used to check stream pads
+    '''
+
+    def __init__(self, inputs: int = None):
+        self.inputs = inputs
+        self.chains = []
+        self.labels = count()
+
+    def label(self, prefix: str = 's') -> str:
+        '''
+        Gets a new unique pad label
+        '''
+        return f'{prefix}{next(self.labels)}'
+
+    def chain(self, inputs: List[str], filters: List[Union[Filter, str]],
+              outputs: Union[int, List[str]] = 1) -> List[str]:
+        '''
+        Adds a chain to the graph
+
+        Parameters
+        ----------
+        inputs: list
+            Labels or input streams (such as 0:v) the chain reads
+        filters: list
+            Filters, or raw filter text, run in order
+        outputs: int or list
+            Labels the chain writes, or how many new labels to make
+
+        Returns the output labels
+        '''
+        if isinstance(outputs, int):
+            outputs = [self.label() for _ in range(outputs)]
+
+        self.chains.append(Chain(list(inputs), [f for f in filters if f], list(outputs)))
+        return list(outputs)
+
+    @property
+    def outputs(self) -> List[str]:
+        '''
+        The labels written by a chain but read by no other chain
+        '''
+        read = {pad for chain in self.chains for pad in chain.inputs}
+        return [pad for chain in self.chains for pad in chain.outputs if pad not in read]
+
+    def validate(self):
+        '''
+        Checks every pad is written once and read at most once
+
+        Raises FilterGraphError otherwise
+        '''
+        written = set()
+        for chain in self.chains:
+            if not chain.filters:
+                raise FilterGraphError(f'Chain {chain} has no filters')
+            for pad in chain.outputs:
+                if STREAM.match(pad):
+                    raise FilterGraphError(f'Pad [{pad}] is an input stream and cannot be written')
+                if pad in written:
+                    raise FilterGraphError(f'Pad [{pad}] is written more than once')
+                written.add(pad)
+
+        read = set()
+        for chain in self.chains:
+            for pad in chain.inputs:
+                stream = STREAM.match(pad)
+                if stream:
+                    if self.inputs is not None and int(stream.group(1)) >= self.inputs:
+                        raise FilterGraphError(f'Stream [{pad}] is not one of the {self.inputs} inputs')
+                    continue
+
+                if pad not in written:
+                    raise FilterGraphError(f'Pad [{pad}] is read but never written')
+                if pad in read:
+                    raise FilterGraphError(f'Pad [{pad}] is read more than once')
+                read.add(pad)
+
+        if not self.outputs:
+            raise FilterGraphError('The graph has no outputs')
+
+    def compile(self) -> 'Template':
+        '''
+        Validates the graph and turns it into a template
+        '''
+        self.validate()
+        return Template(';'.join(str(chain) for chain in self.chains).split(HOLE), self.outputs)
+
+    def __str__(self) -> str:
+        return self.compile().render()
+
+
+class Template:
+    '''
+    A compiled filter graph with holes for its parameters
+    '''
+
+    def __init__(self, parts: List[str], outputs: List[str]):
+        self.parts = parts # the names of the parameters are every other part
+        self.outputs = outputs
+        self.params = set(parts[1::2])
+
+    def render(self, **params) -> str:
+        '''
+        Fills in the parameters of the graph
+        '''
+        if params.keys() != self.params:
+            missing = sorted(self.params - params.keys())
+            unknown = sorted(params.keys() - self.params)
+            raise FilterGraphError(f'Missing parameters {missing}, unknown parameters {unknown}')
+
+        parts = list(self.parts)
+        parts[1::2] = [format_value(params[name]) for name in parts[1::2]]
+        return ''.join(parts)
+
+    def get_map_args(self, pads: List[str] = None) -> List[str]:
+        '''
+        Gets the -map options which pick outputs of the graph, all of them by default
+        '''
+        return [arg for pad in (self.outputs if pads is None else pads) for arg in ['-map', f'[{pad}]']]
+
+
+def format_value(value) -> str:
+    '''
+    Formats an option value the way ffmpeg reads it
+
+    Parameters are left as holes for `Template.render`
+    '''
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, float):
+        return f'{value:.3f}'.rstrip('0').rstrip('.')
+
+    return str(value)
+
+
+def escape(text: str) -> str:
+    '''
+    Escapes text so it reaches a filter as a single option value
+
+    Escapes once for the option parser and once more for the graph parser
+    '''
+    text = re.sub(r"([\\':])", r'\\\1', str(text))
+    return re.sub(r"([\\'\[\],;])", r'\\\1', text)
+
+
+@contextmanager
+def filter_args(graph: str, directory: str = None, threshold: int = SCRIPT_THRESHOLD) -> Iterator[List[str]]:
+    '''
+    Gets the ffmpeg options which pass a rendered graph
+
+    Graphs longer than `threshold` are written to a script file of their own,
+    which is removed when the block exits, so the command has to run inside it
+
+    Parameters
+    ----------
+    graph: str
+        The rendered graph
+    directory: str
+        Where script files are written, defaults to the system temp directory
+    threshold: int
+        Length above which a script file is used
+    '''
+    if len(graph) <= threshold:
+        yield ['-filter_complex', graph]
+        return
+
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with NamedTemporaryFile('w', encoding='utf-8', suffix='.txt', dir=directory, delete=False) as file:
+        file.write(graph)
+
+    try:
+        yield ['-filter_complex_script', file.name]
+    finally:
+        os.remove(file.name)
+
+
+class FilterGraphError(Exception):
+    '''
+    Raised when a filter graph is not valid
+    '''
@@ -0,0 +1,249 @@
+'''
+Durable render queue for family_guy backed by SQLite
+
+Every source video is a row in `sources` and every part of it a row in
+`parts`, each with its own state. A rerun skips the parts which are already
+done and retries the ones which failed, and several worker processes can
+pull sources from the same queue file.
+'''
+import os
+import socket
+import sqlite3
+from time import time
+from typing import List, Optional
+
+LEASE = 6 * 3600 # seconds before a claimed source is assumed abandoned by a dead worker
+MAX_ATTEMPTS = 3
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sources (
+    video_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL DEFAULT 'pending',
+    title TEXT,
+    parts INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    claimed_at REAL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS parts (
+    video_id TEXT NOT NULL,
+    part INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    file_path TEXT,
+    description TEXT,
+    error TEXT,
+    updated_at REAL,
+    PRIMARY KEY (video_id, part)
+);
+CREATE INDEX IF NOT EXISTS sources_state ON sources (state);
+'''
+
+
+def get_worker_id() -> str:
+    '''
+    Gets a name for this worker process
+    '''
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def is_dead_worker(worker: str) -> bool:
+    '''
+    Whether a worker is a process on this host which is no longer running
+
+    Workers on other hosts are never assumed dead, their claims wait for the lease
+    '''
+    host, _, pid = (worker or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit() or os.name == 'nt':
+        return False # signal 0 does not check a process on Windows
+
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False # running as another user
+
+    return False
+
+
+class JobQueue:
+    '''
+    Queue of (video id, part) render jobs
+
+    Source states go pending -> claimed -> done or failed, part states go
+    pending -> done or failed. Failed sources are claimed again until they
+    reach MAX_ATTEMPTS. A worker hands its unfinished claims back with
+    `release_sources` when it stops, and claims of workers which died on this
+    host are taken over straight away instead of after the lease.
+    '''
+
+    def __init__(self, path: str, lease: float = LEASE, max_attempts: int = MAX_ATTEMPTS):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+        # autocommit, transactions are opened explicitly where they matter
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+
+    def add_sources(self, video_ids: List[str]) -> int:
+        '''
+        Adds source videos, ignoring the ones already in the queue
+
+        Returns the number of new sources
+        '''
+        before = self.connection.total_changes
+        with self.transaction():
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO sources (video_id) VALUES (?)',
+                [(video_id,) for video_id in video_ids]
+            )
+        return self.connection.total_changes - before
+
+    def claim_source(self, worker: str = None) -> Optional[str]:
+        '''
+        Atomically claims the next source which still has work to do
+
+        Returns the video id, or None once the queue is finished
+        '''
+        now = time()
+        with self.transaction():
+            dead = [row['worker'] for row in self.connection.execute(
+                "SELECT DISTINCT worker FROM sources WHERE state = 'claimed'"
+            ) if is_dead_worker(row['worker'])]
+
+            row = self.connection.execute(f'''
+                SELECT video_id FROM sources
+                WHERE (state IN ('pending', 'failed') AND attempts < ?)
+                   OR (state = 'claimed' AND claimed_at < ?)
+                   OR (state = 'claimed' AND worker IN ({', '.join('?' * len(dead))}))
+                ORDER BY rowid LIMIT 1
+            ''', (self.max_attempts, now - self.lease, *dead)).fetchone()
+
+            if row is None:
+                return None
+
+            self.connection.execute('''
+                UPDATE sources SET state = 'claimed', worker = ?, claimed_at = ?,
+                    attempts = attempts + 1, error = NULL
+                WHERE video_id = ?
+            ''', (worker or get_worker_id(), now, row['video_id']))
+
+        return row['video_id']
+
+    def release_sources(self, worker: str = None) -> int:
+        '''
+        Hands the sources a worker claimed but did not finish back to the queue
+
+        The interrupted claim does not count as an attempt. Returns the number
+        of sources released
+        '''
+        before = self.connection.total_changes
+        with self.transaction():
+            self.connection.execute('''
+                UPDATE sources SET state = 'pending', worker = NULL, claimed_at = NULL,
+                    attempts = MAX(attempts - 1, 0)
+                WHERE state = 'claimed' AND worker = ?
+            ''', (worker or get_worker_id(),))
+        return self.connection.total_changes - before
+
+    def set_parts(self, video_id: str, title: str, parts: int):
+        '''
+        Records how many parts a source is split into
+        '''
+        with self.transaction():
+            self.connection.execute(
+                'UPDATE sources SET title = ?, parts = ? WHERE video_id = ?',
+                (title, parts, video_id)
+            )
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO parts (video_id, part) VALUES (?, ?)',
+                [(video_id, part) for part in range(parts)]
+            )
+
+    def pending_parts(self, video_id: str) -> List[int]:
+        '''
+        Gets the parts of a source which are not done yet
+        '''
+        return [row['part'] for row in self.connection.execute(
+            "SELECT part FROM parts WHERE video_id = ? AND state != 'done' ORDER BY part",
+            (video_id,)
+        )]
+
+    def finish_part(self, video_id: str, part: int, file_path: str, description: str):
+        '''
+        Marks a part as rendered
+        '''
+        self.connection.execute('''
+            UPDATE parts SET state = 'done', attempts = attempts + 1, file_path = ?,
+                description = ?, error = NULL, updated_at = ?
+            WHERE video_id = ? AND part = ?
+        ''', (file_path, description, time(), video_id, part))
+
+    def fail_part(self, video_id: str, part: int, error: str):
+        '''
+        Marks a part as failed so it is retried on the next run
+        '''
+        self.connection.execute('''
+            UPDATE parts SET state = 'failed', attempts = attempts + 1, error = ?, updated_at = ?
+            WHERE video_id = ? AND part = ?
+        ''', (str(error), time(), video_id, part))
+
+    def finish_source(self, video_id: str):
+        '''
+        Marks a source done if all of its parts are, failed otherwise
+        '''
+        state = 'failed' if self.pending_parts(video_id) else 'done'
+        self.connection.execute(
+            'UPDATE sources SET state = ? WHERE video_id = ?', (state, video_id)
+        )
+
+    def fail_source(self, video_id: str, error: str):
+        '''
+        Marks a source as failed before its parts could be rendered
+        '''
+        self.connection.execute(
+            "UPDATE sources SET state = 'failed', error = ? WHERE video_id = ?",
+            (str(error), video_id)
+        )
+
+    def counts(self) -> dict:
+        '''
+        Gets the number of sources in each state
+        '''
+        return dict(self.connection.execute(
+            'SELECT state, COUNT(*) FROM sources GROUP BY state'
+        ).fetchall())
+
+    def transaction(self):
+        '''
+        Opens a write transaction which other workers wait on
+        '''
+        return Transaction(self.connection)
+
+    def close(self):
+        '''
+        Closes the queue
+        '''
+        self.connection.close()
+
+
+class Transaction:
+    '''
+    BEGIN IMMEDIATE ... COMMIT, rolled back on error
+    '''
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
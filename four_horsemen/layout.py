@@ -0,0 +1,182 @@
+'''
+Where the images of a multi_meme video go
+
+The images share an area of the video which is split into a grid of equal
+cells, filled row by row with the last row centered. The usual image counts
+have fixed grids (`GRIDS`); any other count gets the grid whose cells are
+closest to square for the area.
+
+A layout only depends on the canvas and the number of images, so layouts are
+computed once and cached. The ones for every canvas in `CANVASES` and up to
+`PRECOMPUTED_IMAGES` images are built on import, which makes `get_layout` a
+lookup.
+
+When the sizes of the images are known, `pack_layout` tries every grid which
+holds them without an empty row and keeps the one showing the most image, so
+tall images end up side by side and wide ones stacked.
+'''
+from functools import lru_cache
+from math import ceil, sqrt
+from typing import List, NamedTuple, Tuple
+
+GRIDS = { # rows, columns
+    1: (1, 1),
+    2: (2, 1),
+    3: (3, 1),
+    4: (2, 2),
+    5: (3, 2),
+    6: (3, 2),
+    7: (3, 3),
+    8: (3, 3),
+    9: (3, 3),
+}
+PRECOMPUTED_IMAGES = 16
+ASPECT_PRECISION = 2 # decimals image aspect ratios are rounded to when packing, so packings are shared
+MIN_ASPECT = 10 ** -ASPECT_PRECISION # thinner images are packed as this, so rounding never gives 0
+
+
+class Canvas(NamedTuple):
+    '''
+    The size of a video and the area its images share
+    '''
+    output: Tuple[int, int]
+    area: Tuple[int, int]
+    center: Tuple[int, int] # center of the area in the video
+
+
+CANVASES = {
+    'portrait': Canvas((1080, 1920), (800, 1450), (500, 800)),
+    'square': Canvas((1080, 1080), (900, 900), (540, 540)),
+    'landscape': Canvas((1920, 1080), (1600, 900), (960, 540)),
+}
+DEFAULT_CANVAS = 'portrait'
+
+
+class Layout(NamedTuple):
+    '''
+    The grid of a number of images
+    '''
+    rows: int
+    columns: int
+    cell: Tuple[int, int] # width and height of every cell
+    positions: Tuple[Tuple[float, float], ...] # top left corner of the cell of every image in the video
+
+
+def get_grid(count: int, area: Tuple[int, int] = CANVASES[DEFAULT_CANVAS].area) -> Tuple[int, int]:
+    '''
+    Gets the number of rows and columns for `count` images
+    '''
+    if count < 1:
+        raise ValueError(f'Number of posts {count} is not supported')
+    if count in GRIDS:
+        return GRIDS[count]
+
+    width, height = area
+    columns = max(1, round(sqrt(count * width / height)))
+    return ceil(count / columns), columns
+
+
+@lru_cache(maxsize=None)
+def get_layout(count: int, canvas: Canvas = CANVASES[DEFAULT_CANVAS]) -> Layout:
+    '''
+    Gets the layout of `count` images on a canvas
+    '''
+    return make_layout(count, canvas, *get_grid(count, canvas.area))
+
+
+def make_layout(count: int, canvas: Canvas, rows: int, columns: int) -> Layout:
+    '''
+    Lays `count` images out on a grid of rows x columns
+    '''
+    width, height = canvas.area
+    positions = get_positions(count, rows, columns, canvas.area, canvas.center)
+
+    return Layout(rows, columns, (width // columns, height // rows), positions)
+
+
+@lru_cache(maxsize=None)
+def get_positions(count: int, rows: int, columns: int, dimensions: tuple, center: tuple) -> Tuple[Tuple[float, float], ...]:
+    '''
+    Gets the position of every image on a grid
+    '''
+    return tuple(get_pos(index, count, rows, columns, dimensions, center) for index in range(count))
+
+
+def get_pos(curr_index: int, num_posts: int, rows: int, columns: int, dimensions: tuple, center: tuple):
+    '''
+    Gets the position of the post
+
+    Changes depending on whether or not the post is in a full row or not
+
+    Parameters
+    i : int
+        The index of the position to get
+    n : int
+        The number of posts
+    rows : int
+        The number of rows
+    columns : int
+        The number of columns
+    dimensions : tuple (of ints)
+        The dimensions of the space to take up
+    '''
+    x_dim, y_dim = dimensions
+    x_center, y_center = center
+
+    width, height = x_dim // columns, y_dim // rows
+
+    row = curr_index // columns
+    column = curr_index % columns
+
+    x_offset = (columns * rows - num_posts) * width // 2 if row == rows - 1 else 0
+
+    x, y = column * width + x_offset, row * height
+    return x + x_center - x_dim // 2, y + y_center - y_dim / 2
+
+
+def pack_layout(sizes: List[Tuple[int, int]], canvas: Canvas = CANVASES[DEFAULT_CANVAS]) -> Layout:
+    '''
+    Gets the layout which shows the most of images of the given sizes
+
+    Parameters
+    ----------
+    sizes: list
+        The width and height of every image, images without a size are packed as squares
+    canvas: Canvas
+        The canvas the images are laid out on
+    '''
+    aspects = tuple(
+        max(round(width / height, ASPECT_PRECISION), MIN_ASPECT) if width > 0 and height > 0 else 1.0
+        for width, height in sizes
+    )
+    return get_packed_layout(aspects, canvas)
+
+
+@lru_cache(maxsize=None)
+def get_packed_layout(aspects: Tuple[float, ...], canvas: Canvas) -> Layout:
+    '''
+    Gets the layout which shows the most of images with the given aspect ratios
+
+    The usual grid wins ties
+    '''
+    count = len(aspects)
+    width, height = canvas.area
+
+    grids = [get_grid(count, canvas.area)]
+    for columns in range(1, count + 1):
+        rows = ceil(count / columns)
+        if (rows - 1) * columns < count and (rows, columns) not in grids:
+            grids.append((rows, columns))
+
+    def get_shown(grid):
+        rows, columns = grid
+        cell_width, cell_height = width / columns, height / rows
+        # Each image is scaled to fit its cell, so it shows as much as its aspect allows
+        return sum(min(cell_width, cell_height * aspect) * min(cell_height, cell_width / aspect) for aspect in aspects)
+
+    return make_layout(count, canvas, *max(grids, key=get_shown))
+
+
+for _canvas in CANVASES.values():
+    for _count in range(1, PRECOMPUTED_IMAGES + 1):
+        get_layout(_count, _canvas)
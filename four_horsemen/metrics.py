@@ -0,0 +1,163 @@
+'''
+Timings and counters for every stage of the generators
+
+Each stage (download, probe, captions, filtergraph, encode, save) is timed
+with `METRICS.timer`. Encodes also get the frame rate and speed ffmpeg
+reported while it ran (see `four_horsemen.process`). Every event is appended
+to a JSON Lines file, and a run ends with a summary table and, optionally, a
+Prometheus textfile. Together they show whether a slow batch is waiting on the network, on
+decoding or on encoding.
+'''
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from time import perf_counter, time
+from typing import Iterator
+
+from four_horsemen.cache import atomic_path
+from four_horsemen.store import RecordSink
+
+
+class Metrics:
+    '''
+    Thread safe aggregates of stage timings, numeric fields and counters
+
+    Only sums are kept in memory, the individual events go to the JSON Lines
+    file given to `open`
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sink = None
+        self.reset()
+
+    def reset(self):
+        '''
+        Forgets everything recorded so far
+        '''
+        with self.lock:
+            self.stages = defaultdict(lambda: {'count': 0, 'failed': 0, 'seconds': 0.0, 'max': 0.0})
+            self.fields = defaultdict(lambda: defaultdict(lambda: [0.0, 0])) # stage -> field -> [sum, count]
+            self.counters = defaultdict(float)
+            self.start = perf_counter()
+
+    def open(self, path: str = None):
+        '''
+        Appends every event to a JSON Lines file from now on (None stops)
+        '''
+        self.sink = RecordSink(path) if path else None
+
+    @contextmanager
+    def timer(self, stage: str, **labels) -> Iterator[dict]:
+        '''
+        Times the body of a with statement as a stage
+
+        Yields a dictionary the body can add fields to, such as the progress
+        ffmpeg reported for an encode. The labels (ids, part numbers) are
+        written with the event but never averaged
+        '''
+        fields = dict(labels)
+        start = perf_counter()
+        failed = False
+        try:
+            yield fields
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            measured = {field: value for field, value in fields.items() if field not in labels}
+            self.observe(stage, perf_counter() - start, failed=failed, labels=labels, **measured)
+
+    def observe(self, stage: str, seconds: float, failed: bool = False, labels: dict = None, **fields):
+        '''
+        Records one run of a stage
+
+        Numeric fields are averaged in the summary, `labels` only go to the
+        JSON Lines file
+        '''
+        with self.lock:
+            stats = self.stages[stage]
+            stats['count'] += 1
+            stats['failed'] += int(failed)
+            stats['seconds'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+
+            for field, value in fields.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self.fields[stage][field][0] += value
+                    self.fields[stage][field][1] += 1
+
+        if self.sink:
+            self.sink.append({'time': time(), 'stage': stage, 'seconds': round(seconds, 4),
+                              'failed': failed, **(labels or {}), **fields})
+
+    def count(self, name: str, value: float = 1):
+        '''
+        Adds to a counter
+        '''
+        with self.lock:
+            self.counters[name] += value
+
+    def summary(self) -> str:
+        '''
+        Gets a table of every stage and counter
+        '''
+        elapsed = perf_counter() - self.start
+        lines = [
+            f'{"stage":<12} {"count":>6} {"failed":>6} {"total s":>9} {"mean s":>8} {"max s":>8} {"share":>6}  averages',
+        ]
+
+        with self.lock:
+            for stage, stats in sorted(self.stages.items(), key=lambda item: -item[1]['seconds']):
+                averages = ' '.join(
+                    f'{field}={total / count:.2f}'
+                    for field, (total, count) in self.fields[stage].items() if count
+                )
+                lines.append(
+                    f'{stage:<12} {stats["count"]:>6} {stats["failed"]:>6} {stats["seconds"]:>9.1f}'
+                    f' {stats["seconds"] / stats["count"]:>8.2f} {stats["max"]:>8.2f}'
+                    f' {stats["seconds"] / elapsed:>6.0%}  {averages}'
+                )
+
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'{name:<12} {value:>6g}')
+
+        lines.append(f'wall clock {elapsed:.1f} s (stages overlap when run in parallel)')
+        return '\n'.join(lines)
+
+    def write_prometheus(self, path: str, prefix: str = 'four_horsemen'):
+        '''
+        Writes every stage and counter in the Prometheus textfile format
+        '''
+        lines = [
+            f'# TYPE {prefix}_stage_seconds_total counter',
+            f'# TYPE {prefix}_stage_runs_total counter',
+            f'# TYPE {prefix}_stage_failures_total counter',
+        ]
+
+        with self.lock:
+            for stage, stats in sorted(self.stages.items()):
+                lines.append(f'{prefix}_stage_seconds_total{{stage="{stage}"}} {stats["seconds"]:.6f}')
+                lines.append(f'{prefix}_stage_runs_total{{stage="{stage}"}} {stats["count"]}')
+                lines.append(f'{prefix}_stage_failures_total{{stage="{stage}"}} {stats["failed"]}')
+
+                for field, (total, count) in sorted(self.fields[stage].items()):
+                    if count:
+                        lines.append(f'{prefix}_stage_{field}_mean{{stage="{stage}"}} {total / count:.6f}')
+
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'{prefix}_{name}_total {value:g}')
+
+        with atomic_path(path) as tmp_path, open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write('\n'.join(lines) + '\n')
+
+    def report(self, prometheus: str = None):
+        '''
+        Prints the summary at the end of a run and writes the Prometheus textfile
+        '''
+        print(self.summary())
+        if prometheus:
+            self.write_prometheus(prometheus)
+
+
+METRICS = Metrics()
@@ -9,14 +9,30 @@ python3 four_horsemen/multi_meme.py -i subreddits.txt -b backgrounds\
     -n 50 -l 30 -m meta.xlsx -o output
 """
 import os
+from functools import lru_cache
 from typing import List
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import time
 from argparse import ArgumentParser
-from random import choice, randint, random, shuffle
+import random
+from random import Random, randint
 
+import numpy as np
 import pandas as pd
-import shutup
-
-from four_horsemen.utils import get_posts, download_image, get_media_length
+import requests
+
+from four_horsemen.assets import prescale_images
+from four_horsemen.backgrounds import BackgroundIndex
+from four_horsemen.filtergraph import Filter, FilterGraph, Param, Template, filter_args
+from four_horsemen.layout import CANVASES, DEFAULT_CANVAS, Canvas, Layout, get_grid, get_layout, get_pos, \
+    get_positions, pack_layout
+from four_horsemen.metrics import METRICS
+from four_horsemen.process import ProcessError, run_ffmpeg
+from four_horsemen.profiles import PROFILES, get_encoder_args
+from four_horsemen.proxies import TARGETS, get_fill_filter
+from four_horsemen.store import RecordSink
+from four_horsemen.utils import get_posts, download_image, get_dimensions, get_media_length, get_seek_args, \
+    get_worker_count
 
 ALLOWED_IMG_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif']
 ALLOWED_VIDEO_EXTENSIONS = ['mp4', 'mov', 'avi', 'mkv']
@@ -31,16 +47,35 @@ API_KEYS_OF_INTEREST = ['id', 'subreddit', 'title', 'ups', 'downs',
 NUM_IMAGES = [ i for i in range(1, 5) ]
 BACKGROUND_SPEED = [0, 0.5, 1, 1.5, 2, 2.5, 3]
 LENGTHS = [5, 10, 15]
+ID_RANGE = 1000000 # video ids are drawn from 0 to this, without repeats
 
 DIMENSIONS = {
-    'output': (1080, 1920),
-    'imgs': (800, 1450),
-    'imgs_center': (500, 800)
+    'output': CANVASES[DEFAULT_CANVAS].output,
+    'imgs': CANVASES[DEFAULT_CANVAS].area,
+    'imgs_center': CANVASES[DEFAULT_CANVAS].center,
 }
 
 SMALLER = 20
 RAND_SHIFT = 15
 
+HARVEST_WORKERS = 16
+PREFETCH_WORKERS = 8
+FFMPEG_THREADS = 4 # threads given to each ffmpeg process when sizing the pool
+DEFAULT_PROFILE = 'archive'
+FLUSH_ROWS = 10000 # posts kept in memory before streaming them out to parquet
+
+POST_TYPES = {
+    'id': 'string',
+    'subreddit': 'string',
+    'title': 'string',
+    'ups': 'Int64',
+    'downs': 'Int64',
+    'upvote_ratio': 'float64',
+    'permalink': 'string',
+    'url': 'string',
+    'from': 'string',
+}
+
 # IMPLEMENTATION
 
 def main():
@@ -49,17 +84,15 @@ def main():
     """
     args = get_args()
     args = parse_args(args)
+    METRICS.open(args.metrics)
 
-    os.system('rm tmp/*')
-    os.system(f'rm {args.output}/*')
+    clear_directory('tmp')
+    clear_directory(args.output)
 
     subreddits = [
         f for f in open(args.input, 'r', encoding='utf-8').read().strip().split('\n')
         ]
-    backgrounds = [
-        f for f in os.listdir(args.backgrounds)
-        if any(f.endswith(ext) for ext in ALLOWED_VIDEO_EXTENSIONS)
-        ]
+    backgrounds = BackgroundIndex(args.backgrounds, ALLOWED_VIDEO_EXTENSIONS, get_proxy_target(CANVASES[args.canvas]))
     audios = [
         f for f in os.listdir(args.audio)
         if any(f.endswith(ext) for ext in ALLOWED_AUDIO_EXTENSIONS)
@@ -70,10 +103,12 @@ def main():
     print(f'Found {len(subreddits)} subreddits')
 
     if os.path.isfile(args.meta):
-        frame = pd.read_excel(args.meta, index_col=False)
+        frame = read_meta(args.meta)
+    elif args.meta.endswith('.parquet'):
+        frame = get_subreddits(args, subreddits, args.meta)
     else:
         frame = get_subreddits(args, subreddits)
-        frame.to_excel(args.meta, index=False)
+        write_meta(frame, args.meta)
 
     # Determines the number of videos per subreddit
     videos_per_subreddit = int(args.number) // len(subreddits) + 1
@@ -81,25 +116,36 @@ def main():
     print("--------------------------------------------------")
     print(f'Creating {videos_per_subreddit} videos per subreddit')
 
-    video_info = make_info(frame, backgrounds, audios, videos_per_category)
+    video_info = make_info(frame, backgrounds, audios, videos_per_category, args.batch, args.seed,
+                           list(range(1, args.images + 1)), args.canvas)
+
+    Random(args.seed).shuffle(video_info)
+
+    video_sink = RecordSink('video_info.jsonl', key='id')
+    success_sink = RecordSink('success.jsonl', key='id')
+    failed_sink = RecordSink('failed.jsonl', key='id')
 
-    shuffle(video_info)
+    # The videos of earlier runs were removed with the output, so are their records
+    for sink in [video_sink, success_sink, failed_sink]:
+        sink.clear()
 
-    pd.DataFrame(video_info).to_excel('video_info.xlsx', index=False)
+    video_sink.extend(video_info)
 
     print("--------------------------------------------------")
-    success, failed = create_videos(video_info, args.output)
+    jobs = get_worker_count(args.jobs, FFMPEG_THREADS)
+    print(f'Rendering {jobs} {"batches of videos" if args.batch > 1 else "videos"} at a time')
+
+    success, failed = create_videos(video_info, args.output, jobs, profile=args.profile, pack=args.pack,
+                                    success_sink=success_sink, failed_sink=failed_sink)
 
     print(f'Successfully created {len(success):4d} videos')
     print(f'Failed to create     {len(failed):4d} videos')
 
-    success = pd.DataFrame(success)
-    success['posted'] = False
-    success['posted_at'] = None
-    success.to_excel('success.xlsx', index=False)
+    if args.export:
+        for sink in [video_sink, success_sink, failed_sink]:
+            sink.export(sink.path.replace('.jsonl', f'.{args.export}'))
 
-    failed = pd.DataFrame(failed)
-    failed.to_excel('failed.xlsx', index=False)
+    METRICS.report(args.prometheus)
 
 
 def get_args():
@@ -112,9 +158,20 @@ def get_args():
     args.add_argument('-n', '--number', help='Number of memes to create', default=50)
     args.add_argument('-l', '--length', help='Length of the output video in seconds', default=30)
     args.add_argument('-t', '--token', help='Token for Reddit API') # Could be optional
-    args.add_argument('-m', '--meta', help='Meta data for each video', default='meta.xlsx')
+    args.add_argument('-m', '--meta', help='Meta data for each video (xlsx, csv or parquet)', default='meta.xlsx')
     args.add_argument('-a', '--audio', help='Audio directory', default='audios')
     args.add_argument('-o', '--output', help='Output directory', default='output')
+    args.add_argument('-p', '--profile', help='Encoding profile', default=DEFAULT_PROFILE, choices=PROFILES)
+    args.add_argument('--metrics', help='JSON Lines file every stage timing is appended to', default='metrics.jsonl')
+    args.add_argument('--prometheus', help='Also write the metrics of the run to this Prometheus textfile')
+    args.add_argument('-x', '--export', help='Also export the video info and results at the end', choices=['xlsx', 'csv', 'json'])
+    args.add_argument('-j', '--jobs', help='Videos to render at once (0 picks from the core count)', default=0, type=int)
+    args.add_argument('-w', '--workers', help='Reddit requests to make at once', default=HARVEST_WORKERS, type=int)
+    args.add_argument('-k', '--images', help='Most images in one video', default=max(NUM_IMAGES), type=int)
+    args.add_argument('--canvas', help='Size of the videos', default=DEFAULT_CANVAS, choices=CANVASES)
+    args.add_argument('--pack', help='Pick the grid which fits the sizes of the images best', action='store_true')
+    args.add_argument('--seed', help='Seed for planning the videos, the same seed makes the same plan', type=int)
+    args.add_argument('--batch', help='Videos rendered by one ffmpeg process, sharing a background and audio', default=1, type=int)
 
     args = args.parse_args()
     return args
@@ -127,140 +184,556 @@ def parse_args(args):
     return args
 
 
-def get_subreddits(args, subreddits: List[str]) -> pd.DataFrame:
+def get_proxy_target(canvas: Canvas):
     """
-    Gets the releavant posts from the subreddits
+    Gets the proxies backgrounds are read from for a canvas
+
+    The proxies are cropped to the portrait canvas, other canvases use the
+    original backgrounds so they are not cropped and scaled back up
     """
-    frame = pd.DataFrame(columns=API_KEYS_OF_INTEREST + ['from'])
+    size = TARGETS['multi_meme']
+    return 'multi_meme' if canvas.output == (size['width'], size['height']) else None
 
-    for subreddit in subreddits:
-        for post_type in REQUESTYPES:
-            try:
-                posts = get_posts(subreddit, post_type, args.number, args.token)
-            except TimeoutError:
-                print(f'Failed to get posts for {post_type} for {subreddit}')
+
+def read_meta(path: str) -> pd.DataFrame:
+    """
+    Reads previously harvested posts based on the ending of the path
+    """
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    elif path.endswith('.csv'):
+        return pd.read_csv(path, dtype=POST_TYPES) # ids which look like numbers stay strings
+
+    return pd.read_excel(path, index_col=False)
+
+
+def write_meta(frame: pd.DataFrame, path: str):
+    """
+    Saves harvested posts in the format given by the ending of the path
+    """
+    if path.endswith('.parquet'):
+        frame.to_parquet(path, index=False)
+    elif path.endswith('.csv'):
+        frame.to_csv(path, index=False)
+    else:
+        frame.to_excel(path, index=False)
+
+
+def get_subreddits(args, subreddits: List[str], path: str = None) -> pd.DataFrame:
+    """
+    Gets the releavant posts from the subreddits
+
+    Every (subreddit, request type) pair is fetched concurrently, the results
+    are then filtered in the same order as the serial loop
+
+    Parameters
+    ----------
+    path: str
+        Optional parquet file to stream the posts into as they are harvested
+    """
+    buffer = PostBuffer(path)
+
+    with ThreadPoolExecutor(max_workers=getattr(args, 'workers', HARVEST_WORKERS)) as pool:
+        requests_made = [
+            (subreddit, post_type,
+             pool.submit(get_posts, subreddit, post_type, args.number, args.token))
+            for subreddit in subreddits
+            for post_type in REQUESTYPES
+        ]
+
+    for subreddit, post_type, request in requests_made:
+        try:
+            posts = request.result()
+        except (TimeoutError, requests.RequestException, ValueError):
+            print(f'Failed to get posts for {post_type} for {subreddit}')
+            continue
+
+        for post in posts:
+            ending = post['url'].split('.')[-1]
+
+            if ending not in ALLOWED_IMG_EXTENSIONS:
                 continue
 
-            for post in posts:
-                ending = post['url'].split('.')[-1]
+            buffer.add(
+                {key: post[key] for key in API_KEYS_OF_INTEREST} |
+                {
+                    'from': post_type,
+                }
+            )
 
-                if ending not in ALLOWED_IMG_EXTENSIONS:
-                    continue
+    return buffer.close()
 
-                with shutup.mute_warnings:
-                    frame = frame.append(
-                        {key: post[key] for key in API_KEYS_OF_INTEREST} |
-                        {
-                            'from': post_type, 
-                        }
-                , ignore_index=True)
 
-    return frame
+class PostBuffer:
+    """
+    Collects harvested posts column by column and builds the frame once
+
+    Appending a row to a DataFrame copies the whole frame, so rows are kept
+    as one list per column instead. When a parquet path is given the columns
+    are streamed out every FLUSH_ROWS posts to keep memory bounded.
+    """
+
+    def __init__(self, path: str = None, flush_rows: int = FLUSH_ROWS):
+        self.path = path
+        self.flush_rows = flush_rows
+        self.columns = {key: [] for key in POST_TYPES}
+        self.writer = None
+        self.rows = 0
+
+    def add(self, post: dict):
+        """
+        Adds a single post
+        """
+        for key, column in self.columns.items():
+            column.append(post.get(key))
+        self.rows += 1
+
+        if self.path and len(self.columns['id']) >= self.flush_rows:
+            self.flush()
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Builds a frame from the posts still held in memory
+        """
+        return pd.DataFrame(self.columns).astype(POST_TYPES)
+
+    def flush(self):
+        """
+        Writes the posts held in memory to the parquet file
+        """
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError('pyarrow is required to stream posts to parquet') from e
+
+        table = pa.Table.from_pandas(self.to_frame(), preserve_index=False)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema)
 
+        self.writer.write_table(table)
+        self.columns = {key: [] for key in POST_TYPES}
 
-def make_info(frame: pd.DataFrame, backgrounds: List, audios: List, videos_per_category: int):
+    def close(self) -> pd.DataFrame:
+        """
+        Finishes the harvest and returns every post as a frame
+        """
+        if not self.path:
+            return self.to_frame()
+
+        self.flush()
+        self.writer.close()
+        print(f'Saved {self.rows} posts to {self.path}')
+
+        return pd.read_parquet(self.path)
+
+
+def make_info(frame: pd.DataFrame, backgrounds: BackgroundIndex, audios: List, videos_per_category: int,
+              batch: int = 1, seed: int = None, num_images: List[int] = NUM_IMAGES, canvas: str = DEFAULT_CANVAS):
     """
     Makes the information for each video
-    """
-    return_array = []
 
-    for subreddit, posts in frame.groupby('subreddit'):
-        return_array += make_subreddit_info(
-            videos_per_category, posts, subreddit, backgrounds, audios
-            )
+    Parameters
+    ----------
+    batch: int
+        Number of videos which share a background and audio so they can be
+        rendered together, see `assign_batches`
+    seed: int
+        Makes the same plan for the same posts every time
+    num_images: list
+        The numbers of images a video can have
+    canvas: str
+        The size of the videos, see `four_horsemen.layout.CANVASES`
+    """
+    plan = make_plan(frame, backgrounds, audios, videos_per_category, np.random.default_rng(seed), num_images,
+                     canvas)
+    return_array = plan_to_info(plan, frame)
+
+    if batch > 1:
+        assign_batches(return_array, backgrounds, batch, Random(seed))
 
     return return_array
 
 
-def make_subreddit_info(count: int, posts: pd.DataFrame,
-    subreddit, backgrounds: List, audios: List):
+def make_plan(frame: pd.DataFrame, backgrounds: BackgroundIndex, audios: List, videos_per_category: int,
+              rng: np.random.Generator, num_images: List[int] = NUM_IMAGES,
+              canvas: str = DEFAULT_CANVAS) -> pd.DataFrame:
+    """
+    Draws the plan of every video at once
+
+    Each subreddit gets `videos_per_category` videos of every request type.
+    Every draw is made for all videos at once with numpy: the number of
+    images, which posts they show (with replacement, from the posts of the
+    video's subreddit), their positions, the length, background window, audio
+    and speed.
+
+    Returns one row per video. The posts are the rows of `frame` in the
+    columns image0, image1, ... (-1 when the video has fewer images) and
+    their positions are in x0, y0, x1, y1, ...
+    """
+    codes, subreddits = pd.factorize(frame['subreddit'], sort=True)
+    posts = np.argsort(codes, kind='stable') # rows of frame grouped by subreddit
+    counts = np.bincount(codes, minlength=len(subreddits))
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    per_subreddit = len(REQUESTYPES) * videos_per_category
+    videos = len(subreddits) * per_subreddit
+    subreddit = np.repeat(np.arange(len(subreddits)), per_subreddit)
+    category = np.tile(np.repeat(np.arange(len(REQUESTYPES)), videos_per_category), len(subreddits))
+
+    max_images = max(num_images)
+    n = rng.choice(num_images, videos)
+    picks = (rng.random((videos, max_images)) * counts[subreddit, None]).astype(np.int64)
+    images = posts[offsets[subreddit, None] + picks]
+    empty = np.arange(max_images) >= n[:, None]
+    images[empty] = -1
+
+    shifts = SMALLER + rng.integers(-RAND_SHIFT, RAND_SHIFT + 1, (videos, max_images, 2))
+    positions = get_layout_table(max_images, CANVASES[canvas])[n] + shifts
+    positions[empty] = 0
+
+    length = rng.choice(LENGTHS, videos)
+    background = np.empty(videos, dtype=object)
+    background_start = np.empty(videos)
+    for value in LENGTHS:
+        chosen = length == value
+        background[chosen], background_start[chosen] = backgrounds.sample_many(value, chosen.sum(), rng)
+
+    plan = pd.DataFrame({
+        'id': rng.choice(ID_RANGE, videos, replace=False),
+        'subreddit': pd.Categorical.from_codes(subreddit, subreddits),
+        'category': pd.Categorical.from_codes(category, REQUESTYPES),
+        'n': n.astype(np.int8),
+        'audio': pd.Categorical.from_codes(rng.integers(len(audios), size=videos), audios),
+        'background': pd.Categorical(background),
+        'background_start': background_start,
+        'speed': np.array(BACKGROUND_SPEED)[rng.integers(len(BACKGROUND_SPEED), size=videos)],
+        'length': length.astype(np.int16),
+        'canvas': pd.Categorical.from_codes(np.zeros(videos, dtype=np.int8), [canvas]),
+    })
+    for i in range(max_images):
+        plan[f'image{i}'] = images[:, i].astype(np.int32)
+        plan[f'x{i}'] = positions[:, i, 0].astype(np.int16)
+        plan[f'y{i}'] = positions[:, i, 1].astype(np.int16)
+
+    return plan
+
+
+def plan_to_info(plan: pd.DataFrame, frame: pd.DataFrame) -> List[dict]:
+    """
+    Turns a plan into the information of every video
+    """
+    max_images = sum(column.startswith('image') for column in plan.columns)
+    urls = frame['url'].to_numpy(dtype=object)
+    images = plan[[f'image{i}' for i in range(max_images)]].to_numpy()
+    positions = np.stack([plan[[f'x{i}', f'y{i}']].to_numpy() for i in range(max_images)], axis=1)
+
+    columns = {key: plan[key].tolist() for key in
+               ['id', 'subreddit', 'category', 'n', 'audio', 'background', 'background_start', 'speed', 'length',
+                'canvas']}
+
+    return [
+        {
+            # Metadata
+            'id': columns['id'][row],
+            'subreddit': columns['subreddit'][row],
+            'category': columns['category'][row],
+
+            # Video information
+            'images': urls[images[row, :count]].tolist(),
+            'positions': positions[row, :count].tolist(),
+            'n': count,
+            'audio': columns['audio'][row],
+            'background': columns['background'][row],
+            'background_start': columns['background_start'][row],
+            'speed': columns['speed'][row],
+            'length': columns['length'][row],
+            'canvas': columns['canvas'][row],
+        }
+        for row, count in enumerate(columns['n'])
+    ]
+
+
+@lru_cache(maxsize=None)
+def get_layout_table(max_images: int, canvas: Canvas = CANVASES[DEFAULT_CANVAS]) -> np.ndarray:
     """
-    Makes a list of dictionaries containing the information for each video
+    Gets the position of every image of every layout with up to `max_images` images
+
+    Indexed by [number of images, image, (x, y)], unused images are at 0
     """
-    return_array = []
+    table = np.zeros((max_images + 1, max_images, 2), dtype=np.int64)
+    for count in range(1, max_images + 1):
+        table[count, :count] = get_layout(count, canvas).positions
 
-    for category in REQUESTYPES:
-        for _ in range(count):
-            return_array.append(make_video_info(posts, subreddit, backgrounds, audios, category))
+    return table
 
-    return return_array
 
+def assign_batches(info: List[dict], backgrounds: BackgroundIndex, batch: int, rng: Random = random):
+    """
+    Groups videos so each group shares one background and audio
+
+    Every group gets a single background window long enough for all of its
+    videos, which then take consecutive parts of it. The audio is shared the
+    same way when the group is rendered. Each video is tagged with the id of
+    the first video of its group as `batch`.
+    """
+    for first in range(0, len(info), batch):
+        group = info[first:first + batch]
+        background, background_start = backgrounds.sample(sum(i['length'] for i in group), rng)
+
+        for i in group:
+            i |= {
+                'batch': group[0]['id'],
+                'background': background,
+                'background_start': background_start,
+                'audio': group[0]['audio'],
+            }
+            background_start += i['length']
 
-def make_video_info(posts: pd.DataFrame, subreddit: str,
-    backgrounds: List, audios: List, category: str) -> dict:
-    '''
-    Creates the video which can contain multiple images
-    '''
 
-    image_count = choice(NUM_IMAGES)
-    post_imgs = posts.sample(image_count, replace=True)
+def get_batches(info: List[dict]) -> List[List[dict]]:
+    """
+    Gets the groups of videos rendered together, in the order they first appear
 
-    return {
-        # Metadata
-        'id': randint(0, 1000000),
-        'subreddit': subreddit,
-        'category': category,
+    The videos of a group are put back in the order of their background
+    windows, since the info may have been shuffled. Videos without a batch
+    are rendered on their own
+    """
+    batches = {}
+    for i in info:
+        batches.setdefault(i.get('batch', ('video', i['id'])), []).append(i)
 
-        # Video information
-        'images': post_imgs['url'].tolist(),
-        'n': image_count,
-        'audio': choice(audios),
-        'background': choice(backgrounds),
-        'speed': choice(BACKGROUND_SPEED),
-        'length': choice(LENGTHS),
-    }
+    return [sorted(batch, key=lambda i: i.get('background_start', 0)) for batch in batches.values()]
 
 
-def create_videos(info: List[dict], output: str = 'output'):
+def create_videos(info: List[dict], output: str = 'output', jobs: int = 1,
+                  profile: str = DEFAULT_PROFILE, success_sink: RecordSink = None,
+                  failed_sink: RecordSink = None, pack: bool = False):
     """
     Creates the videos from the information
 
+    Up to `jobs` videos are rendered at once while the images of the videos
+    after them are downloaded in the background. Videos which share a batch
+    (see `assign_batches`) are rendered by one ffmpeg process and succeed or
+    fail together. Results are appended to the sinks as each video finishes.
+
+    With `pack` every video's grid is picked to fit the sizes of its images,
+    see `four_horsemen.layout.pack_layout`
+
     Return (sucess, failed)
     """
     sucess = []
     failed = []
-    for i in info:
-        try:
-            create_video(i, output)
-            sucess.append(i)
-        except Exception as e:
-            print('Video creation failed')
-            print(e)
-            failed.append(i)
+    if not info:
+        return sucess, failed
+
+    batches = get_batches(info)
+    jobs = max(1, min(jobs, len(batches)))
+    threads = max(1, (os.cpu_count() or 1) // jobs)
+    start = time()
+
+    with ThreadPoolExecutor(max_workers=PREFETCH_WORKERS) as prefetch, \
+         ThreadPoolExecutor(max_workers=jobs) as render:
+        # Downloads are queued in render order so they stay ahead of the encoders
+        renders = {}
+        for batch in batches:
+            downloads = [prefetch.submit(download_images, i['images']) for i in batch]
+            if len(batch) == 1:
+                renders[render.submit(render_video, batch[0], downloads[0], output, threads, profile, pack)] = batch
+            else:
+                renders[render.submit(render_batch, batch, downloads, output, threads, profile, pack)] = batch
+
+        for done in as_completed(renders):
+            try:
+                done.result()
+                error = None
+            except Exception as e:
+                print('Video creation failed')
+                print(e)
+                error = e
+
+            for i in renders[done]:
+                if error is None:
+                    sucess.append(i)
+                    METRICS.count('videos_done')
+                    with METRICS.timer('save', id=i['id']):
+                        if success_sink:
+                            success_sink.append(i | {'posted': False, 'posted_at': None})
+                else:
+                    failed.append(i)
+                    METRICS.count('videos_failed')
+                    with METRICS.timer('save', id=i['id']):
+                        if failed_sink:
+                            failed_sink.append(i)
+
+            elapsed = max(time() - start, 1e-6)
+            print(f'Finished {len(sucess) + len(failed):4d}/{len(info)} videos'
+                  f' ({len(sucess) / elapsed * 3600:.0f} videos/hour)')
+
+    elapsed = max(time() - start, 1e-6)
+    print(f'Rendered {len(sucess)} videos in {elapsed:.0f} seconds'
+          f' ({len(sucess) / elapsed * 3600:.0f} videos/hour)')
 
     return sucess, failed
 
 
-def create_video(info: dict, output: str = 'output'):
+def render_video(info: dict, download, output: str, threads: int, profile: str = DEFAULT_PROFILE,
+                 pack: bool = False):
     """
-    Creates a video from the information
+    Waits for a video's images to download and then creates it
     """
-    download_images(info['images'])
+    return create_video(info, output, images=download.result(), threads=threads, profile=profile, pack=pack)
 
-    command = [
-        'ffmpeg',
-        *get_input_settings(),
-        *get_inputs(info['images'], info['background'], info['audio']),
-        '-filter_complex', f'"{get_filter_complex(info)}"',
-        *get_output_settings(output, info['id']),
-    ]
 
-    command = ' '.join(command)
+def create_video(info: dict, output: str = 'output', images: List[str] = None, threads: int = 0,
+                 profile: str = DEFAULT_PROFILE, pack: bool = False):
+    """
+    Creates a video from the information
+
+    Parameters
+    ----------
+    images: list
+        Local paths of the images if they were already downloaded
+    threads: int
+        Number of threads ffmpeg may use (0 lets ffmpeg decide)
+    profile: str
+        Encoding profile to use, see `four_horsemen.profiles`
+    pack: bool
+        Picks the grid which fits the sizes of the images best
+    """
+    images = images or download_images(info['images'])
+    canvas = get_canvas(info)
+    layout, positions = get_video_layout(info, images, pack)
+    with METRICS.timer('prescale', id=info['id']):
+        images = prescale_images(images, get_cell_size(len(images), layout=layout))
+
+    with METRICS.timer('filtergraph', id=info['id']):
+        filter_complex = get_filter_complex(info, scaled=True, positions=positions)
+        maps = get_filter_template(len(images), True, canvas).get_map_args()
 
     print(f'Creating video for {info["id"]} with subreddit'
           f' r/{info["subreddit"]} and category {info["category"]}')
 
-    os.system(command)
+    with filter_args(filter_complex) as graph_args:
+        command = [
+            'ffmpeg',
+            *get_input_settings(),
+            *get_inputs(images, info['background'], info['background_start'], info['audio'], info['length']),
+            *graph_args,
+            *maps,
+            *get_output_settings(output, info['id'], threads, profile),
+        ]
+
+        with METRICS.timer('encode', id=info['id']) as fields:
+            try:
+                fields.update(run_ffmpeg(command).progress)
+            except ProcessError as e:
+                raise VideoCreationError(f'Failed to create video for {info["id"]}: {e}') from e
+
+    if not os.path.isfile(get_output_path(output, info['id'])):
+        raise VideoCreationError(f'Failed to create video for {info["id"]}: no output was written')
 
-    if not os.path.exists(output):
-        raise VideoCreationError(f'Failed to create video for {info["id"]}')
 
-def download_images(urls: List[str]) -> None:
+def render_batch(batch: List[dict], downloads: list, output: str, threads: int, profile: str = DEFAULT_PROFILE,
+                 pack: bool = False):
+    """
+    Waits for the images of a batch to download and then creates its videos
+    """
+    return create_batch(batch, output, images=[download.result() for download in downloads],
+                        threads=threads, profile=profile, pack=pack)
+
+
+def create_batch(batch: List[dict], output: str = 'output', images: List[List[str]] = None,
+                 threads: int = 0, profile: str = DEFAULT_PROFILE, pack: bool = False):
+    """
+    Creates several videos which share a background and audio with one ffmpeg process
+
+    The background and audio are opened and decoded once, then split to every
+    video, which trims out its own consecutive window of them. Short videos
+    spend most of their time starting ffmpeg and opening inputs, which is now
+    paid once per batch.
+
+    Parameters
+    ----------
+    batch: list
+        The information of the videos, as grouped by `assign_batches`
+    images: list
+        Local paths of the images of every video if they were already downloaded
+    threads: int
+        Number of threads ffmpeg may use (0 lets ffmpeg decide)
+    profile: str
+        Encoding profile to use, see `four_horsemen.profiles`
+    pack: bool
+        Picks the grid which fits the sizes of the images best for every video
+    """
+    images = images or [download_images(i['images']) for i in batch]
+    ids = [i['id'] for i in batch]
+    layouts = [get_video_layout(i, paths, pack) for i, paths in zip(batch, images)]
+    with METRICS.timer('prescale', id=ids[0], videos=len(batch)):
+        images = [prescale_images(paths, get_cell_size(len(paths), layout=layout))
+                  for paths, (layout, _) in zip(images, layouts)]
+
+    start = min(i['background_start'] for i in batch)
+    length = max(i['background_start'] - start + i['length'] for i in batch)
+
+    with METRICS.timer('filtergraph', id=ids[0], videos=len(batch)):
+        template = get_batch_template(tuple(len(paths) for paths in images), True, get_canvas(batch[0]))
+        params = {}
+        for k, (i, paths, (_, positions)) in enumerate(zip(batch, images, layouts)):
+            params |= get_overlay_params(len(paths), f'v{k}_', positions, get_canvas(i))
+            params |= {f'start{k}': i['background_start'] - start, f'length{k}': i['length']}
+        filter_complex = template.render(**params)
+
+    print(f'Creating {len(batch)} videos for {", ".join(str(id) for id in ids)} in one batch')
+
+    with filter_args(filter_complex) as graph_args:
+        command = [
+            'ffmpeg',
+            *get_input_settings(),
+            *get_inputs(sum(images, []), batch[0]['background'], start, batch[0]['audio'], length),
+            *graph_args,
+        ]
+        for k, id in enumerate(ids):
+            command += [
+                *template.get_map_args(template.outputs[2 * k:2 * k + 2]),
+                *get_output_settings(output, id, threads, profile),
+            ]
+
+        with METRICS.timer('encode', id=ids[0], videos=len(batch)) as fields:
+            try:
+                fields.update(run_ffmpeg(command).progress)
+            except ProcessError as e:
+                raise VideoCreationError(f'Failed to create videos for batch {ids[0]}: {e}') from e
+
+    missing = [id for id in ids if not os.path.isfile(get_output_path(output, id))]
+    if missing:
+        raise VideoCreationError(f'Failed to create videos {missing} of batch {ids[0]}: no output was written')
+
+
+def clear_directory(directory: str):
+    """
+    Removes the files left in a directory by the previous run
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            os.remove(path)
+
+def download_images(urls: List[str]) -> List[str]:
     """
     Downloads the images from the posts
+
+    Returns the local path of every image
     """
-    for url in urls:
-        download_image(url)
+    with METRICS.timer('download', images=len(urls)):
+        paths = [download_image(url) for url in urls]
+
+    for url, path in zip(urls, paths):
+        if path is None:
+            raise VideoCreationError(f'Failed to download {url}')
+
+    return paths
 
 def get_input_settings() -> List[str]:
     """
@@ -272,91 +745,159 @@ def get_input_settings() -> List[str]:
         '-loglevel', 'error',
     ]
 
-def get_output_settings(output: str, video_id: int) -> List[str]:
+def get_output_settings(output: str, video_id: int, threads: int = 0,
+                        profile: str = DEFAULT_PROFILE) -> List[str]:
     """
     Get the output settings for the FFmpeg command
     """
     return [
-        '-map', '\'[vout]\'',
-        '-map', '\'[aout]\'',
-
         '-shortest',
 
-        '-c:v', 'libx264',
-        '-preset', 'slow',
-        '-crf', '18',
-        '-pix_fmt', 'yuv420p',
-        '-c:a', 'aac',
-        '-b:a', '192k',
+        *get_encoder_args(profile, threads),
         '-movflags', '+faststart',
-        f'{output}/{video_id}.{OUTPUT_ENDING}',
+        get_output_path(output, video_id),
     ]
 
-def get_inputs(images, background, audio):
+
+def get_output_path(output: str, video_id: int) -> str:
+    """
+    Gets the file a video is written to
+    """
+    return os.path.join(output, f'{video_id}.{OUTPUT_ENDING}')
+
+def get_inputs(images, background, background_start, audio, length):
     """
     Gets the inputs for the FFmpeg command
+
+    The background and audio are seeked to their window before they are
+    opened so ffmpeg never decodes the part of them which is thrown away
+    (the background window starts on a keyframe so fast seeking is exact)
     """
     return [
-        '-i', f'../../Desktop/backgrounds/{background}',
-        '-i', f'audios/{audio}',
-        *sum([['-i', f'{os.path.join("tmp", f.split("/")[-1])}'] for f in images], []),
+        *get_seek_args(background_start, length, accurate=False), '-i', background,
+        *get_randomized_audio(audio, length),
+        *sum([['-i', f] for f in images], []),
     ]
 
-def get_filter_complex(info: dict):
+def get_filter_complex(info: dict, scaled: bool = False, positions: list = None) -> str:
     """
     Creates the filter_complex command for ffmpeg
+
+    Parameters
+    ----------
+    info: dict
+        The information for the video
+    scaled: bool
+        Whether the images were already scaled to `get_cell_size`
+    positions: list
+        Where the images go, overrides the positions of the plan
     """
-    # Gets the layout of the posts
     num_images = len(info['images'])
-    layout = get_post_layout(DIMENSIONS['imgs'], DIMENSIONS['imgs_center'], num_images)
-    x_post_dim, y_post_dim = get_media_dims(DIMENSIONS['imgs'], num_images)
-    img_filter = ','.join([
-        f'scale={x_post_dim - SMALLER}:{y_post_dim - SMALLER}:force_original_aspect_ratio=decrease',
-    ])
-    x_rand = lambda: SMALLER + randint(-RAND_SHIFT, RAND_SHIFT)
-    y_rand = lambda: SMALLER + randint(-RAND_SHIFT, RAND_SHIFT)
+    canvas = get_canvas(info)
+    params = get_overlay_params(num_images, positions=positions or info.get('positions'), canvas=canvas)
+    return get_filter_template(num_images, scaled, canvas).render(**params)
 
-    layout = [
-        f'[{i+2}:v]{img_filter},[base{i + 1}]overlay=({x + x_rand()}):({y + y_rand()})[base{i+2}]' if i > 0 else 
-        f'[2:v]{img_filter},[v0]overlay=({x + x_rand()}):({y + y_rand()})[base2]'
-        for i, (x, y) in enumerate(layout)
-        ]
 
-    length = info['length']
-    speed = info['speed']
+def get_overlay_params(num_images: int, prefix: str = '', positions: list = None,
+                       canvas: Canvas = CANVASES[DEFAULT_CANVAS]) -> dict:
+    """
+    Gets the position of every image of a layout
 
-    video_length = get_media_length(f'../../Desktop/backgrounds/{info["background"]}')
-    start_time = random() * (video_length - length)
-    end_time = start_time + length
+    Uses the positions drawn by `make_plan` when given, otherwise shifts the
+    layout randomly
+    """
+    if positions is None:
+        positions = shift_positions(get_layout(num_images, canvas).positions)
 
-    filter_complex = [
-        f'[0:v]trim={start_time:.2f}:{end_time:.2f}',
-        'setpts=PTS-STARTPTS[v0]',
+    params = {}
+    for i, (x, y) in enumerate(positions):
+        params[f'{prefix}x{i}'] = x
+        params[f'{prefix}y{i}'] = y
 
-        *layout,
-        f'[base{num_images + 1}]unsharp=3:3:1.5[vout]',
-        *get_randomized_audio(info["audio"], info["length"]),
-    ]
+    return params
+
+
+@lru_cache(maxsize=None)
+def get_filter_template(num_images: int, scaled: bool = False, canvas: Canvas = CANVASES[DEFAULT_CANVAS]) -> Template:
+    """
+    Gets the graph of a video with `num_images` images
+
+    Compiled once per image count and canvas, the parameters are the position
+    of every image (x0, y0, x1, y1, ...). The outputs are [vout] and [aout].
+    """
+    graph = FilterGraph(inputs=num_images + 2)
+    base, = graph.chain(['0:v'], ['setpts=PTS-STARTPTS', get_fill_filter(*canvas.output)])
+    base = add_overlays(graph, base, 2, num_images, scaled, canvas)
+
+    graph.chain([base], [Filter('unsharp', 3, 3, 1.5)], ['vout'])
+    graph.chain(['1:a'], ['asetpts=PTS-STARTPTS'], ['aout'])
+
+    return graph.compile()
+
+
+@lru_cache(maxsize=None)
+def get_batch_template(counts: tuple, scaled: bool = False, canvas: Canvas = CANVASES[DEFAULT_CANVAS]) -> Template:
+    """
+    Gets the graph of a batch of videos with `counts` images each
+
+    The background and audio are split to every video, which trims out its
+    window with the parameters start<k> and length<k>. The positions of the
+    images of video k are v<k>_x0, v<k>_y0, ... The outputs are the video and
+    audio of every video in turn.
+    """
+    graph = FilterGraph(inputs=sum(counts) + 2)
+    backgrounds = graph.chain(['0:v'], [get_fill_filter(*canvas.output), Filter('split', len(counts))], len(counts))
+    audios = graph.chain(['1:a'], [Filter('asplit', len(counts))], len(counts))
 
-    return ','.join(filter_complex)
+    first_input = 2
+    for k, num_images in enumerate(counts):
+        start, length = Param(f'start{k}'), Param(f'length{k}')
+        base, = graph.chain([backgrounds[k]], [Filter('trim', start=start, duration=length), 'setpts=PTS-STARTPTS'])
+        base = add_overlays(graph, base, first_input, num_images, scaled, canvas, f'v{k}_')
+        first_input += num_images
+
+        graph.chain([base], [Filter('unsharp', 3, 3, 1.5)])
+        graph.chain([audios[k]], [Filter('atrim', start=start, duration=length), 'asetpts=PTS-STARTPTS'])
+
+    return graph.compile()
+
+
+def add_overlays(graph: FilterGraph, base: str, first_input: int, num_images: int, scaled: bool = False,
+                 canvas: Canvas = CANVASES[DEFAULT_CANVAS], prefix: str = '') -> str:
+    """
+    Adds the chains which overlay the images of a layout on a background
+
+    The images are the inputs from `first_input` on and their positions the
+    parameters <prefix>x0, <prefix>y0, ... Returns the label of the result.
+    """
+    for i in range(num_images):
+        image = f'{first_input + i}:v'
+        if not scaled:
+            x_post_dim, y_post_dim = get_cell_size(num_images, canvas)
+            image, = graph.chain([image], [
+                Filter('scale', x_post_dim, y_post_dim, force_original_aspect_ratio='decrease'),
+            ])
+
+        # The base has to stay the first (main) input of the overlay
+        base, = graph.chain([base, image], [Filter('overlay', Param(f'{prefix}x{i}'), Param(f'{prefix}y{i}'))])
+
+    return base
 
 
 def get_randomized_audio(audio: str, length: int) -> List[str]:
     """
-    Gets a randomized audio file
+    Gets the input for a random window of the audio file
+
+    Audio shorter than the window (a batch shares one window for all of its
+    videos) is looped from the start instead, so no video runs out of audio
     """
     audio = f'audios/{audio}'
     audio_length = get_media_length(audio)
+    if audio_length < length:
+        return ['-stream_loop', '-1', *get_seek_args(0, length), '-i', audio]
 
-    start_time = random() * (audio_length - length)
-    end_time = start_time + length
-
-    audio_filter = [
-        f'[1:a]atrim={start_time:.2f}:{end_time:.2f}',
-        'asetpts=PTS-STARTPTS[aout]',
-    ]
-
-    return audio_filter
+    start_time = random.random() * (audio_length - length)
+    return [*get_seek_args(start_time, length), '-i', audio]
 
 def get_post_layout(dimensions: tuple, center: tuple, num_images: int):
     """
@@ -364,77 +905,68 @@ def get_post_layout(dimensions: tuple, center: tuple, num_images: int):
     """
     rows, columns = get_rows_columns(num_images)
 
-    return [
-        get_pos(post_index, num_images, rows, columns, dimensions, center)
-        for post_index in range(num_images)
-    ]
+    return list(get_positions(num_images, rows, columns, tuple(dimensions), tuple(center)))
 
-def get_media_dims(dimensions: tuple, num_images: int) -> tuple:
+
+def get_video_layout(info: dict, images: List[str], pack: bool = False) -> tuple:
     """
-    Gets the dimensions of each post
+    Gets the layout of a video and where its images go
+
+    The planned positions are used unless the layout is packed to the sizes
+    of the images, in which case new positions are shifted randomly
+
+    Returns (layout, positions)
     """
-    rows, columns = get_rows_columns(num_images)
-    width, height = dimensions
+    canvas = get_canvas(info)
+    if not pack:
+        return get_layout(len(images), canvas), info.get('positions')
 
-    return width // columns, height // rows
+    layout = pack_layout([get_dimensions(path) for path in images], canvas)
+    return layout, shift_positions(layout.positions)
 
 
-def get_pos(curr_index: int, num_posts: int, rows: int, columns: int, dimensions: tuple, center: tuple):
+def shift_positions(positions: list) -> list:
+    """
+    Shifts every position of a layout by a random amount
     """
-    Gets the position of the post
+    x_rand = lambda: SMALLER + randint(-RAND_SHIFT, RAND_SHIFT)
+    y_rand = lambda: SMALLER + randint(-RAND_SHIFT, RAND_SHIFT)
 
-    Changes depending on whether or not the post is in a full row or not
+    return [(x + x_rand(), y + y_rand()) for x, y in positions]
 
-    Parameters
-    i : int
-        The index of the position to get
-    n : int
-        The number of posts
-    rows : int
-        The number of rows
-    columns : int
-        The number of columns
-    dimensions : tuple (of ints)
-        The dimensions of the space to take up
+
+def get_canvas(info: dict) -> Canvas:
+    """
+    Gets the canvas a video is planned on
+    """
+    return CANVASES[info.get('canvas', DEFAULT_CANVAS)]
+
+
+def get_cell_size(num_images: int, canvas: Canvas = CANVASES[DEFAULT_CANVAS], layout: Layout = None) -> tuple:
     """
-    x_dim, y_dim = dimensions
-    x_center, y_center = center
+    Gets the size each image is scaled to fit inside
 
-    width, height = x_dim // columns, y_dim // rows
+    Uses `layout` when the images were packed
+    """
+    x_post_dim, y_post_dim = (layout or get_layout(num_images, canvas)).cell
+    return x_post_dim - SMALLER, y_post_dim - SMALLER
 
-    row = curr_index // columns
-    column = curr_index % columns
 
-    x_offset = (columns * rows - num_posts) * width // 2 if row == rows - 1 else 0
+def get_media_dims(dimensions: tuple, num_images: int) -> tuple:
+    """
+    Gets the dimensions of each post
+    """
+    rows, columns = get_rows_columns(num_images)
+    width, height = dimensions
 
-    x, y = column * width + x_offset, row * height
-    return x + x_center - x_dim // 2, y + y_center - y_dim / 2
+    return width // columns, height // rows
 
 
 def get_rows_columns(num_posts: int):
     """
     Gets the number of rows and columns for the posts
     """
-    if num_posts == 1:
-        return 1, 1
-    elif num_posts == 2:
-        return 2, 1
-    elif num_posts == 3:
-        return 3, 1
-    elif num_posts == 4:
-        return 2, 2
-    elif num_posts == 5:
-        return 3, 2
-    elif num_posts == 6:
-        return 3, 2
-    elif num_posts == 7:
-        return 3, 3
-    elif num_posts == 8:
-        return 3, 3
-    elif num_posts == 9:
-        return 3, 3
-    else:
-        raise ValueError(f'Number of posts {num_posts} is not supported')
+    return get_grid(num_posts, DIMENSIONS['imgs'])
 
 
 class VideoCreationError(Exception):
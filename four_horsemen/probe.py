@@ -0,0 +1,155 @@
+'''
+Probes media files once with ffprobe and caches the results
+
+Every file is probed with a single ffprobe call which returns the duration,
+dimensions, frame rate and codecs from the container and stream headers.
+Keyframe timestamps need every keyframe of the video to be read, so they are
+only found when asked for (backgrounds need them, sources and audio do not).
+Results are kept in an in-memory LRU and on disk, keyed by path, modification
+time and size, so an unchanged file is never probed twice.
+'''
+import json
+import os
+from functools import lru_cache
+from hashlib import sha1
+from typing import NamedTuple, Tuple
+
+from four_horsemen.cache import get_cache_dir, read_meta, write_meta
+from four_horsemen.process import ProcessError, run
+
+PROBE_VERSION = 2 # bump when MediaInfo changes to invalidate the disk cache
+LRU_SIZE = 1024
+PROBE_TIMEOUT = 60 # seconds, only the headers are read
+KEYFRAME_TIMEOUT = 300 # seconds, finding every keyframe of a long file takes a while
+
+PROBE_ENTRIES = ':'.join([
+    'format=duration',
+    'stream=index,codec_type,codec_name,width,height,avg_frame_rate,r_frame_rate,duration',
+    'stream_disposition=attached_pic',
+])
+KEYFRAME_ARGS = ['-select_streams', 'v:0', '-skip_frame', 'nokey', '-show_entries', 'frame=pts_time']
+
+
+class MediaInfo(NamedTuple):
+    '''
+    Everything the generators need to know about a media file
+    '''
+    duration: float
+    width: int
+    height: int
+    fps: float
+    video_codec: str
+    audio_codec: str
+    keyframes: Tuple[float, ...] = () # only found when probed with keyframes=True
+
+
+def probe(path: str, keyframes: bool = False) -> MediaInfo:
+    '''
+    Gets the information for a media file, probing it only when needed
+
+    Parameters
+    ----------
+    path: str
+        The media file
+    keyframes: bool
+        Also finds the timestamps of the keyframes of the video, which reads
+        every keyframe of the file
+    '''
+    stat = os.stat(path)
+    return _probe(os.path.abspath(path), stat.st_mtime_ns, stat.st_size, keyframes)
+
+
+@lru_cache(maxsize=LRU_SIZE)
+def _probe(path: str, mtime: int, size: int, keyframes: bool = False) -> MediaInfo:
+    '''
+    Probes a file unless it is already in the disk cache
+
+    The modification time and size are part of the key, so a changed file
+    misses both the LRU and the disk cache
+    '''
+    key = sha1(f'{PROBE_VERSION}:{path}:{mtime}:{size}:{keyframes}'.encode('utf-8')).hexdigest()
+    cache_path = os.path.join(get_cache_dir('probe'), f'{key}.json')
+
+    cached = read_meta(cache_path)
+    try:
+        return MediaInfo(**{**cached, 'keyframes': tuple(cached['keyframes'])})
+    except (TypeError, KeyError):
+        pass
+
+    info = parse_probe(run_ffprobe(path))
+    if keyframes:
+        info = info._replace(keyframes=parse_keyframes(run_ffprobe(path, KEYFRAME_ARGS, KEYFRAME_TIMEOUT)))
+
+    write_meta(cache_path, info._asdict())
+    return info
+
+
+def run_ffprobe(path: str, args: list = None, timeout: float = PROBE_TIMEOUT) -> dict:
+    '''
+    Runs ffprobe on a file and returns its json output
+
+    Reads the headers (PROBE_ENTRIES) unless other options are given
+    '''
+    args = args or ['-show_entries', PROBE_ENTRIES]
+    try:
+        result = run(['ffprobe', '-v', 'error', '-print_format', 'json', *args, path], timeout=timeout)
+    except ProcessError as e:
+        raise ProbeError(f'ffprobe failed for {path}: {e}') from e
+
+    return json.loads(result.stdout)
+
+
+def parse_probe(output: dict) -> MediaInfo:
+    '''
+    Converts ffprobe's json output into a MediaInfo
+    '''
+    streams = output.get('streams', [])
+
+    # Cover art in audio files shows up as a video stream
+    video = next((
+        s for s in streams
+        if s.get('codec_type') == 'video' and not s.get('disposition', {}).get('attached_pic')
+        ), {})
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), {})
+
+    duration = output.get('format', {}).get('duration') or video.get('duration') \
+        or audio.get('duration') or 0
+
+    return MediaInfo(
+        duration=float(duration),
+        width=int(video.get('width', 0)),
+        height=int(video.get('height', 0)),
+        fps=parse_rate(video.get('avg_frame_rate') or video.get('r_frame_rate')),
+        video_codec=video.get('codec_name', ''),
+        audio_codec=audio.get('codec_name', ''),
+    )
+
+
+def parse_keyframes(output: dict) -> Tuple[float, ...]:
+    '''
+    Gets the sorted keyframe timestamps from ffprobe's json output of KEYFRAME_ARGS
+    '''
+    return tuple(sorted(
+        float(frame['pts_time']) for frame in output.get('frames', [])
+        if frame.get('pts_time') not in (None, 'N/A')
+    ))
+
+
+def parse_rate(rate: str) -> float:
+    '''
+    Parses an ffprobe frame rate such as 30000/1001
+    '''
+    if not rate:
+        return 0.0
+
+    numerator, _, denominator = rate.partition('/')
+    if not denominator:
+        return float(numerator)
+
+    return float(numerator) / float(denominator) if float(denominator) else 0.0
+
+
+class ProbeError(Exception):
+    '''
+    Raised when ffprobe cannot read a file
+    '''
@@ -0,0 +1,212 @@
+'''
+Runs ffmpeg, ffprobe and the other tools the generators call
+
+Commands are argument lists run without a shell, so paths with spaces or
+quotes need no escaping and no shell is started for every call. Each call
+returns a `ProcessResult` and raises `ProcessError` when the tool fails.
+
+ffmpeg writes its progress to a pipe which is read as it arrives. The latest
+frame count, frame rate and speed are handed to a callback as they come in,
+and an encode which stops making progress is killed instead of hanging the
+run.
+'''
+import queue
+import subprocess
+import threading
+from collections import deque
+from time import monotonic
+from typing import Callable, Dict, List, NamedTuple
+
+STALL_TIMEOUT = 120 # seconds an encode may go without encoding a frame
+STDERR_LINES = 20 # lines of stderr kept for error messages
+PROGRESS_FIELDS = {'frame': 'frames', 'fps': 'fps', 'speed': 'speed'}
+
+
+class ProcessResult(NamedTuple):
+    '''
+    What happened to a finished process
+    '''
+    argv: List[str]
+    returncode: int
+    seconds: float
+    stdout: str
+    stderr: str
+    progress: Dict[str, float]
+    killed: str # why the process was killed, empty when it exited by itself
+
+    @property
+    def ok(self) -> bool:
+        '''
+        Whether the process exited successfully
+        '''
+        return self.returncode == 0 and not self.killed
+
+
+def run(argv: List[str], timeout: float = None, check: bool = True) -> ProcessResult:
+    '''
+    Runs a command and captures its output
+
+    Parameters
+    ----------
+    argv: list
+        The command and its arguments
+    timeout: float
+        Seconds after which the process is killed
+    check: bool
+        Raises ProcessError when the process fails
+    '''
+    start = monotonic()
+    try:
+        completed = subprocess.run(argv, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, timeout=timeout, check=False)
+        result = ProcessResult(argv, completed.returncode, monotonic() - start, decode(completed.stdout),
+                               decode(completed.stderr), {}, '')
+    except subprocess.TimeoutExpired as e:
+        result = ProcessResult(argv, -9, monotonic() - start, decode(e.stdout), decode(e.stderr), {},
+                               f'timed out after {timeout:.0f} seconds')
+    except OSError as e:
+        result = ProcessResult(argv, 127, monotonic() - start, '', str(e), {}, '')
+
+    if check and not result.ok:
+        raise ProcessError(result)
+
+    return result
+
+
+def run_ffmpeg(argv: List[str], timeout: float = None, stall_timeout: float = STALL_TIMEOUT,
+               on_progress: Callable[[Dict[str, float]], None] = None, check: bool = True) -> ProcessResult:
+    '''
+    Runs ffmpeg while reading its progress
+
+    Parameters
+    ----------
+    argv: list
+        The ffmpeg command, starting with the ffmpeg executable
+    timeout: float
+        Seconds after which ffmpeg is killed
+    stall_timeout: float
+        Seconds ffmpeg may go without encoding a frame before it is killed
+    on_progress: callable
+        Called with the latest progress (see `parse_progress`) every time
+        ffmpeg reports it
+    check: bool
+        Raises ProcessError when ffmpeg fails
+    '''
+    argv = [argv[0], '-nostats', '-progress', 'pipe:1', *argv[1:]]
+    start = monotonic()
+
+    try:
+        process = subprocess.Popen(argv, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, text=True, errors='replace')
+    except OSError as e:
+        result = ProcessResult(argv, 127, monotonic() - start, '', str(e), {}, '')
+        if check:
+            raise ProcessError(result) from e
+        return result
+
+    lines = queue.Queue()
+    stderr = deque(maxlen=STDERR_LINES)
+    threading.Thread(target=read_lines, args=(process.stdout, lines.put), daemon=True).start()
+    stderr_reader = threading.Thread(target=read_lines, args=(process.stderr, stderr.append), daemon=True)
+    stderr_reader.start()
+
+    progress = {}
+    block = []
+    last_change = start
+    killed = ''
+    while True:
+        now = monotonic()
+        wait = stall_timeout - (now - last_change)
+        if timeout is not None:
+            wait = min(wait, timeout - (now - start))
+
+        try:
+            line = lines.get(timeout=max(wait, 0))
+        except queue.Empty:
+            if timeout is not None and monotonic() - start >= timeout:
+                killed = f'timed out after {timeout:.0f} seconds'
+            else:
+                killed = f'stalled for {stall_timeout:.0f} seconds'
+            process.kill()
+            break
+
+        if line is None:
+            break
+
+        block.append(line)
+        if not line.startswith('progress='):
+            continue
+
+        update = parse_progress(''.join(block))
+        block = []
+        if update.get('frames') != progress.get('frames') or update.get('out_time') != progress.get('out_time'):
+            last_change = monotonic()
+        progress.update(update)
+
+        if on_progress:
+            on_progress(dict(progress))
+
+    returncode = process.wait()
+    stderr_reader.join(timeout=1)
+
+    result = ProcessResult(argv, returncode, monotonic() - start, '',
+                           ''.join(line for line in stderr if line), progress, killed)
+
+    if check and not result.ok:
+        raise ProcessError(result)
+
+    return result
+
+
+def read_lines(stream, put: Callable):
+    '''
+    Hands every line of a stream to `put`, then None once it closes
+    '''
+    for line in stream:
+        put(line)
+    stream.close()
+    put(None)
+
+
+def parse_progress(text: str) -> Dict[str, float]:
+    '''
+    Gets the frame count, frame rate, speed and encoded time from ffmpeg's -progress output
+
+    The output is blocks of key=value lines, each ending in progress=continue
+    or progress=end. Later values win.
+    '''
+    progress = {}
+    for line in text.splitlines():
+        key, _, value = line.strip().partition('=')
+        try:
+            if key in PROGRESS_FIELDS:
+                progress[PROGRESS_FIELDS[key]] = float(value.strip().rstrip('x'))
+            elif key == 'out_time_us':
+                progress['out_time'] = int(value) / 1e6
+        except ValueError:
+            continue # N/A before the first frame is encoded
+
+    return progress
+
+
+def decode(output) -> str:
+    '''
+    Decodes captured output, which may be missing
+    '''
+    if output is None:
+        return ''
+    if isinstance(output, bytes):
+        return output.decode('utf-8', errors='replace')
+    return output
+
+
+class ProcessError(Exception):
+    '''
+    Raised when a process fails, holds its ProcessResult
+    '''
+
+    def __init__(self, result: ProcessResult):
+        self.result = result
+        reason = result.killed or f'exited with {result.returncode}'
+        details = result.stderr.strip().splitlines()[-1:] if result.stderr.strip() else []
+        super().__init__(': '.join([f'{result.argv[0]} {reason}', *details]))
@@ -0,0 +1,67 @@
+'''
+Named x264 encoding profiles shared by both generators
+
+draft is the fastest and is what family_guy has always used, archive is the
+slow high quality encode multi_meme has always used and balanced sits in
+between. Each profile covers the x264 preset, CRF and tune, the lookahead,
+the keyframe interval and the audio bitrate.
+'''
+from typing import List
+
+PROFILES = {
+    'draft': {
+        'preset': 'ultrafast',
+        'crf': 32,
+        'tune': None,
+        'lookahead': 0,
+        'gop': 60,
+        'audio_bitrate': '96k',
+    },
+    'balanced': {
+        'preset': 'veryfast',
+        'crf': 23,
+        'tune': None,
+        'lookahead': 20,
+        'gop': 120,
+        'audio_bitrate': '128k',
+    },
+    'archive': {
+        'preset': 'slow',
+        'crf': 18,
+        'tune': None,
+        'lookahead': 60,
+        'gop': 250,
+        'audio_bitrate': '192k',
+    },
+}
+
+
+def get_encoder_args(profile: str, threads: int = 0) -> List[str]:
+    '''
+    Gets the ffmpeg output options for a named profile
+
+    Parameters
+    ----------
+    profile: str
+        One of PROFILES
+    threads: int
+        Number of threads ffmpeg may use (0 lets ffmpeg decide)
+    '''
+    if profile not in PROFILES:
+        raise ValueError(f'Unknown encoding profile {profile}, expected one of {", ".join(PROFILES)}')
+
+    settings = PROFILES[profile]
+    tune = ['-tune', settings['tune']] if settings['tune'] else []
+
+    return [
+        '-c:v', 'libx264',
+        '-preset', settings['preset'],
+        '-crf', str(settings['crf']),
+        *tune,
+        '-rc-lookahead', str(settings['lookahead']),
+        '-g', str(settings['gop']),
+        '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac',
+        '-b:a', settings['audio_bitrate'],
+        '-threads', str(threads),
+    ]
@@ -0,0 +1,176 @@
+'''
+Pre-transcodes the backgrounds to the size each generator renders them at
+
+Backgrounds are usually 4K captures, but family_guy only ever shows a
+1080x1100 crop of them and multi_meme a 1080x1920 one. Transcoding each
+background once to that crop, at 30 fps with a keyframe every second, means
+renders decode small frames which need no scaling and can seek anywhere
+cheaply.
+
+Proxies are written to `.proxies/<generator>/` inside the backgrounds
+directory and picked up automatically by `BackgroundIndex` while they are
+newer than their background.
+
+TEST_CMD:
+python3 -m four_horsemen.proxies backgrounds -g family_guy multi_meme -j 2
+'''
+import os
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from four_horsemen.cache import atomic_path, read_meta, write_meta
+from four_horsemen.process import ProcessError, run_ffmpeg
+
+PROXY_DIR = '.proxies'
+PROXY_VERSION = 1 # bump when the settings below change to rebuild every proxy
+
+TARGETS = {
+    'family_guy': {'width': 1080, 'height': 1100},
+    'multi_meme': {'width': 1080, 'height': 1920},
+}
+
+PROXY_SETTINGS = {
+    'fps': 30,
+    'gop': 30, # a keyframe every second
+    'preset': 'veryfast',
+    'crf': 18,
+}
+
+VIDEO_EXTENSIONS = ['mov', 'mp4', 'avi', 'mkv', 'webm'] # must be supported by ffmpeg
+
+
+def main():
+    '''
+    Creates the missing or outdated proxies of every background
+    '''
+    args = get_args()
+
+    names = [name for name in sorted(os.listdir(args.backgrounds))
+             if name.split('.')[-1] in VIDEO_EXTENSIONS]
+    print(f'Found {len(names)} backgrounds')
+
+    jobs = [(os.path.join(args.backgrounds, name), target) for target in args.generators for name in names]
+
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        results = list(executor.map(lambda job: make_proxy(*job, force=args.force), jobs))
+
+    print(f'Made {sum(results)} proxies, {len(results) - sum(results)} were up to date')
+
+
+def get_args():
+    '''
+    Gets the cli arguments
+    '''
+    args = ArgumentParser(description='Pre-transcodes backgrounds for the generators')
+    args.add_argument('backgrounds', help='Backgrounds directory')
+    args.add_argument('-g', '--generators', help='Generators to make proxies for', nargs='+',
+                      default=list(TARGETS), choices=TARGETS)
+    args.add_argument('-j', '--jobs', help='Backgrounds to transcode at once', default=1, type=int)
+    args.add_argument('-f', '--force', help='Transcode even when the proxy is up to date', action='store_true')
+
+    return args.parse_args()
+
+
+def get_proxy_path(background: str, target: str) -> str:
+    '''
+    Gets where the proxy of a background for a generator is stored
+    '''
+    directory, name = os.path.split(background)
+    root, _ = os.path.splitext(name)
+    return os.path.join(directory, PROXY_DIR, target, f'{root}.mp4')
+
+
+def get_proxy_meta(background: str, target: str) -> dict:
+    '''
+    Gets what a proxy which is up to date was made from
+    '''
+    stat = os.stat(background)
+    return {
+        'version': PROXY_VERSION,
+        'mtime': stat.st_mtime_ns,
+        'size': stat.st_size,
+        **TARGETS[target],
+        **PROXY_SETTINGS,
+    }
+
+
+def get_fresh_proxy(background: str, target: str) -> Optional[str]:
+    '''
+    Gets the proxy of a background if it exists and is up to date
+    '''
+    proxy = get_proxy_path(background, target)
+    if os.path.isfile(proxy) and read_meta(f'{proxy}.json') == get_proxy_meta(background, target):
+        return proxy
+
+    return None
+
+
+def make_proxy(background: str, target: str, force: bool = False) -> bool:
+    '''
+    Transcodes a background for a generator unless its proxy is up to date
+
+    Returns whether a proxy was made
+    '''
+    if not force and get_fresh_proxy(background, target):
+        return False
+
+    proxy = get_proxy_path(background, target)
+    os.makedirs(os.path.dirname(proxy), exist_ok=True)
+    meta = get_proxy_meta(background, target)
+
+    print(f'Making {target} proxy of {os.path.basename(background)}')
+
+    with atomic_path(proxy, '.mp4') as tmp_path:
+        command = [
+            'ffmpeg', '-y', '-v', 'error', '-i', background,
+            *get_proxy_args(meta['width'], meta['height']),
+            tmp_path,
+        ]
+
+        try:
+            run_ffmpeg(command)
+        except ProcessError as e:
+            raise ProxyError(f'Failed to make proxy of {background}: {e}') from e
+
+    write_meta(f'{proxy}.json', meta)
+
+    return True
+
+
+def get_proxy_args(width: int, height: int) -> List[str]:
+    '''
+    Gets the ffmpeg options which crop, scale and re-encode a background
+    '''
+    return [
+        '-vf', f'{get_fill_filter(width, height)},fps={PROXY_SETTINGS["fps"]}',
+        '-an',
+        '-c:v', 'libx264',
+        '-preset', PROXY_SETTINGS['preset'],
+        '-crf', str(PROXY_SETTINGS['crf']),
+        '-g', str(PROXY_SETTINGS['gop']),
+        '-keyint_min', str(PROXY_SETTINGS['gop']),
+        '-sc_threshold', '0',
+        '-pix_fmt', 'yuv420p',
+        '-movflags', '+faststart',
+    ]
+
+
+def get_fill_filter(width: int, height: int) -> str:
+    '''
+    Gets the filter which crops the center of a video to width:height and scales it to width x height
+
+    Applied to a proxy it does nothing, as the proxy already has that size
+    '''
+    crop = f'min(iw/{width}\\,ih/{height})'
+    return f'crop={width}*{crop}:{height}*{crop},scale={width}:{height}'
+
+
+class ProxyError(Exception):
+    '''
+    Raised when a background cannot be transcoded
+    '''
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,16 @@
 import xml.etree.ElementTree as ET
 import html
+import io
+from typing import Iterator
 
 START = 't'
 BLOCK_DURATION = 'd'
-WORD_DURATION = 'ac'
+BODY = 'body'
 
 def xml_to_srt(xml: str, max_len: int = 200) -> str:
     """
     Converts the passed xml into an SRT file
-    
+
     Parameters
     ----------
     xml: str
@@ -16,111 +18,156 @@ def xml_to_srt(xml: str, max_len: int = 200) -> str:
     max_len: int
         The maximum length of the caption. Used to keep captions from wrapping
     """
+    return "".join(iter_srt(xml, max_len))
+
+
+def write_srt(xml, path: str, max_len: int = 200) -> int:
+    """
+    Converts the passed xml into an SRT file on disk without holding either in memory
+
+    Parameters
+    ----------
+    xml: str, bytes or file
+        The xml, a path to it or an open file, see `iter_srt`
+    path: str
+        Where to write the SRT file
+    max_len: int
+        The maximum length of the caption
+
+    Returns the number of captions written
+    """
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for cue in iter_srt(xml, max_len):
+            f.write(cue)
+            count += 1
+
+    return count
 
-    print(xml)
-    tree = ET.fromstring(xml)
 
-    output = ""
+def iter_srt(xml, max_len: int = 200) -> Iterator[str]:
+    """
+    Yields the SRT captions for timedtext (format 3) xml one at a time
+
+    The xml is parsed incrementally and every paragraph is dropped once its
+    captions are out, so memory stays bounded for multi-hour captions
+
+    Parameters
+    ----------
+    xml: str, bytes or file
+        The xml itself, a path to it or an open file
+    max_len: int
+        The maximum length of the caption. Used to keep captions from wrapping
+    """
     caption_number = 1
+    body = None
 
-    for child in list(tree[1]):
-        frame_len = get_frame_len(child, max_len)
-    
-        start, end = None, None
-        text = ""
-        prev = ""
-        start = get_start(child)
-        for word in list(child):
-            text += html.unescape(word.text)
-
-            if not start:
-                start = get_start(word)
-
-            if len(text) > frame_len * caption_number: # Makes sure the overlap is not too much 
-                # Saves the text
-                output += out(caption_number, start, get_start(word) + int(word.attrib[WORD_DURATION]), text)
-                start = None
-                text = "" # Clears the text
-                caption_number += 1
+    for event, element in ET.iterparse(get_source(xml), events=('start', 'end')):
+        if event == 'start':
+            if element.tag == BODY and body is None:
+                body = element
+            continue
 
-        if not text == "":
-            # Also saves the text
-            output += out(caption_number, start, get_end(word), text)
-            caption_number += 1
-    
-    return output
-
-
-# def xml_to_srt_bad(xml: str, empty=True) -> str: # Perfectly fine to push to the PyTube Repository
-    # Creates the element tree
-    tree = ET.fromstring(xml)
-
-    output = ""
-    caption_number = 0
-    for i, child in enumerate(tree[1]):
-        text = ""
-        for word in list(child): # Children have a nested word by word structure which will just be ignored
-            text += html.unescape(word.text)
-
-        caption = text.replace("\n", " ").replace("  ", " ")
-        try:
-            duration = float(child.attrib["d"])
-        except KeyError:
-            duration = 0.0
-        start = float(child.attrib["t"])
-        end = start + duration
-
-        if not empty and text == "": # Creates blank spaces which should probably make SRTs output correctly
+        if body is None or element is body:
             continue
-        if text == "":
-            text = "__"
-        
-        caption_number += 1
-        output += f"{caption_number}\n" # Sequence number only outputs when text is actually there
-        output += f"{fmt_time(start)} --> {fmt_time(end)}\n"
-        output += f"{caption}\n\n"
 
-    return output
+        if element in body: # only paragraphs, not the words inside them
+            for start, end, text in split_paragraph(element, max_len):
+                yield out(caption_number, start, end, text)
+                caption_number += 1
+
+            body.remove(element)
 
-def get_frame_len(child: str, max_len: int) -> int:
+
+def get_source(xml):
+    """
+    Gets something iterparse can read from the xml, a path or a file
+    """
+    if isinstance(xml, bytes):
+        return io.BytesIO(xml)
+    if isinstance(xml, str) and xml.lstrip().startswith('<'):
+        return io.StringIO(xml)
+
+    return xml
+
+
+def split_paragraph(paragraph, max_len: int) -> list:
+    """
+    Splits a paragraph into captions of roughly equal length
+
+    Word times are offsets from the start of the paragraph, and each word lasts
+    until the next one starts (the last until the end of the paragraph)
+
+    Returns a list of (start, end, text)
+    """
+    words = [
+        (get_start(paragraph) + get_start(word), html.unescape(word.text or ""))
+        for word in paragraph
+    ]
+    if not words:
+        return []
+
+    end = get_end(paragraph) or words[-1][0]
+    frame_len = get_frame_len(sum(len(text) for _, text in words), max_len)
+
+    captions = []
+    start, text = None, ""
+    for i, (word_start, word) in enumerate(words):
+        if start is None:
+            start = word_start
+        text += word
+
+        if len(text) > frame_len and i + 1 < len(words):
+            captions.append((start, words[i + 1][0], clean(text)))
+            start, text = None, ""
+
+    if text.strip():
+        captions.append((start, end, clean(text)))
+
+    return [caption for caption in captions if caption[2]]
+
+
+def get_frame_len(length: int, max_len: int) -> int:
     """
     Gets the length of each frame
     """
-    words = ""
-    for word in list(child):
-        words += html.unescape(word.text)
-    
-    frames = len(words) // max_len + 1
-    return len(words) // frames
+    frames = length // max_len + 1
+    return length // frames
 
 
-def get_start(word) -> int:
+def get_start(element) -> int:
     """
-    Gets the start time of the word
+    Gets the start time of a paragraph, or a word's offset into its paragraph
     """
-    return int(word.attrib[START])
+    return int(element.attrib.get(START, 0))
+
+
+def get_end(paragraph) -> int:
+    """
+    Gets the end time of a paragraph (0 if it has no duration)
+    """
+    if BLOCK_DURATION not in paragraph.attrib:
+        return 0
+
+    return get_start(paragraph) + int(paragraph.attrib[BLOCK_DURATION])
 
 
-def get_end(word) -> int:
+def clean(text: str) -> str:
     """
-    Gets the end time of the word
+    Removes the line breaks and extra spaces from a caption
     """
-    return int(word.attrib[START]) + int(word.attrib[WORD_DURATION])
+    return " ".join(text.split())
 
 
 def out(i, start, end, caption):
     """
     Formats the srt output
     """
-    output = ""
-    output += f"{i}\n" # Sequence number only outputs when text is actually there
-    output += f"{fmt_time(start)} --> {fmt_time(end)}\n"
-    output += f"{caption}\n\n"
-    return output
+    return f"{i}\n{fmt_time(start)} --> {fmt_time(end)}\n{caption}\n\n"
 
 
 def fmt_time(time: int) -> str:
     """
     Formats the time in miliseconds
     """
-    return f"{int(time // 1000 // 60 // 60)}:{int(time // 1000 // 60 % 60)}:{int(time // 1000 % 60)},{int(time % 1000)}"
\ No newline at end of file
+    return f"{int(time // 1000 // 60 // 60):02}:{int(time // 1000 // 60 % 60):02}:{int(time // 1000 % 60):02},{int(time % 1000):03}"
@@ -0,0 +1,153 @@
+'''
+Append-only record store shared by the generators and the upload bots
+
+Records are appended to a JSON Lines file as they are produced instead of
+rewriting a whole spreadsheet every time, so saving costs O(1) per record.
+Updates (such as flipping `uploaded`) are appended as partial records and
+folded onto the original by key when the file is read. The result can be
+exported to xlsx, csv or json once at the end of a run.
+'''
+import json
+import os
+import threading
+from typing import Iterable, List
+
+import pandas as pd
+
+JSONL_ENDING = '.jsonl'
+
+
+class RecordSink:
+    '''
+    A JSON Lines file which records are only ever appended to
+
+    Each record is written with a single append so several threads or
+    processes can share a file without interleaving lines.
+
+    Parameters
+    ----------
+    path: str
+        The .jsonl file to append to
+    key: str
+        Field identifying a record, later records with the same key are merged
+        into the first one when reading
+    '''
+
+    def __init__(self, path: str, key: str = None):
+        self.path = path
+        self.key = key
+        self.lock = threading.Lock()
+
+    def append(self, record: dict):
+        '''
+        Appends a single record
+        '''
+        self.extend([record])
+
+    def extend(self, records: List[dict]):
+        '''
+        Appends several records at once
+        '''
+        if not records:
+            return
+
+        lines = ''.join(json.dumps(record, default=str) + '\n' for record in records)
+        with self.lock, open(self.path, 'a', encoding='utf-8') as file:
+            file.write(lines)
+
+    def clear(self):
+        '''
+        Removes every record, for runs which start over
+        '''
+        with self.lock:
+            if os.path.isfile(self.path):
+                os.remove(self.path)
+
+    def read(self) -> List[dict]:
+        '''
+        Reads every record, folding updates onto the records they belong to
+        '''
+        return read_records(self.path, self.key)
+
+    def export(self, path: str):
+        '''
+        Writes every record to a spreadsheet, see `save_data`
+        '''
+        records = self.read()
+        if records:
+            save_data(records, path)
+
+
+def get_sink_path(path: str) -> str:
+    '''
+    Gets the .jsonl file records for `path` are appended to
+
+    `info.xlsx` is appended to as `info.jsonl` and exported at the end
+    '''
+    root, ending = os.path.splitext(path)
+    return path if ending == JSONL_ENDING else root + JSONL_ENDING
+
+
+def read_records(path: str, key: str = None) -> List[dict]:
+    '''
+    Reads the records of a JSON Lines file in the order they were first written
+
+    With a key, records sharing the key are merged (later fields win)
+    '''
+    if not os.path.isfile(path):
+        return []
+
+    with open(path, 'r', encoding='utf-8') as file:
+        return parse_records(file, key)
+
+
+def parse_records(lines: Iterable[str], key: str = None) -> List[dict]:
+    '''
+    Parses JSON Lines into records, see `read_records`
+    '''
+    records = {}
+    ordered = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue # a line cut short by a crash
+
+        if key is None or key not in record:
+            ordered.append(record)
+        elif record[key] in records:
+            records[record[key]].update(record)
+        else:
+            records[record[key]] = record
+            ordered.append(record)
+
+    return ordered
+
+
+def save_data(info: list, path: str) -> None:
+    """
+    Saves the data based on the ending of the string
+
+    Parameters
+    ----------
+    info
+        A list of dictionaries with video information
+    path
+        The path to save the data to
+    """
+    frame = pd.DataFrame(info)
+
+    if path.endswith('.csv'):
+        frame.to_csv(path, index=False)
+    elif path.endswith('.json'):
+        frame.to_json(path, orient='records')
+    elif path.endswith(JSONL_ENDING):
+        frame.to_json(path, orient='records', lines=True)
+    elif path.endswith('.xlsx'):
+        frame.to_excel(path, index=False)
+    else:
+        frame.to_csv(path, index=False)
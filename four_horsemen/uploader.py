@@ -0,0 +1,195 @@
+'''
+Shared upload queue for the chron upload bots
+
+The video info written by the generators is synced incrementally into an
+SQLite table indexed on `uploaded`, so finding the next video to post does
+not depend on how many have been posted already. Videos are claimed and
+marked posted atomically, so overlapping cron ticks never post the same
+video twice, and a tick can post a batch of videos. A video which fails to
+upload is retried after the others, and given up on after MAX_ATTEMPTS.
+'''
+import os
+import sqlite3
+from argparse import ArgumentParser
+from time import time
+from typing import List
+
+from four_horsemen.jobs import Transaction, get_worker_id
+from four_horsemen.process import run as run_process
+from four_horsemen.store import parse_records
+
+LEASE = 3600 # seconds before a claimed upload is assumed abandoned
+MAX_ATTEMPTS = 3 # uploads of a video before it is given up on
+UPLOAD_TIMEOUT = 900
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS uploads (
+    file_path TEXT PRIMARY KEY,
+    description TEXT,
+    uploaded INTEGER NOT NULL DEFAULT 0,
+    claimed_by TEXT,
+    claimed_at REAL,
+    posted_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS uploads_uploaded ON uploads (uploaded, claimed_at);
+CREATE TABLE IF NOT EXISTS synced (
+    path TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL
+);
+'''
+
+
+class UploadStore:
+    '''
+    Indexed store of which videos have been uploaded
+    '''
+
+    def __init__(self, path: str, lease: float = LEASE, max_attempts: int = MAX_ATTEMPTS):
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+
+    def sync(self, info: str) -> int:
+        '''
+        Adds the videos appended to a video info .jsonl file since the last sync
+
+        Only the new end of the file is read. Records which already say they
+        were uploaded (written by older bots) are marked as posted.
+
+        Returns the number of records read
+        '''
+        if not os.path.isfile(info):
+            return 0
+
+        key = os.path.abspath(info)
+        size = os.path.getsize(info)
+
+        with Transaction(self.connection):
+            row = self.connection.execute('SELECT offset FROM synced WHERE path = ?', (key,)).fetchone()
+            offset = row['offset'] if row and row['offset'] <= size else 0 # the file was replaced
+
+            with open(info, 'rb') as file:
+                file.seek(offset)
+                data = file.read(size - offset)
+
+            # Only whole lines, a writer may be in the middle of the last one
+            data = data[:data.rfind(b'\n') + 1]
+            records = parse_records(data.decode('utf-8').splitlines())
+
+            self.connection.executemany('''
+                INSERT INTO uploads (file_path, description, uploaded) VALUES (?, ?, ?)
+                ON CONFLICT (file_path) DO UPDATE SET
+                    description = COALESCE(excluded.description, description),
+                    uploaded = MAX(uploaded, excluded.uploaded)
+            ''', [
+                (record['file_path'], record.get('description'), int(bool(record.get('uploaded'))))
+                for record in records if 'file_path' in record
+            ])
+            self.connection.execute(
+                'INSERT OR REPLACE INTO synced (path, offset) VALUES (?, ?)', (key, offset + len(data))
+            )
+
+        return len(records)
+
+    def claim(self, count: int = 1, worker: str = None) -> List[dict]:
+        '''
+        Atomically claims up to `count` videos which have not been uploaded
+
+        Videos which failed before come after the ones not tried yet
+        '''
+        now = time()
+        with Transaction(self.connection):
+            rows = self.connection.execute('''
+                SELECT file_path, description FROM uploads
+                WHERE uploaded = 0 AND (claimed_at IS NULL OR claimed_at < ?) AND attempts < ?
+                ORDER BY attempts, rowid LIMIT ?
+            ''', (now - self.lease, self.max_attempts, count)).fetchall()
+
+            self.connection.executemany('''
+                UPDATE uploads SET claimed_by = ?, claimed_at = ?, attempts = attempts + 1
+                WHERE file_path = ?
+            ''', [(worker or get_worker_id(), now, row['file_path']) for row in rows])
+
+        return [dict(row) for row in rows]
+
+    def mark_posted(self, file_path: str):
+        '''
+        Registers that a claimed video has been uploaded
+        '''
+        self.connection.execute('''
+            UPDATE uploads SET uploaded = 1, posted_at = ?, claimed_by = NULL, claimed_at = NULL, error = NULL
+            WHERE file_path = ?
+        ''', (time(), file_path))
+
+    def release(self, file_path: str, error: str = None):
+        '''
+        Gives a claimed video back so a later tick can retry it
+        '''
+        self.connection.execute('''
+            UPDATE uploads SET claimed_by = NULL, claimed_at = NULL, error = ?
+            WHERE file_path = ?
+        ''', (error, file_path))
+
+    def remaining(self) -> int:
+        '''
+        Gets the number of videos which have not been uploaded
+        '''
+        return self.connection.execute('SELECT COUNT(*) FROM uploads WHERE uploaded = 0').fetchone()[0]
+
+    def close(self):
+        '''
+        Closes the store
+        '''
+        self.connection.close()
+
+
+def upload(video: dict, cookies: str) -> bool:
+    '''
+    Uploads a single video with tiktok-uploader
+    '''
+    print(f'Uploading {video["file_path"]}')
+    result = run_process(['tiktok-uploader', '-v', video['file_path'], '-d', video['description'] or '', '-c', cookies],
+                         timeout=UPLOAD_TIMEOUT, check=False)
+    if not result.ok:
+        print(result.stderr.strip() or result.killed)
+
+    return result.ok
+
+
+def run(store: str, info: str, cookies: str, batch: int = 1) -> int:
+    '''
+    Syncs the video info and uploads the next `batch` videos
+
+    Returns the number of videos posted
+    '''
+    uploads = UploadStore(store)
+    uploads.sync(info)
+
+    posted = 0
+    for video in uploads.claim(batch):
+        if upload(video, cookies):
+            uploads.mark_posted(video['file_path'])
+            posted += 1
+        else:
+            print(f'Failed to upload {video["file_path"]}')
+            uploads.release(video['file_path'], 'tiktok-uploader failed')
+
+    print(f'Posted {posted} videos, {uploads.remaining()} left to post')
+    uploads.close()
+
+    return posted
+
+
+def get_args(description: str = None):
+    '''
+    Gets the cli arguments shared by the upload bots
+    '''
+    args = ArgumentParser(description=description)
+    args.add_argument('-n', '--batch', help='Videos to upload in this run', default=1, type=int)
+
+    return args.parse_args()
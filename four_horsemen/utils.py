@@ -2,29 +2,50 @@
 Utility functions for the four horsemen 
 '''
 import json
-import subprocess
+import os
+import threading
+from collections import defaultdict
+from time import sleep
 from typing import List
+from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from four_horsemen.cache import MediaCache
+from four_horsemen.probe import probe
 
 TIMEOUT = 40
 
+MAX_PER_HOST = 8 # concurrent requests allowed to a single host
+RETRIES = 5
+BACKOFF = 2 # seconds, doubled after every retry
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
 SESSION = requests.Session()
+# Shared between threads, so the pool has to hold a connection for each of them
+SESSION.mount('https://', HTTPAdapter(pool_connections=MAX_PER_HOST, pool_maxsize=MAX_PER_HOST))
+SESSION.mount('http://', HTTPAdapter(pool_connections=MAX_PER_HOST, pool_maxsize=MAX_PER_HOST))
+
+MEDIA_CACHE = MediaCache(SESSION)
+
+HOST_LIMITS = defaultdict(lambda: threading.BoundedSemaphore(MAX_PER_HOST))
+HOST_LIMITS_LOCK = threading.Lock()
 
 def get_posts(subreddit: str, post_type: str, limit: int, api_key: str) -> List[dict]:
     '''
     Gets the posts from the subreddit
+
+    Safe to call from several threads at once
     '''
     url = f'https://www.reddit.com/r/{subreddit}/{post_type}.json?limit={limit}'
 
-    session = SESSION or requests.Session()
-
     print(f'Getting posts from {url}')
     headers = {'User-Agent': 'Mozilla/5.0'}
     if api_key:
-        posts = session.get(url, headers=headers, auth=api_key, timeout=20)
+        posts = get_with_backoff(url, headers=headers, auth=api_key, timeout=20)
     else:
-        posts = session.get(url, headers=headers, timeout=20)
+        posts = get_with_backoff(url, headers=headers, timeout=20)
     body = json.loads(posts.text)
 
     return list(map(
@@ -33,42 +54,101 @@ def get_posts(subreddit: str, post_type: str, limit: int, api_key: str) -> List[
             )
 
 
-def download_image(url: str) -> bool:
-    '''Downloads the image from the post'''
+def get_with_backoff(url: str, **kwargs) -> requests.Response:
+    '''
+    Gets a url through the shared session, backing off when rate limited
 
+    At most MAX_PER_HOST requests run against a host at once. Rate limited and
+    server error responses are retried after the delay the server asks for
+    (Retry-After or Reddit's x-ratelimit-reset) or an exponential backoff.
+    '''
     session = SESSION or requests.Session()
-    image = session.get(url, timeout=TIMEOUT)
 
-    save_path = f'tmp/{url.split("/")[-1]}'
+    with HOST_LIMITS_LOCK:
+        limit = HOST_LIMITS[urlparse(url).netloc]
 
-    if image.status_code != 200:
-        print(f'Failed to download {url}')
-        return False
+    for attempt in range(RETRIES + 1):
+        with limit:
+            response = session.get(url, **kwargs)
 
-    with open(save_path, 'wb') as file:
-        for chunk in image.iter_content(chunk_size=1024):
-            if chunk:
-                file.write(chunk)
+        if response.status_code not in RETRY_STATUS or attempt == RETRIES:
+            break
 
-    return True
+        delay = get_retry_delay(response, attempt)
+        print(f'Got {response.status_code} from {url}, retrying in {delay:.0f} seconds')
+        sleep(delay)
 
+    # Waits out the window when the last request used up the rate limit
+    try:
+        if float(response.headers.get('x-ratelimit-remaining', 1)) < 1:
+            sleep(float(response.headers.get('x-ratelimit-reset', 0)))
+    except ValueError:
+        pass
 
-def get_dimensions(file_path: str):
-    '''Gets the dimensions of the post'''
-    output = subprocess.Popen(
-        f'ffprobe -i {file_path}', stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True
-        ).communicate()[0].decode('utf-8')
+    return response
+
+
+def get_retry_delay(response: requests.Response, attempt: int) -> float:
+    '''
+    Gets how long to wait before retrying a request
+    '''
+    if response.status_code == 429:
+        for header in ['Retry-After', 'x-ratelimit-reset']:
+            try:
+                return float(response.headers[header])
+            except (KeyError, ValueError):
+                continue
+
+    return BACKOFF * 2 ** attempt
+
+
+def download_image(url: str) -> str:
+    '''
+    Downloads the image from the post into the shared media cache
+
+    Returns the local path of the image, or None if it failed to download
+    '''
+    return MEDIA_CACHE.get(url)
 
-    dimensions_line = output.rsplit('Video:', maxsplit=1)[-1].split(',')[2].split(' ')[-1].strip()
-    dimensions_line = dimensions_line[:dimensions_line.find(' ')]
 
-    return tuple(map(int, dimensions_line.split('x')))
+def get_dimensions(file_path: str):
+    '''Gets the dimensions of the post'''
+    info = probe(file_path)
+    return info.width, info.height
 
 def get_media_length(file_path: str):
     '''Get the length of a video or audio file'''
-    output = subprocess.Popen(
-        f'ffprobe -i {file_path}', stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True
-    ).communicate()[0].decode('utf-8')
+    return probe(file_path).duration
+
+
+def get_worker_count(jobs: int = 0, threads: int = 1) -> int:
+    '''
+    Gets the number of concurrent ffmpeg processes to run
+
+    A jobs value of 0 sizes the pool from the core count, leaving each ffmpeg
+    process `threads` cores of its own
+    '''
+    if jobs and jobs > 0:
+        return jobs
+
+    return max(1, (os.cpu_count() or 1) // max(1, threads))
+
+
+def get_seek_args(start: float, duration: float = None, accurate: bool = True) -> List[str]:
+    '''
+    Gets the ffmpeg options which seek an input before it is opened
+
+    Must be placed before the `-i` of the input. Fast seeking jumps to the
+    keyframe before `start` without decoding anything in between, which is
+    fine for backgrounds where the exact frame does not matter. Accurate
+    seeking (ffmpeg's default) also decodes from that keyframe up to `start`
+    so the first frame is exact.
+    '''
+    args = [] if accurate else ['-noaccurate_seek']
+    args += ['-ss', f'{start:.3f}']
+
+    if duration is not None:
+        args += ['-t', f'{duration:.3f}']
+
+    return args
 
-    seg = output.split('Duration:')[1].split(',')[0].split(':')
-    return int(seg[0]) * 3600 + int(seg[1]) * 60 + float(seg[2])
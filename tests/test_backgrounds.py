@@ -0,0 +1,70 @@
+"""
+Testing the backgrounds.py module
+"""
+import random
+import unittest.mock as mock
+
+import numpy as np
+import pytest
+
+from four_horsemen import backgrounds, cache
+from four_horsemen.probe import MediaInfo
+
+LONG = MediaInfo(100.0, 1920, 1080, 30.0, 'h264', 'aac', (0.0, 10.0, 20.0, 80.0, 95.0))
+SHORT = MediaInfo(30.0, 1920, 1080, 30.0, 'h264', 'aac', (0.0, 10.0))
+
+
+def get_info(path, keyframes=False):
+    """
+    Fake probe, files named short*.mp4 are 30 seconds long
+    """
+    return SHORT if 'short' in path else LONG
+
+
+def test_refresh(tmp_path, monkeypatch):
+    """
+    Tests that only new or changed backgrounds are probed and removed ones are dropped
+    """
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    directory = tmp_path / 'backgrounds'
+    directory.mkdir()
+    (directory / 'a.mp4').write_bytes(b'a')
+    (directory / 'b.mp4').write_bytes(b'b')
+    (directory / 'notes.txt').write_bytes(b'not a video')
+
+    with mock.patch.object(backgrounds, 'probe', side_effect=get_info) as probe:
+        assert len(backgrounds.BackgroundIndex(str(directory))) == 2
+        assert probe.call_count == 2
+
+        (directory / 'b.mp4').write_bytes(b'a different b')
+        (directory / 'a.mp4').unlink()
+        index = backgrounds.BackgroundIndex(str(directory))
+
+        assert probe.call_count == 3
+        assert [background.path for background in index.backgrounds] == [str(directory / 'b.mp4')]
+
+
+def test_sample(tmp_path, monkeypatch):
+    """
+    Tests that samples start on a keyframe and always fit inside the background
+    """
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    (tmp_path / 'long.mp4').write_bytes(b'long')
+    (tmp_path / 'short.mp4').write_bytes(b'short')
+
+    with mock.patch.object(backgrounds, 'probe', side_effect=get_info):
+        index = backgrounds.BackgroundIndex(str(tmp_path))
+
+    rng = random.Random(0)
+    for _ in range(50):
+        path, start = index.sample(60, rng)
+        assert path == str(tmp_path / 'long.mp4')
+        assert start in (0.0, 10.0, 20.0)
+
+    with pytest.raises(backgrounds.BackgroundError):
+        index.sample(120)
+
+    paths, starts = index.sample_many(25, 200, np.random.default_rng(0))
+    assert set(paths) == {str(tmp_path / 'long.mp4'), str(tmp_path / 'short.mp4')}
+    assert set(starts[paths == str(tmp_path / 'short.mp4')]) == {0.0}
+    assert set(starts[paths == str(tmp_path / 'long.mp4')]) == {0.0, 10.0, 20.0}
@@ -0,0 +1,114 @@
+"""
+Testing the cache.py module
+"""
+import os
+import threading
+import unittest.mock as mock
+
+import pytest
+
+from four_horsemen.cache import MediaCache, atomic_path
+
+URL = 'https://i.redd.it/meme.png'
+
+
+def make_response(status: int, body: bytes = b'', headers: dict = None):
+    """
+    Makes a fake streamed response
+    """
+    response = mock.Mock(status_code=status, headers=headers or {})
+    response.iter_content.return_value = [body]
+    return response
+
+
+def test_download_once(tmp_path):
+    """
+    Tests that a url is downloaded once and then served from the cache
+    """
+    session = mock.Mock()
+    session.get.return_value = make_response(200, b'image', {'ETag': '"abc"'})
+    cache = MediaCache(session, str(tmp_path))
+
+    path = cache.get(URL)
+    assert path.endswith('.png')
+    assert open(path, 'rb').read() == b'image'
+
+    assert cache.get(URL) == path
+    assert session.get.call_count == 1
+
+
+def test_revalidate(tmp_path):
+    """
+    Tests that a stale entry is checked with its ETag and kept on a 304
+    """
+    session = mock.Mock()
+    session.get.return_value = make_response(200, b'image', {'ETag': '"abc"'})
+    cache = MediaCache(session, str(tmp_path), revalidate_after=0)
+    path = cache.get(URL)
+
+    session.get.return_value = make_response(304)
+    assert cache.get(URL) == path
+    assert session.get.call_args[1]['headers'] == {'If-None-Match': '"abc"'}
+    assert open(path, 'rb').read() == b'image'
+
+
+def test_in_flight(tmp_path):
+    """
+    Tests that concurrent requests for the same url share one download
+    """
+    release = threading.Event()
+
+    def get(*args, **kwargs):
+        release.wait(5)
+        return make_response(200, b'image')
+
+    session = mock.Mock()
+    session.get.side_effect = get
+    cache = MediaCache(session, str(tmp_path))
+
+    paths = []
+    threads = [threading.Thread(target=lambda: paths.append(cache.get(URL))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert session.get.call_count == 1
+    assert len(set(paths)) == 1
+
+
+def test_evict(tmp_path, monkeypatch):
+    """
+    Tests that the least recently used files are evicted first
+    """
+    monkeypatch.setattr('four_horsemen.cache.EVICT_GRACE', 0)
+    session = mock.Mock()
+    session.get.side_effect = lambda *args, **kwargs: make_response(200, b'x' * 100)
+    cache = MediaCache(session, str(tmp_path), max_bytes=250)
+
+    first = cache.get('https://i.redd.it/1.png')
+    os.utime(first, (0, 0))
+    second = cache.get('https://i.redd.it/2.png')
+    third = cache.get('https://i.redd.it/3.png')
+
+    assert not os.path.exists(first)
+    assert os.path.exists(second) and os.path.exists(third)
+
+
+def test_atomic_path(tmp_path):
+    """
+    Tests that a file only appears once its block succeeds and failed writes leave nothing behind
+    """
+    path = str(tmp_path / 'file.txt')
+
+    with pytest.raises(ValueError):
+        with atomic_path(path, '.txt') as tmp, open(tmp, 'w', encoding='utf-8') as file:
+            file.write('half')
+            raise ValueError('interrupted')
+    assert os.listdir(tmp_path) == []
+
+    with atomic_path(path) as tmp, open(tmp, 'w', encoding='utf-8') as file:
+        file.write('whole')
+        assert not os.path.exists(path)
+    assert os.listdir(tmp_path) == ['file.txt']
@@ -0,0 +1,153 @@
+"""
+Testing the download.py module
+"""
+import os
+import sys
+import threading
+import types
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from four_horsemen import download
+from four_horsemen.cache import write_meta
+
+DATA = bytes(range(256)) * 40 # 10240 bytes
+Stream = namedtuple('Stream', ['resolution', 'is_progressive'])
+YouTubeStream = namedtuple('YouTubeStream', ['resolution', 'is_progressive', 'url'])
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """
+    Serves DATA, honouring Range headers unless the path is /norange
+    """
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.headers.get('Range'))
+        header = self.headers.get('Range')
+
+        if header and self.path != '/norange':
+            start, end = (int(i) for i in header.split('=')[1].split('-'))
+            body = DATA[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(DATA)}')
+        else:
+            body = DATA
+            self.send_response(200)
+
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    """
+    A local HTTP server standing in for the video host
+    """
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    RangeHandler.requests = []
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+
+
+def test_ranged(server, tmp_path):
+    """
+    Tests that a file fetched in chunks over several connections is reassembled
+    """
+    path = str(tmp_path / 'video.mp4')
+    download.fetch_url(f'{server}/video.mp4', path, connections=4, chunk_size=1000)
+
+    assert open(path, 'rb').read() == DATA
+    assert len(RangeHandler.requests) == 1 + 11
+    assert not os.path.exists(path + download.JOURNAL_ENDING)
+
+
+def test_resume(server, tmp_path):
+    """
+    Tests that the chunks recorded in the journal are not fetched again
+    """
+    path = str(tmp_path / 'video.mp4')
+    with open(path + download.PART_ENDING, 'wb') as file:
+        file.write(DATA[:4000] + bytes(len(DATA) - 4000))
+    write_meta(path + download.JOURNAL_ENDING, {'size': len(DATA), 'chunk_size': 1000, 'done': [0, 1, 2, 3]})
+
+    download.fetch_url(f'{server}/video.mp4', path, connections=2, chunk_size=1000)
+
+    assert open(path, 'rb').read() == DATA
+    assert 'bytes=0-999' not in RangeHandler.requests
+    assert 'bytes=4000-4999' in RangeHandler.requests
+
+
+def test_no_ranges(server, tmp_path):
+    """
+    Tests that servers without range support are downloaded in one request
+    """
+    path = str(tmp_path / 'video.mp4')
+    download.LocalBackend(server + '/norange').download('abc', path)
+
+    assert open(path, 'rb').read() == DATA
+
+
+def test_pick_stream():
+    """
+    Tests that the lowest stream which fills the output is picked
+    """
+    streams = [Stream('360p', True), Stream('720p', True), Stream('1080p', False),
+               Stream('1440p', False), Stream(None, False)]
+
+    assert download.pick_stream(streams) == Stream('1080p', False)
+    assert download.pick_stream(streams, min_height=480) == Stream('720p', True)
+    assert download.pick_stream(streams[:2]) == Stream('720p', True)
+    assert download.pick_stream([]) is None
+
+
+class FakeStreams(list):
+    """
+    Stands in for pytube's StreamQuery of a video without an audio only stream
+    """
+
+    def filter(self, only_audio=False, **kwargs):
+        return FakeStreams() if only_audio else self
+
+    def order_by(self, key):
+        return self
+
+    def desc(self):
+        return self
+
+    def first(self):
+        return self[0] if self else None
+
+
+@pytest.mark.parametrize('streams, fetched', [
+    ([YouTubeStream('360p', True, 'low'), YouTubeStream('1080p', False, 'high')], ['low']),
+    ([YouTubeStream('1080p', False, 'high')], None),
+])
+def test_youtube_without_audio(monkeypatch, tmp_path, streams, fetched):
+    """
+    Tests that a video without an audio stream falls back to a progressive stream, or fails clearly
+    """
+    class YouTube:
+        def __init__(self, url):
+            self.streams = FakeStreams(streams)
+            self.title = 'Title'
+            self.captions = {}
+
+    monkeypatch.setitem(sys.modules, 'pytube', types.SimpleNamespace(YouTube=YouTube))
+    urls = []
+    monkeypatch.setattr(download, 'fetch_url', lambda url, path, connections: urls.append(url))
+    backend = download.YouTubeBackend()
+
+    if fetched is None:
+        with pytest.raises(download.DownloadError, match='audio'):
+            backend.download('abc', str(tmp_path / 'abc.mp4'))
+    else:
+        assert backend.download('abc', str(tmp_path / 'abc.mp4')).title == 'Title'
+        assert urls == fetched
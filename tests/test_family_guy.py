@@ -0,0 +1,101 @@
+"""
+Testing the family_guy.py module
+"""
+from time import sleep
+
+from four_horsemen import family_guy
+from four_horsemen.family_guy import ClipCreationError, Source, prefetch_sources, render_parts, render_source
+
+
+class FakeQueue:
+    """
+    Hands out sources in order, like JobQueue.claim_source
+    """
+
+    def __init__(self, ids):
+        self.ids = list(ids)
+        self.claimed = 0
+
+    def claim_source(self):
+        if self.claimed == len(self.ids):
+            return None
+        self.claimed += 1
+        return self.ids[self.claimed - 1]
+
+
+def fake_fetch(id, use_captions=False, backend=None):
+    return Source(id, f'Title {id}', 60.0)
+
+
+def test_prefetch_lookahead(monkeypatch):
+    """
+    Tests that sources are claimed up to the lookahead ahead of the one rendering
+    """
+    monkeypatch.setattr(family_guy, 'fetch_source', fake_fetch)
+    monkeypatch.setattr(family_guy, 'get_tmp_size', lambda: 0)
+    queue = FakeQueue('abcde')
+
+    sources = prefetch_sources(queue, lookahead=2)
+    id, source = next(sources)
+
+    assert id == 'a'
+    assert source.result() == Source('a', 'Title a', 60.0)
+    assert queue.claimed == 3
+
+    assert [id for id, _ in sources] == ['b', 'c', 'd', 'e']
+
+
+def test_prefetch_disk_limit(monkeypatch):
+    """
+    Tests that downloading ahead pauses while tmp is over the limit
+    """
+    monkeypatch.setattr(family_guy, 'fetch_source', fake_fetch)
+    monkeypatch.setattr(family_guy, 'get_tmp_size', lambda: 100)
+    queue = FakeQueue('abc')
+
+    sources = prefetch_sources(queue, lookahead=2, max_tmp=50)
+    assert next(sources)[0] == 'a'
+    assert queue.claimed == 1
+
+    assert [id for id, _ in sources] == ['b', 'c']
+
+
+def fake_upload_clip(index, id, threads, **clip_args):
+    """
+    Finishes the later parts first and fails part 2
+    """
+    sleep(0.05 * (5 - index))
+    if index == 2:
+        raise ClipCreationError(f'Failed to make clip {index + 1} for video {id}')
+
+
+def test_render_parts(monkeypatch):
+    """
+    Tests that a failed part is collected without stopping the others
+    """
+    started = []
+
+    def upload_clip(index, **clip_args):
+        started.append(index)
+        fake_upload_clip(index, **clip_args)
+
+    monkeypatch.setattr(family_guy, 'upload_clip', upload_clip)
+
+    failed = render_parts([0, 1, 2, 3, 4], jobs=5, id='a')
+
+    assert list(failed) == [2]
+    assert isinstance(failed[2], ClipCreationError)
+    assert sorted(started) == [0, 1, 2, 3, 4]
+
+
+def test_render_source_order(monkeypatch, tmp_path):
+    """
+    Tests that the information of the finished parts comes back in part order
+    """
+    monkeypatch.setattr(family_guy, 'upload_clip', fake_upload_clip)
+    monkeypatch.setattr(family_guy, 'remove_source', lambda id: None)
+
+    information = render_source(Source('a', 'Title', 50.0), 10, 0, None, str(tmp_path), jobs=5)
+
+    assert [row['part'] for row in information] == [1, 2, 4, 5]
+    assert information[0]['description'] == 'Part 1/5 of Title'
@@ -0,0 +1,90 @@
+"""
+Testing the filtergraph.py module
+"""
+import os
+
+import pytest
+
+from four_horsemen.family_guy import get_single_pass_template
+from four_horsemen.filtergraph import Filter, FilterGraph, FilterGraphError, Param, escape, filter_args
+from four_horsemen.multi_meme import get_filter_template
+
+
+def test_graph():
+    """
+    Tests that chains are joined with their pads and options are formatted
+    """
+    graph = FilterGraph(inputs=2)
+    top, = graph.chain(['0:v'], [Filter('scale', 1080, 810), None])
+    graph.chain([top, '1:v'], [Filter('vstack', inputs=2, shortest=True)], ['out'])
+    graph.chain(['1:a'], ['asetpts=PTS-STARTPTS', Filter('atrim', start=1.5, duration=Param('length'))], ['aout'])
+
+    template = graph.compile()
+    assert template.render(length=90.0) == \
+        '[0:v]scale=1080:810[s0];[s0][1:v]vstack=inputs=2:shortest=1[out];' \
+        '[1:a]asetpts=PTS-STARTPTS,atrim=start=1.5:duration=90[aout]'
+    assert template.get_map_args() == ['-map', '[out]', '-map', '[aout]']
+
+    with pytest.raises(FilterGraphError, match='length'):
+        template.render()
+
+
+@pytest.mark.parametrize('chains, error', [
+    ([(['0:v'], ['null'], ['a']), (['0:v'], ['null'], ['a'])], 'written more than once'),
+    ([(['0:v'], ['null'], ['1:v'])], 'input stream and cannot be written'),
+    ([(['0:v'], ['null'], ['a']), (['a'], ['null'], ['b']), (['a'], ['null'], ['c'])], 'read more than once'),
+    ([(['missing'], ['null'], ['a'])], 'never written'),
+    ([(['2:v'], ['null'], ['a'])], 'not one of the 2 inputs'),
+    ([(['0:v'], [], ['a'])], 'no filters'),
+])
+def test_validate(chains, error):
+    """
+    Tests that broken pads are caught before ffmpeg runs
+    """
+    graph = FilterGraph(inputs=2)
+    for inputs, filters, outputs in chains:
+        graph.chain(inputs, filters, outputs)
+
+    with pytest.raises(FilterGraphError, match=error):
+        graph.compile()
+
+
+def test_escape():
+    """
+    Tests that text is escaped for both the option and graph parsers
+    """
+    assert escape('gte(t,0)') == 'gte(t\\,0)'
+    assert escape("C:/it's") == "C\\\\:/it\\\\\\'s"
+
+
+def test_templates():
+    """
+    Tests that the generators compile a template once per layout and map every output
+    """
+    assert get_filter_template(3, True) is get_filter_template(3, True)
+    assert get_filter_template(3, True).params == {'x0', 'y0', 'x1', 'y1', 'x2', 'y2'}
+
+    template = get_single_pass_template(3, True)
+    assert template.params == {'duration', 'captions', 'number0', 'start0', 'number1', 'start1',
+                               'number2', 'start2'}
+    assert len(template.outputs) == 6
+
+
+def test_filter_script(tmp_path):
+    """
+    Tests that long graphs are passed as a script file which is removed after the command
+    """
+    with filter_args('[0:v]null[out]', str(tmp_path)) as args:
+        assert args == ['-filter_complex', '[0:v]null[out]']
+
+    graph = ';'.join(f'[{i}:v]null[o{i}]' for i in range(1000))
+    with filter_args(graph, str(tmp_path)) as (option, path), filter_args(graph, str(tmp_path)) as (_, other):
+        assert option == '-filter_complex_script'
+        assert open(path, encoding='utf-8').read() == graph
+        assert path != other
+
+    with pytest.raises(RuntimeError):
+        with filter_args(graph, str(tmp_path)):
+            raise RuntimeError('ffmpeg failed')
+
+    assert os.listdir(tmp_path) == []
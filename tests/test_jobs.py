@@ -0,0 +1,91 @@
+"""
+Testing the jobs.py module
+"""
+import socket
+
+from four_horsemen.jobs import JobQueue
+
+
+def test_claim(tmp_path):
+    """
+    Tests that two workers sharing a queue never claim the same source
+    """
+    path = str(tmp_path / 'jobs.db')
+    first, second = JobQueue(path), JobQueue(path)
+
+    assert first.add_sources(['a', 'b']) == 2
+    assert second.add_sources(['a', 'b']) == 0
+
+    assert {first.claim_source('one'), second.claim_source('two')} == {'a', 'b'}
+    assert first.claim_source('one') is None
+
+
+def test_resume(tmp_path):
+    """
+    Tests that a rerun only renders the parts which did not finish
+    """
+    path = str(tmp_path / 'jobs.db')
+    queue = JobQueue(path)
+    queue.add_sources(['a'])
+
+    assert queue.claim_source() == 'a'
+    queue.set_parts('a', 'Title', 3)
+    queue.finish_part('a', 0, 'output/a_0.mp4', 'Part 1/3 of Title')
+    queue.fail_part('a', 1, 'ffmpeg failed')
+    queue.finish_source('a')
+    queue.close()
+
+    queue = JobQueue(path)
+    assert queue.claim_source() == 'a'
+    queue.set_parts('a', 'Title', 3)
+    assert queue.pending_parts('a') == [1, 2]
+
+    queue.finish_part('a', 1, 'output/a_1.mp4', 'Part 2/3 of Title')
+    queue.finish_part('a', 2, 'output/a_2.mp4', 'Part 3/3 of Title')
+    queue.finish_source('a')
+
+    assert queue.claim_source() is None
+    assert queue.pending_parts('a') == []
+    assert queue.counts() == {'done': 1}
+
+
+def test_max_attempts(tmp_path):
+    """
+    Tests that a source which keeps failing is eventually given up on
+    """
+    queue = JobQueue(str(tmp_path / 'jobs.db'), max_attempts=2)
+    queue.add_sources(['a'])
+
+    for _ in range(2):
+        assert queue.claim_source() == 'a'
+        queue.fail_source('a', 'download failed')
+
+    assert queue.claim_source() is None
+
+
+def test_release(tmp_path):
+    """
+    Tests that a stopped worker's unfinished claims are picked up again straight away
+    """
+    queue = JobQueue(str(tmp_path / 'jobs.db'))
+    queue.add_sources(['a', 'b', 'c'])
+
+    assert [queue.claim_source('one'), queue.claim_source('one'), queue.claim_source('two')] == ['a', 'b', 'c']
+    queue.finish_source('a')
+
+    assert queue.release_sources('one') == 1
+    assert queue.claim_source('three') == 'b'
+    assert queue.claim_source('three') is None
+
+
+def test_dead_worker(tmp_path):
+    """
+    Tests that the claims of a worker which died on this host are taken over without waiting for the lease
+    """
+    queue = JobQueue(str(tmp_path / 'jobs.db'))
+    queue.add_sources(['a', 'b'])
+
+    assert queue.claim_source('elsewhere:1') == 'a'
+    assert queue.claim_source(f'{socket.gethostname()}:999999999') == 'b'
+    assert queue.claim_source() == 'b'
+    assert queue.claim_source() is None
@@ -0,0 +1,58 @@
+"""
+Testing the layout.py module
+"""
+import pytest
+
+from four_horsemen.layout import CANVASES, GRIDS, PRECOMPUTED_IMAGES, Layout, get_grid, get_layout, get_pos, \
+    pack_layout
+
+PORTRAIT = CANVASES['portrait']
+
+
+def test_get_layout():
+    """
+    Tests that layouts are cached and match laying out every image with get_pos
+    """
+    for canvas in CANVASES.values():
+        for count in range(1, PRECOMPUTED_IMAGES + 1):
+            layout = get_layout(count, canvas)
+            assert get_layout(count, canvas) is layout
+            assert layout.positions == tuple(
+                get_pos(i, count, layout.rows, layout.columns, canvas.area, canvas.center) for i in range(count)
+            )
+
+    assert get_layout(4) == Layout(2, 2, (400, 725), ((100, 75), (500, 75), (100, 800), (500, 800)))
+
+
+def test_get_grid():
+    """
+    Tests that every count fits its grid without an empty row
+    """
+    for count in range(1, 50):
+        rows, columns = get_grid(count, PORTRAIT.area)
+        assert rows * columns >= count > (rows - 1) * columns
+
+    assert get_grid(7) == GRIDS[7] == (3, 3)
+    assert get_grid(10, PORTRAIT.area) == (5, 2)
+
+    with pytest.raises(ValueError):
+        get_grid(0)
+
+
+def test_pack_layout():
+    """
+    Tests that tall images are put side by side and wide ones stacked
+    """
+    assert pack_layout([(1000, 300), (1000, 300)])[:2] == (2, 1)
+    assert pack_layout([(300, 1000), (300, 1000)])[:2] == (1, 2)
+    assert pack_layout([(300, 1000), (300, 1000)]).cell == (400, 1450)
+    assert pack_layout([(1000, 300)] * 3, CANVASES['landscape'])[:2] == (3, 1)
+
+
+def test_pack_layout_degenerate():
+    """
+    Tests that very thin images and images without a size still pack
+    """
+    layout = pack_layout([(2, 1000), (300, 300)])
+    assert layout.rows * layout.columns >= 2
+    assert pack_layout([(0, 0), (300, 300)]) == pack_layout([(300, 300), (300, 300)])
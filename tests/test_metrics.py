@@ -0,0 +1,56 @@
+"""
+Testing the metrics.py module
+"""
+import json
+
+import pytest
+
+from four_horsemen.metrics import Metrics
+
+
+def test_timer(tmp_path):
+    """
+    Tests that stages are timed, failures counted and events written as JSON lines
+    """
+    path = tmp_path / 'metrics.jsonl'
+    metrics = Metrics()
+    metrics.open(str(path))
+
+    with metrics.timer('download', id='a') as fields:
+        fields['bytes'] = 100
+    with metrics.timer('encode', id=7, part=3) as fields:
+        fields['fps'] = 75.0
+    with pytest.raises(ValueError):
+        with metrics.timer('download', id='b'):
+            raise ValueError('network')
+    metrics.observe('encode', 2.0, fps=100.0, speed=2.0)
+    metrics.observe('encode', 4.0, fps=50.0, speed=1.0)
+    metrics.count('parts_done', 2)
+
+    events = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(event['stage'], event['failed']) for event in events] == \
+        [('download', False), ('encode', False), ('download', True), ('encode', False), ('encode', False)]
+    assert (events[0]['id'], events[0]['bytes']) == ('a', 100)
+    assert (events[1]['id'], events[1]['part']) == (7, 3)
+
+    assert metrics.stages['download']['count'] == 2
+    assert metrics.stages['download']['failed'] == 1
+    assert metrics.stages['encode']['seconds'] >= 6.0
+    assert 'fps=75.00' in metrics.summary()
+    assert 'id=' not in metrics.summary() and 'part=' not in metrics.summary()
+
+
+def test_prometheus(tmp_path):
+    """
+    Tests the Prometheus textfile
+    """
+    path = tmp_path / 'metrics.prom'
+    metrics = Metrics()
+    metrics.observe('encode', 1.5, fps=60.0)
+    metrics.count('parts_done')
+    metrics.write_prometheus(str(path))
+
+    lines = path.read_text().splitlines()
+    assert 'four_horsemen_stage_seconds_total{stage="encode"} 1.500000' in lines
+    assert 'four_horsemen_stage_fps_mean{stage="encode"} 60.000000' in lines
+    assert 'four_horsemen_parts_done_total 1' in lines
@@ -1,42 +1,201 @@
 """
 Testing the multi_meme.py module
 """
-import unittest.mock as mock
+from time import sleep, time
 
+import numpy as np
+import pandas as pd
+
+from four_horsemen import multi_meme
 from four_horsemen.multi_meme import get_pos, get_post_layout
+from four_horsemen.store import RecordSink
 
 DIMS = (400, 800)
+CENTER = (200, 400) # centered, so positions are relative to the top left corner
 
 def test_get_pos():
     """
     Tests the get_pos function from multi_meme.py
     """
-    res = get_pos(0, 2, 2, 1, DIMS)
+    res = get_pos(0, 2, 2, 1, DIMS, CENTER)
     assert res == (0, 0)
 
-    res = get_pos(1, 2, 2, 1, DIMS)
+    res = get_pos(1, 2, 2, 1, DIMS, CENTER)
     assert res == (0, 400)
 
-    res = get_pos(2, 3, 2, 2, DIMS)
+    res = get_pos(2, 3, 2, 2, DIMS, CENTER)
     assert res == (100, 400)
 
-    res = get_pos(2, 4, 2, 2, DIMS)
+    res = get_pos(2, 4, 2, 2, DIMS, CENTER)
     assert res == (0, 400)
 
-    res = get_pos(3, 4, 2, 2, DIMS)
+    res = get_pos(3, 4, 2, 2, DIMS, CENTER)
     assert res == (200, 400)
 
 
-def test_get_post_layout():
+def test_get_pos_center():
+    """
+    Tests that positions move with the center of the layout
+    """
+    assert get_pos(0, 1, 1, 1, DIMS, (500, 800)) == (300, 400)
+
+
+def test_get_post_layout(monkeypatch):
     """
     Tests the get_post_layout function from multi_meme.py
     """
-    mocker = mock.Mock()
-    mocker.get_post_layout = get_post_layout
+    assert get_post_layout(DIMS, CENTER, 4) == [(0, 0), (200, 0), (0, 400), (200, 400)]
+
+    monkeypatch.setattr(multi_meme, 'get_rows_columns', lambda num_posts: (2, 3))
+    assert get_post_layout(DIMS, CENTER, 5) == [(0, 0), (133, 0), (266, 0), (66, 400), (199, 400)]
+
+
+class FakeBackgrounds:
+    """
+    Hands out a window of the same background, like BackgroundIndex.sample
+    """
+
+    def __init__(self):
+        self.lengths = []
+
+    def sample(self, length, rng=None):
+        self.lengths.append(length)
+        return 'background.mp4', 10.0
+
+    def sample_many(self, length, count, rng):
+        return np.array(['background.mp4'] * count, dtype=object), np.full(count, 10.0)
+
+
+def test_assign_batches():
+    """
+    Tests that batched videos share a background and audio with consecutive windows
+    """
+    info = [{'id': i, 'audio': f'{i}.mp3', 'length': length} for i, length in enumerate([5, 10, 15, 5, 5])]
+    backgrounds = FakeBackgrounds()
+    multi_meme.assign_batches(info, backgrounds, 3)
+
+    assert backgrounds.lengths == [30, 10]
+    assert [i['batch'] for i in info] == [0, 0, 0, 3, 3]
+    assert [i['background_start'] for i in info] == [10.0, 15.0, 25.0, 10.0, 15.0]
+    assert [i['audio'] for i in info] == ['0.mp3'] * 3 + ['3.mp3'] * 2
+
+    # Shuffled videos come back in the order of their windows
+    batches = multi_meme.get_batches(info[::-1] + [{'id': 9}])
+    assert [[i['id'] for i in batch] for batch in batches] == [[3, 4], [0, 1, 2], [9]]
+
+
+def test_batch_template():
+    """
+    Tests that every video of a batch gets its own outputs and parameters
+    """
+    template = multi_meme.get_batch_template((2, 1), scaled=True)
+
+    assert len(template.outputs) == 4
+    assert template.params == {'start0', 'length0', 'v0_x0', 'v0_y0', 'v0_x1', 'v0_y1',
+                               'start1', 'length1', 'v1_x0', 'v1_y0'}
+
+
+def test_make_info():
+    """
+    Tests that the plan is reproducible and only shows posts of the video's subreddit
+    """
+    frame = pd.DataFrame({'subreddit': ['b', 'a', 'b', 'a', 'b'], 'url': ['b0', 'a0', 'b1', 'a1', 'b2']})
+    info = multi_meme.make_info(frame, FakeBackgrounds(), ['sound.mp3'], 10, seed=0)
+
+    assert info == multi_meme.make_info(frame, FakeBackgrounds(), ['sound.mp3'], 10, seed=0)
+    assert len(info) == 2 * len(multi_meme.REQUESTYPES) * 10
+    assert len({i['id'] for i in info}) == len(info)
+    assert [i['subreddit'] for i in info[::10]] == ['a'] * 5 + ['b'] * 5
+
+    for i in info:
+        assert i['n'] == len(i['images']) == len(i['positions'])
+        assert all(url[0] == i['subreddit'] for url in i['images'])
+
+        layout = get_post_layout(multi_meme.DIMENSIONS['imgs'], multi_meme.DIMENSIONS['imgs_center'], i['n'])
+        for (x, y), (layout_x, layout_y) in zip(i['positions'], layout):
+            assert abs(x - layout_x - multi_meme.SMALLER) <= multi_meme.RAND_SHIFT
+            assert abs(y - layout_y - multi_meme.SMALLER) <= multi_meme.RAND_SHIFT
+
+
+def test_meta(tmp_path):
+    """
+    Tests that harvested posts read back the same from csv and from the streamed parquet
+    """
+    posts = [
+        {'id': str(i), 'subreddit': 'memes', 'title': f'post {i}', 'ups': i, 'downs': 0, 'upvote_ratio': 0.5,
+         'permalink': f'/r/memes/{i}', 'url': f'https://i.redd.it/{i}.png', 'from': 'hot'}
+        for i in range(5)
+    ]
+
+    path = str(tmp_path / 'meta.parquet')
+    buffer = multi_meme.PostBuffer(path, flush_rows=2)
+    for post in posts:
+        buffer.add(post)
+    frame = buffer.close()
+
+    assert frame.to_dict('records') == posts
+    assert multi_meme.read_meta(path).to_dict('records') == posts
+
+    path = str(tmp_path / 'meta.csv')
+    multi_meme.write_meta(frame, path)
+    assert multi_meme.read_meta(path).to_dict('records') == posts
+
+
+def test_randomized_audio(monkeypatch):
+    """
+    Tests that audio shorter than the window of a batch is looped instead of seeked before its start
+    """
+    monkeypatch.setattr(multi_meme, 'get_media_length', lambda path: 20.0)
+
+    args = multi_meme.get_randomized_audio('song.mp3', 15)
+    assert '-stream_loop' not in args
+    assert 0 <= float(args[args.index('-ss') + 1]) <= 5
+
+    assert multi_meme.get_randomized_audio('song.mp3', 60) == \
+        ['-stream_loop', '-1', '-ss', '0.000', '-t', '60.000', '-i', 'audios/song.mp3']
+
+
+def test_proxy_target():
+    """
+    Tests that only the portrait canvas reads the portrait proxies
+    """
+    assert multi_meme.get_proxy_target(multi_meme.CANVASES['portrait']) == 'multi_meme'
+    assert multi_meme.get_proxy_target(multi_meme.CANVASES['landscape']) is None
+    assert multi_meme.get_proxy_target(multi_meme.CANVASES['square']) is None
+
+
+def test_create_videos(monkeypatch, tmp_path):
+    """
+    Tests that every video is appended to its sink as soon as it finishes, and batches fail together
+    """
+    success_sink = RecordSink(str(tmp_path / 'success.jsonl'), key='id')
+    failed_sink = RecordSink(str(tmp_path / 'failed.jsonl'), key='id')
+    written = []
+
+    def render_video(info, download, *args):
+        # The last video waits until the ones before it reached the sinks, which is before create_videos returns
+        deadline = time() + 5
+        while info['id'] == 2 and len(success_sink.read()) + len(failed_sink.read()) < 2 and time() < deadline:
+            sleep(0.01)
+        written.append(len(success_sink.read()) + len(failed_sink.read()))
+        if info['id'] == 1:
+            raise multi_meme.VideoCreationError('Failed to create video for 1')
+
+    def render_batch(batch, downloads, *args):
+        raise multi_meme.VideoCreationError(f'Failed to create videos for batch {batch[0]["id"]}')
 
-    mocker.get_rows_columns.return_value = (2, 2)
+    monkeypatch.setattr(multi_meme, 'download_images', lambda urls: urls)
+    monkeypatch.setattr(multi_meme, 'render_video', render_video)
+    monkeypatch.setattr(multi_meme, 'render_batch', render_batch)
 
-    assert mocker.get_post_layout(DIMS, 4) == [(0, 0), (200, 0), (0, 400), (200, 400)]
+    info = [{'id': i, 'images': []} for i in range(3)]
+    info += [{'id': i, 'images': [], 'batch': 3, 'background_start': i} for i in (3, 4)]
+    success, failed = multi_meme.create_videos(info, str(tmp_path), jobs=1,
+                                               success_sink=success_sink, failed_sink=failed_sink)
 
-    mocker.get_rows_columns.return_value = (2, 3)
-    assert(mocker.get_post_layout(DIMS, 5) == [(0, 0), (133, 0), (266, 0), (66, 400), (199, 400)])
+    assert [i['id'] for i in success] == [0, 2]
+    assert sorted(i['id'] for i in failed) == [1, 3, 4]
+    assert written[-1] == 2
+    assert success_sink.read() == [{'id': 0, 'images': [], 'posted': False, 'posted_at': None},
+                                   {'id': 2, 'images': [], 'posted': False, 'posted_at': None}]
+    assert sorted(i['id'] for i in failed_sink.read()) == [1, 3, 4]
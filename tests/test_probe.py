@@ -0,0 +1,82 @@
+"""
+Testing the probe.py module
+"""
+import unittest.mock as mock
+
+from four_horsemen import cache, probe
+
+OUTPUT = {
+    'streams': [
+        {'index': 0, 'codec_name': 'h264', 'codec_type': 'video', 'width': 1920,
+         'height': 1080, 'avg_frame_rate': '30000/1001', 'disposition': {'attached_pic': 0}},
+        {'index': 1, 'codec_name': 'aac', 'codec_type': 'audio', 'avg_frame_rate': '0/0'},
+    ],
+    'format': {'duration': '12.500000'},
+}
+
+KEYFRAMES = {
+    'frames': [{'pts_time': '2.000000'}, {'pts_time': '0.000000'}, {'pts_time': 'N/A'}],
+}
+
+
+def test_parse_probe():
+    """
+    Tests that parse_probe reads every field from ffprobe's json
+    """
+    info = probe.parse_probe(OUTPUT)
+
+    assert info.duration == 12.5
+    assert (info.width, info.height) == (1920, 1080)
+    assert round(info.fps, 2) == 29.97
+    assert (info.video_codec, info.audio_codec) == ('h264', 'aac')
+    assert info.keyframes == ()
+
+
+def test_parse_keyframes():
+    """
+    Tests that keyframes are read from the separate keyframe query
+    """
+    assert probe.parse_keyframes(KEYFRAMES) == (0.0, 2.0)
+
+
+def test_parse_probe_cover_art():
+    """
+    Tests that cover art is not mistaken for the video stream of an audio file
+    """
+    info = probe.parse_probe({
+        'streams': [
+            {'index': 0, 'codec_name': 'mp3', 'codec_type': 'audio'},
+            {'index': 1, 'codec_name': 'png', 'codec_type': 'video', 'width': 500,
+             'height': 500, 'disposition': {'attached_pic': 1}},
+        ],
+        'format': {'duration': '60.0'},
+    })
+
+    assert (info.width, info.height, info.video_codec) == (0, 0, '')
+    assert info.audio_codec == 'mp3'
+
+
+def test_probe_cache(tmp_path, monkeypatch):
+    """
+    Tests that a file is probed once across the LRU and the disk cache
+    """
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    media = tmp_path / 'video.mp4'
+    media.write_bytes(b'video')
+
+    with mock.patch.object(probe, 'run_ffprobe', side_effect=lambda path, args=None, timeout=None:
+                           KEYFRAMES if args else OUTPUT) as run:
+        assert probe.probe(str(media)).duration == 12.5
+        assert probe.probe(str(media)).duration == 12.5
+        assert run.call_count == 1
+
+        probe._probe.cache_clear()
+        assert probe.probe(str(media)).keyframes == ()
+        assert run.call_count == 1
+
+        assert probe.probe(str(media), keyframes=True).keyframes == (0.0, 2.0)
+        assert run.call_count == 3
+
+        media.write_bytes(b'a different video')
+        probe.probe(str(media))
+        assert run.call_count == 4
@@ -0,0 +1,90 @@
+"""
+Testing the process.py module
+"""
+import os
+import sys
+
+import pytest
+
+from four_horsemen.process import ProcessError, parse_progress, run, run_ffmpeg
+
+PROGRESS = """frame=10
+fps=0.00
+speed=N/A
+progress=continue
+frame=300
+fps=145.20
+stream_0_0_q=28.0
+out_time_us=10000000
+speed=4.84x
+progress=end
+"""
+
+# Stands in for ffmpeg: reports two blocks of progress, then hangs when told to
+FAKE_FFMPEG = """#!{python}
+import sys, time
+for frame in (1, 2):
+    print(f'frame={{frame}}\\nfps=30.0\\nspeed=1.5x\\nprogress=continue', flush=True)
+print('bad input', file=sys.stderr, flush=True)
+if 'hang' in sys.argv:
+    time.sleep(30)
+sys.exit(1 if 'fail' in sys.argv else 0)
+"""
+
+
+@pytest.fixture
+def ffmpeg(tmp_path):
+    """
+    Path to the fake ffmpeg
+    """
+    path = tmp_path / 'ffmpeg'
+    path.write_text(FAKE_FFMPEG.format(python=sys.executable))
+    os.chmod(path, 0o755)
+    return str(path)
+
+
+def test_parse_progress():
+    """
+    Tests that the last values of ffmpeg's -progress output are read
+    """
+    assert parse_progress(PROGRESS) == {'frames': 300, 'fps': 145.2, 'speed': 4.84, 'out_time': 10.0}
+    assert parse_progress('') == {}
+
+
+def test_run():
+    """
+    Tests that output is captured and failures raise with stderr
+    """
+    result = run([sys.executable, '-c', 'print("a path with spaces")'])
+    assert result.ok and result.stdout.strip() == 'a path with spaces'
+
+    with pytest.raises(ProcessError, match='oops'):
+        run([sys.executable, '-c', 'import sys; sys.exit("oops")'])
+
+    assert run(['does-not-exist-anywhere'], check=False).returncode == 127
+
+
+def test_run_ffmpeg(ffmpeg):
+    """
+    Tests that progress is streamed to the callback and returned
+    """
+    updates = []
+    result = run_ffmpeg([ffmpeg, '-i', 'in put.mp4'], on_progress=updates.append)
+
+    assert result.argv[1:4] == ['-nostats', '-progress', 'pipe:1']
+    assert [update['frames'] for update in updates] == [1, 2]
+    assert result.progress == {'frames': 2, 'fps': 30.0, 'speed': 1.5}
+
+    with pytest.raises(ProcessError, match='bad input'):
+        run_ffmpeg([ffmpeg, 'fail'])
+
+
+def test_run_ffmpeg_stall(ffmpeg):
+    """
+    Tests that an encode which stops making progress is killed
+    """
+    result = run_ffmpeg([ffmpeg, 'hang'], stall_timeout=0.5, check=False)
+
+    assert not result.ok
+    assert result.killed.startswith('stalled')
+    assert result.seconds < 10
@@ -0,0 +1,43 @@
+"""
+Testing the profiles.py module
+"""
+import pytest
+
+from four_horsemen.profiles import PROFILES, get_encoder_args
+
+
+def test_get_encoder_args():
+    """
+    Tests that every profile becomes complete x264 options
+    """
+    args = get_encoder_args('draft', threads=4)
+    options = dict(zip(args[::2], args[1::2]))
+
+    assert options == {
+        '-c:v': 'libx264', '-preset': 'ultrafast', '-crf': '32', '-rc-lookahead': '0', '-g': '60',
+        '-pix_fmt': 'yuv420p', '-c:a': 'aac', '-b:a': '96k', '-threads': '4',
+    }
+
+    for profile in PROFILES:
+        args = get_encoder_args(profile)
+        assert args[args.index('-preset') + 1] == PROFILES[profile]['preset']
+        assert args[-2:] == ['-threads', '0']
+
+
+def test_tune(monkeypatch):
+    """
+    Tests that a tune is only passed when the profile has one
+    """
+    assert '-tune' not in get_encoder_args('archive')
+
+    monkeypatch.setitem(PROFILES, 'film', {**PROFILES['archive'], 'tune': 'film'})
+    args = get_encoder_args('film')
+    assert args[args.index('-tune') + 1] == 'film'
+
+
+def test_unknown_profile():
+    """
+    Tests that a misspelt profile fails before ffmpeg runs
+    """
+    with pytest.raises(ValueError, match='draft, balanced, archive'):
+        get_encoder_args('fast')
@@ -0,0 +1,74 @@
+"""
+Testing the proxies.py module
+"""
+import os
+import unittest.mock as mock
+
+from four_horsemen import backgrounds, cache, proxies
+from four_horsemen.cache import write_meta
+from four_horsemen.probe import MediaInfo
+
+INFO = MediaInfo(100.0, 1080, 1100, 30.0, 'h264', '', (0.0, 1.0, 2.0))
+
+
+def fake_proxy(background):
+    """
+    Writes a family_guy proxy of a background without running ffmpeg
+    """
+    proxy = proxies.get_proxy_path(background, 'family_guy')
+    os.makedirs(os.path.dirname(proxy), exist_ok=True)
+    with open(proxy, 'wb') as file:
+        file.write(b'proxy')
+    write_meta(f'{proxy}.json', proxies.get_proxy_meta(background, 'family_guy'))
+
+    return proxy
+
+
+def test_fresh_proxy(tmp_path):
+    """
+    Tests that a proxy is only used until its background changes
+    """
+    background = str(tmp_path / 'subway.mkv')
+    with open(background, 'wb') as file:
+        file.write(b'4k capture')
+
+    assert proxies.get_fresh_proxy(background, 'family_guy') is None
+
+    proxy = fake_proxy(background)
+    assert proxy == str(tmp_path / '.proxies' / 'family_guy' / 'subway.mp4')
+    assert proxies.get_fresh_proxy(background, 'family_guy') == proxy
+    assert proxies.get_fresh_proxy(background, 'multi_meme') is None
+
+    with open(background, 'wb') as file:
+        file.write(b'a longer 4k capture')
+    assert proxies.get_fresh_proxy(background, 'family_guy') is None
+
+
+def test_index_uses_proxy(tmp_path, monkeypatch):
+    """
+    Tests that the background index reads proxies where they are up to date
+    """
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    background = str(tmp_path / 'subway.mp4')
+    with open(background, 'wb') as file:
+        file.write(b'4k capture')
+
+    with mock.patch.object(backgrounds, 'probe', return_value=INFO) as probe:
+        index = backgrounds.BackgroundIndex(str(tmp_path), target='family_guy')
+        assert index.backgrounds[0].path == background
+
+        proxy = fake_proxy(background)
+        index.refresh()
+        assert index.backgrounds[0].path == proxy
+        assert probe.call_count == 2
+
+        # Without a generator the originals are used
+        assert backgrounds.BackgroundIndex(str(tmp_path)).backgrounds[0].path == background
+
+
+def test_fill_filter():
+    """
+    Tests that the fill filter crops to the aspect ratio before scaling
+    """
+    assert proxies.get_fill_filter(1080, 1100) == \
+        'crop=1080*min(iw/1080\\,ih/1100):1100*min(iw/1080\\,ih/1100),scale=1080:1100'
@@ -0,0 +1,71 @@
+"""
+Testing the srt.py module
+"""
+import os
+
+from four_horsemen.srt import xml_to_srt, iter_srt, write_srt, fmt_time
+
+XML = os.path.join(os.path.dirname(__file__), '..', 'text.xml')
+
+SAMPLE = """<?xml version="1.0" encoding="utf-8"?>
+<timedtext format="3">
+    <head><ws id="0" /></head>
+    <body>
+        <w t="0" id="1" />
+        <p t="1000" d="3000">
+            <s ac="200">hello</s>
+            <s t="1000" ac="200"> there</s>
+            <s t="2000" ac="200"> friend</s>
+        </p>
+        <p t="5000" w="1" a="1">
+</p>
+        <p t="6000" d="1500"><s>it&#39;s me</s></p>
+    </body>
+</timedtext>
+"""
+
+
+def test_xml_to_srt():
+    """
+    Tests that every paragraph with words becomes a caption
+    """
+    assert xml_to_srt(SAMPLE) == (
+        "1\n00:00:01,000 --> 00:00:04,000\nhello there friend\n\n"
+        "2\n00:00:06,000 --> 00:00:07,500\nit's me\n\n"
+    )
+
+
+def test_split_long_paragraph():
+    """
+    Tests that long paragraphs are split at word boundaries with word timings
+    """
+    cues = list(iter_srt(SAMPLE, max_len=10))
+
+    assert cues[0] == "1\n00:00:01,000 --> 00:00:03,000\nhello there\n\n"
+    assert cues[1] == "2\n00:00:03,000 --> 00:00:04,000\nfriend\n\n"
+
+
+def test_sources(tmp_path):
+    """
+    Tests that strings, bytes, paths and files give the same captions
+    """
+    with open(XML, 'r', encoding='utf-8') as f:
+        expected = xml_to_srt(f.read())
+
+    with open(XML, 'rb') as f:
+        assert "".join(iter_srt(f.read())) == expected
+    with open(XML, 'rb') as f:
+        assert "".join(iter_srt(f)) == expected
+
+    path = str(tmp_path / 'captions.srt')
+    assert write_srt(XML, path) == expected.count(' --> ')
+    with open(path, 'r', encoding='utf-8') as f:
+        assert f.read() == expected
+
+
+def test_fmt_time():
+    """
+    Tests that times are zero padded as SRT expects
+    """
+    assert fmt_time(0) == "00:00:00,000"
+    assert fmt_time(3723004) == "01:02:03,004"
@@ -0,0 +1,69 @@
+"""
+Testing the store.py module
+"""
+import pandas as pd
+
+from four_horsemen.store import RecordSink, get_sink_path
+
+
+def test_fold_updates(tmp_path):
+    """
+    Tests that later records are merged onto the first record with their key
+    """
+    sink = RecordSink(str(tmp_path / 'info.jsonl'), key='file_path')
+    sink.extend([
+        {'file_path': 'a.mp4', 'part': 1, 'uploaded': False},
+        {'file_path': 'b.mp4', 'part': 2, 'uploaded': False},
+    ])
+    sink.append({'file_path': 'a.mp4', 'uploaded': True})
+
+    assert sink.read() == [
+        {'file_path': 'a.mp4', 'part': 1, 'uploaded': True},
+        {'file_path': 'b.mp4', 'part': 2, 'uploaded': False},
+    ]
+
+
+def test_partial_line(tmp_path):
+    """
+    Tests that a line cut short by a crash is skipped
+    """
+    path = tmp_path / 'info.jsonl'
+    sink = RecordSink(str(path))
+    sink.append({'id': 1})
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"id": 2, "tit')
+
+    assert sink.read() == [{'id': 1}]
+
+
+def test_export(tmp_path):
+    """
+    Tests that the folded records are exported once
+    """
+    sink = RecordSink(str(tmp_path / 'info.jsonl'), key='id')
+    sink.extend([{'id': 1, 'posted': False}, {'id': 2, 'posted': False}, {'id': 2, 'posted': True}])
+    sink.export(str(tmp_path / 'info.csv'))
+
+    frame = pd.read_csv(tmp_path / 'info.csv')
+    assert frame['posted'].tolist() == [False, True]
+
+
+def test_clear(tmp_path):
+    """
+    Tests that a cleared sink starts over
+    """
+    sink = RecordSink(str(tmp_path / 'info.jsonl'), key='id')
+    sink.clear()
+    sink.append({'id': 1, 'posted': True})
+    sink.clear()
+    sink.append({'id': 1})
+
+    assert sink.read() == [{'id': 1}]
+
+
+def test_get_sink_path():
+    """
+    Tests that spreadsheets are appended to as a .jsonl file next to them
+    """
+    assert get_sink_path('info.xlsx') == 'info.jsonl'
+    assert get_sink_path('data/info.jsonl') == 'data/info.jsonl'
@@ -0,0 +1,83 @@
+"""
+Testing the uploader.py module
+"""
+from four_horsemen.store import RecordSink
+from four_horsemen.uploader import UploadStore
+
+
+def test_sync(tmp_path):
+    """
+    Tests that only records appended since the last sync are read
+    """
+    info = str(tmp_path / 'info.jsonl')
+    sink = RecordSink(info, key='file_path')
+    store = UploadStore(str(tmp_path / 'uploads.db'))
+
+    sink.extend([
+        {'file_path': 'a.mp4', 'description': 'A', 'uploaded': False},
+        {'file_path': 'b.mp4', 'description': 'B', 'uploaded': True},
+    ])
+    assert store.sync(info) == 2
+    assert store.sync(info) == 0
+    assert store.remaining() == 1
+
+    sink.append({'file_path': 'c.mp4', 'description': 'C', 'uploaded': False})
+    with open(info, 'a', encoding='utf-8') as file:
+        file.write('{"file_path": "d.mp4"') # a writer in the middle of a line
+
+    assert store.sync(info) == 1
+    assert store.remaining() == 2
+
+
+def test_claim(tmp_path):
+    """
+    Tests that overlapping runs never claim the same video
+    """
+    info = str(tmp_path / 'info.jsonl')
+    path = str(tmp_path / 'uploads.db')
+    RecordSink(info).extend([{'file_path': f'{i}.mp4', 'description': str(i)} for i in range(3)])
+
+    first, second = UploadStore(path), UploadStore(path)
+    first.sync(info)
+
+    claimed = first.claim(2, 'one') + second.claim(2, 'two')
+    assert sorted(video['file_path'] for video in claimed) == ['0.mp4', '1.mp4', '2.mp4']
+    assert second.claim(1, 'two') == []
+
+
+def test_posted(tmp_path):
+    """
+    Tests that released videos are retried and posted videos are not
+    """
+    info = str(tmp_path / 'info.jsonl')
+    store = UploadStore(str(tmp_path / 'uploads.db'))
+    RecordSink(info).extend([{'file_path': 'a.mp4'}, {'file_path': 'b.mp4'}])
+    store.sync(info)
+
+    first, second = store.claim(2)
+    store.mark_posted(first['file_path'])
+    store.release(second['file_path'], 'tiktok-uploader failed')
+
+    assert store.remaining() == 1
+    assert [video['file_path'] for video in store.claim(2)] == ['b.mp4']
+
+
+def test_attempts(tmp_path):
+    """
+    Tests that a video which keeps failing is tried after the others and then given up on
+    """
+    info = str(tmp_path / 'info.jsonl')
+    store = UploadStore(str(tmp_path / 'uploads.db'), max_attempts=2)
+    RecordSink(info).extend([{'file_path': 'a.mp4'}, {'file_path': 'b.mp4'}])
+    store.sync(info)
+
+    first, = store.claim()
+    store.release(first['file_path'], 'tiktok-uploader failed')
+    assert [video['file_path'] for video in store.claim()] == ['b.mp4']
+
+    store.release('b.mp4', 'tiktok-uploader failed')
+    assert [video['file_path'] for video in store.claim(2)] == ['a.mp4', 'b.mp4']
+
+    store.release('a.mp4', 'tiktok-uploader failed')
+    store.release('b.mp4', 'tiktok-uploader failed')
+    assert store.claim(2) == []
@@ -0,0 +1,59 @@
+"""
+Testing the utils.py module
+"""
+import unittest.mock as mock
+
+from four_horsemen import utils
+from four_horsemen.utils import get_retry_delay, get_with_backoff
+
+
+def make_response(status: int, headers: dict = None):
+    """
+    Makes a fake response
+    """
+    return mock.Mock(status_code=status, headers=headers or {})
+
+
+def test_get_retry_delay():
+    """
+    Tests that rate limited responses wait as long as the server asks, and everything else backs off
+    """
+    assert get_retry_delay(make_response(429, {'Retry-After': '7'}), 0) == 7.0
+    assert get_retry_delay(make_response(429, {'Retry-After': 'soon', 'x-ratelimit-reset': '12'}), 0) == 12.0
+    assert get_retry_delay(make_response(429), 2) == utils.BACKOFF * 4
+    assert get_retry_delay(make_response(503, {'Retry-After': '7'}), 1) == utils.BACKOFF * 2
+
+
+def test_get_with_backoff(monkeypatch):
+    """
+    Tests that rate limited and failed requests are retried after the right delay
+    """
+    session = mock.Mock()
+    session.get.side_effect = [
+        make_response(429, {'x-ratelimit-reset': '3'}),
+        make_response(502),
+        make_response(200, {'x-ratelimit-remaining': '0', 'x-ratelimit-reset': '5'}),
+    ]
+    sleeps = []
+    monkeypatch.setattr(utils, 'SESSION', session)
+    monkeypatch.setattr(utils, 'sleep', sleeps.append)
+
+    assert get_with_backoff('https://www.reddit.com/r/memes.json', timeout=1).status_code == 200
+    assert session.get.call_count == 3
+    # The last sleep waits out the rate limit window the final response used up
+    assert sleeps == [3.0, utils.BACKOFF * 2, 5.0]
+
+
+def test_get_with_backoff_gives_up(monkeypatch):
+    """
+    Tests that a host which keeps failing is retried RETRIES times and the last response returned
+    """
+    session = mock.Mock()
+    session.get.return_value = make_response(500)
+    sleeps = []
+    monkeypatch.setattr(utils, 'SESSION', session)
+    monkeypatch.setattr(utils, 'sleep', sleeps.append)
+
+    assert get_with_backoff('https://www.reddit.com/r/memes.json').status_code == 500
+    assert session.get.call_count == utils.RETRIES + 1
+    assert sleeps == [utils.BACKOFF * 2 ** attempt for attempt in range(utils.RETRIES)]